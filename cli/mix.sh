@@ -0,0 +1,41 @@
+#!/bin/bash
+set -ex
+
+# レポジトリの絶対パスをコマンドライン引数REPO_APTHとして渡す
+# 比率は GENUINE_RATIO, SYNTHETIC_RATIO で指定する (例 GENUINE_RATIO=2 SYNTHETIC_RATIO=1)
+for ARGUMENT in "$@"
+do
+    KEY=$(echo $ARGUMENT | cut -f1 -d=)
+
+    KEY_LENGTH=${#KEY}
+    VALUE="${ARGUMENT:$KEY_LENGTH+1}"
+
+    export "$KEY"="$VALUE"
+done
+
+GENUINE_RATIO=${GENUINE_RATIO:-1}
+SYNTHETIC_RATIO=${SYNTHETIC_RATIO:-1}
+ENCODE="$REPO_PATH/scripts/encode.py"
+MIX="$REPO_PATH/scripts/mix_corpus.py"
+
+# 合成コーパスは、genuine の SentencePiece モデルと辞書を用いて一度だけエンコード・バイナリ化する
+# (pre-process.sh を実行して bpe.model と data-bin を作成しておく)
+if [ ! -d data-bin-synthetic ]; then
+    python $ENCODE --model bpe.model < $REPO_PATH/corpus/synthetic_bilingual/train.en > train_syn.en
+    python $ENCODE --model bpe.model < $REPO_PATH/corpus/synthetic_bilingual/train.ja > train_syn.ja
+
+    fairseq-preprocess -s en -t ja \
+        --trainpref train_syn \
+        --destdir data-bin-synthetic \
+        --srcdict data-bin/dict.en.txt \
+        --tgtdict data-bin/dict.ja.txt \
+        --workers 16
+
+    rm train_syn.en train_syn.ja
+fi
+
+# ファイルを複製せずに、索引だけを比率に応じて作成する
+# Tagged Back-Translation を行う場合は、合成コーパスの指定の末尾に :tag を付ける
+python $MIX -s en -t ja --destdir data-bin-mixed \
+    --source data-bin:$GENUINE_RATIO \
+    --source data-bin-synthetic:$SYNTHETIC_RATIO:tag
@@ -16,13 +16,23 @@ done
 TRAIN_SP="$REPO_PATH/scripts/train_sp.py"
 ENCODE="$REPO_PATH/scripts/encode.py"
 
-#TEST_EN_MONO="$REPO_PATH/corpus/monolingual/test.en"
-TEST_JA_MONO="$REPO_PATH/corpus/monolingual/test.ja"
+# 単言語のデータは corpus/src/mono_dataset.py によって monotext1.ja, monotext2.ja, ... に分けて保存され、
+# その一覧が manifest.json に記録されている
+MONO_DIR="$REPO_PATH/corpus/monolingual"
+MONO_MANIFEST="$MONO_DIR/manifest.json"
+if [ ! -f "$MONO_MANIFEST" ]; then
+    echo "$MONO_MANIFEST not found. Run corpus/src/mono_dataset.py first." >&2
+    exit 1
+fi
 
 # 学習済みのSentencePieceを用いて各データセットをエンコードする
 encode () {
     python $ENCODE --model bpe.model
 }
 
-#encode < $TEST_EN_MONO >  $REPO_PATH/corpus/monolingual/test_mono_00.en
-encode < $TEST_JA_MONO > $REPO_PATH/corpus/monolingual/test_mono_00.ja
+# マニフェストに記録されている各ファイルをエンコードする (例 monotext1.ja => monotext1_sp.ja)
+MONO_LANG=$(python -c "import json, sys; print(json.load(open(sys.argv[1]))['lang'])" "$MONO_MANIFEST")
+for NAME in $(python -c "import json, sys; print(' '.join(s['name'] for s in json.load(open(sys.argv[1]))['shards']))" "$MONO_MANIFEST")
+do
+    encode < "$MONO_DIR/$NAME.$MONO_LANG" > "$MONO_DIR/${NAME}_sp.$MONO_LANG"
+done
@@ -54,3 +54,7 @@ fairseq-preprocess -s en -t ja \
     --destdir data-bin \
     --joined-dictionary \
     --workers 16
+
+# 推論時の語彙のショートリストを作成する (Translation.load の shortlist に指定する)
+python $REPO_PATH/scripts/shortlist.py -s en -t ja --trainpref train --data data-bin --output shortlist.en-ja.npz
+python $REPO_PATH/scripts/shortlist.py -s ja -t en --trainpref train --data data-bin --output shortlist.ja-en.npz
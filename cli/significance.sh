@@ -0,0 +1,22 @@
+#!/bin/bash
+set -ex
+
+# レポジトリの絶対パスをコマンドライン引数REPO_APTHとして渡す
+# ベースライン(BASELINE)と逆翻訳を用いたモデル(SYSTEM)の test.sh の出力(output.txt)の BLEU の差を、ペアブートストラップ法で検定する
+for ARGUMENT in "$@"
+do
+    KEY=$(echo $ARGUMENT | cut -f1 -d=)
+
+    KEY_LENGTH=${#KEY}
+    VALUE="${ARGUMENT:$KEY_LENGTH+1}"
+
+    export "$KEY"="$VALUE"
+done
+
+cd $REPO_PATH/scripts
+python significance.py \
+    --reference $REPO_PATH/corpus/genuine_bilingual/test.ja \
+    --baseline $BASELINE \
+    --systems $SYSTEM \
+    --resamples 1000 \
+    | tee $REPO_PATH/significance.log
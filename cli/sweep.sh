@@ -0,0 +1,26 @@
+#!/bin/bash
+set -ex
+
+# レポジトリの絶対パスをコマンドライン引数REPO_APTHとして渡す
+# test.sh の --beam と --lenpen を調整するときに、全ての組み合わせを一度の実行で評価する
+for ARGUMENT in "$@"
+do
+    KEY=$(echo $ARGUMENT | cut -f1 -d=)
+
+    KEY_LENGTH=${#KEY}
+    VALUE="${ARGUMENT:$KEY_LENGTH+1}"
+
+    export "$KEY"="$VALUE"
+done
+
+cd $REPO_PATH/scripts
+python sweep.py --src en --tgt ja \
+    --checkpoint_dir $REPO_PATH/checkpoints \
+    --checkpoint_file checkpoint_last.pt \
+    --data $REPO_PATH/data-bin \
+    --bpe_model $REPO_PATH/bpe.model \
+    --input $REPO_PATH/corpus/genuine_bilingual/test.en \
+    --reference $REPO_PATH/corpus/genuine_bilingual/test.ja \
+    --beam 1 3 5 \
+    --lenpen 0.6 0.8 1.0 1.2 \
+    | tee $REPO_PATH/sweep.log
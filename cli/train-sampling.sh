@@ -0,0 +1,63 @@
+#!/bin/bash
+set -ex
+
+# レポジトリの絶対パスをコマンドライン引数REPO_APTHとして渡す
+# SentencePiece の分割を学習中にサンプリングする (ALPHA で平滑化パラメータを指定する 例 ALPHA=0.1)
+# pre-process.sh を実行して bpe.model と data-bin (辞書) を作成しておく
+for ARGUMENT in "$@"
+do
+    KEY=$(echo $ARGUMENT | cut -f1 -d=)
+
+    KEY_LENGTH=${#KEY}
+    VALUE="${ARGUMENT:$KEY_LENGTH+1}"
+
+    export "$KEY"="$VALUE"
+done
+
+ALPHA=${ALPHA:-0.1}
+
+# 生のテキストは corpus/genuine_bilingual から直接読み込むので、エポックごとにエンコードし直す必要はない
+fairseq-train \
+    data-bin \
+    --user-dir $REPO_PATH/scripts/sp_sampling \
+    --task translation_sp_sampling \
+    -s en -t ja \
+    --raw-data $REPO_PATH/corpus/genuine_bilingual \
+    --sp-model bpe.model \
+    --sp-alpha $ALPHA \
+    --num-workers 4 \
+    --fp16 \
+    --save-interval 10 \
+    --log-interval 1 \
+    --log-format simple \
+    --max-epoch 120 \
+    --update-freq 1 \
+    --max-update 30000 \
+    --max-tokens 4000 \
+    --arch bart_base \
+    --encoder-normalize-before \
+    --decoder-normalize-before \
+    --encoder-embed-dim 512 \
+    --encoder-ffn-embed-dim 4096 \
+    --encoder-attention-heads 8 \
+    --encoder-layers 8 \
+    --decoder-embed-dim 512 \
+    --decoder-ffn-embed-dim 4096 \
+    --decoder-attention-heads 8 \
+    --decoder-layers 8 \
+    --share-all-embeddings \
+    --dropout 0.3 \
+    --attention-dropout 0.0 \
+    --activation-dropout 0.0 \
+    --activation-fn gelu \
+    --optimizer adam \
+    --adam-betas '(0.9, 0.999)' \
+    --lr 0.0015 \
+    --lr-scheduler inverse_sqrt \
+    --warmup-updates 4000 \
+    --warmup-init-lr 1e-07 \
+    --clip-norm 1.0 \
+    --weight-decay 0.0001 \
+    --criterion label_smoothed_cross_entropy \
+    --label-smoothing 0.3 \
+    | tee train.log
@@ -1,130 +1,251 @@
-from inspect import cleandoc
 import unicodedata
-from pkg_resources import yield_lines
-from tqdm import tqdm
 import re
 import regex
 import multiprocessing as mp
 import os
+import json
+import signal
+import threading
+import time
+import script_classifier as sc
 
 
-def is_en(sents):
-    en = re.compile("""[a-zA-Z   # アルファベット
-                        0-9      # アラビア数字
-                        \u2160-\u2188   # ローマ数字
-                        \u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E   # ASCII記号の半角版
-    ]+""")
-
-    en_tf_ls = []
-    for sent in sents:
-        if en.fullmatch(sent) is None:
-            en_tf_ls.append(False)
-        else:
-            en_tf_ls.append(True)
-    return en_tf_ls
-
-
-def is_ja(sents):
-    ja = regex.compile("""[\u3041-\u309F                    # ひらがな
-                            \u30A1-\u30FF\uFF66-\uFF9F      # カタカナ
-                            0-9０-９                        # アラビア数字
-                            \p{Numeric_Type=Numeric}        # 漢数字、ローマ数字
-                            \p{Script_Extensions=Han}       # 漢字
-                            # ASCII文字(記号)の半角版
-                            \u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E
-                            # ASCII文字(記号)全角版と日本語の記号の半角版
-                            \uFF01-\uFF0F\uFF1A-\uFF20\uFF3B-\uFF40\uFF5B-\uFF65\u3000-\u303F
-    ]+""")
-
-    ja_tf_ls = []
-    for sent in sents:
-        if ja.fullmatch(sent) is None:
-            ja_tf_ls.append(False)
-        else:
-            ja_tf_ls.append(True)
-    return ja_tf_ls
-
-
-def rm_noise(en_sents, ja_sents, en_q, ja_q):
+def is_en(sents, threshold=1.0):
     """
-    正規表現を用いてデータセットに含まれるノイズ(記号, URL, メールアドレス, etc...)を除去する関数
-    高速化のため、正規表現のパターンを事前にコンパイルしておく。
-
-    同じ機能を実現するための正規表現のパターンは一通りではなく、いくつも考えられる。
-    しかし、パターンによってはプログラムを意図せず停止させてしまうことがあるから、
-    新しい機能をこの関数に追加するときは、十分にテストする。
-    """
-    brackets = re.compile(r"""\<.*?\>|\{.*?\}|\(.*?\)|\[.*?\]|   # 括弧（半角）
-                            |【.*?】|（.*?）|〈.*?〉|《.*?》|「.*?」|『.*?』|【.*?】|                # 括弧（全角）
-                            |〔.*?〕|〖.*?〗|〘.*?〙|〚.*?〛|｛.*?｝|＜.*?＞|｛.*?｝|｟.*?｠|＜.*?＞  # 括弧（全角）
-                            """)
-    unwanted = re.compile(
-        r"[*#^\「\」\『\』\〈\〉:;\<\>\{\}\"\(\)\[\]]+")   # 間違って 空白を入れてしまわないように注意する
-    msc = re.compile(r"\\\\|\t|\\\\t|\r|\\\\r")
-    newlines = re.compile(r"\\\n|\n")
-    urls = re.compile(
-        r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
-    email = re.compile(
-        r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-    )
-    encoding_err = re.compile("0000,0000,0000,\w*?")
-    multi_space = re.compile("[ 　]{2,}")
-    emoji = regex.compile("\p{Emoji_Presentation=Yes}+")
-    hiragana_rare = re.compile(
-        "[\U0001B001-\U0001B11F\U0001B150-\U0001B152\U0001F200]+")
-    katakana_rare = re.compile(
-        "[\u31F0-\u31FF\u32D0-\u32FE\u3300-\u3357\U0001AFF0-\U0001AFFE\U0001B000\U0001B120-\U0001B122\U0001B164-\U0001B167]+")
-
-    cleaned_en, cleaned_ja = [], []
-    print("Start denoising sentences... (Process ID: {})".format(os.getpid()))
-
-    for en_sent, ja_sent in zip(en_sents, ja_sents):
-        en_sent = unicodedata.normalize("NFKC", en_sent).strip()
-        ja_sent = unicodedata.normalize("NFKC", ja_sent).strip()
-        en_sent = urls.sub('', en_sent)
-        ja_sent = urls.sub('', ja_sent)
-
-        en_sent = email.sub('', en_sent)
-        ja_sent = email.sub('', ja_sent)
-
-        en_sent = msc.sub(' ', en_sent)
-        ja_sent = msc.sub(' ', ja_sent)
-
-        en_sent = newlines.sub('', en_sent)
-        ja_sent = newlines.sub('', ja_sent)
+    各文が英文かどうかを判定する関数
+    英文として許容される文字の割合が threshold 以上の文を英文とみなす。
+    (threshold=1.0 のときは、すべての文字が許容される文字である場合のみ英文とみなす)
+    """
+    return sc.classify(sents, "en", threshold).tolist()
 
-        en_sent = emoji.sub('', en_sent)
-        ja_sent = emoji.sub('', ja_sent)
 
-        en_sent = brackets.sub('', en_sent)
-        ja_sent = brackets.sub('', ja_sent)
+def is_ja(sents, threshold=1.0):
+    """
+    各文が和文かどうかを判定する関数
+    和文として許容される文字の割合が threshold 以上の文を和文とみなす。
+    (threshold=1.0 のときは、すべての文字が許容される文字である場合のみ和文とみなす)
+    """
+    return sc.classify(sents, "ja", threshold).tolist()
+
+
+# ノイズを除去するための正規表現 (高速化のため、パターンを事前にコンパイルしておく)
+#
+# 同じ機能を実現するための正規表現のパターンは一通りではなく、いくつも考えられる。
+# しかし、パターンによってはプログラムを意図せず停止させてしまうことがあるから、
+# 新しいパターンを追加するときは、十分にテストする。
+# (scripts/bench_cleaning.py で、各パターンの処理時間が文の長さに比例することを確かめられる)
+#
+# 次のようなパターンは、長い文で処理時間が文の長さの2乗以上に増えることがあるので用いない。
+#   - 同じ文字にマッチする選択肢を繰り返すもの     例: (?:[a-zA-Z]|[$-_])+
+#   - 開始位置ごとに文末まで探索しうるもの         例: \(.*?\)  ("(" が多く、")" がない文)
+#   - 長さに上限のない繰り返しの後に、失敗しうる部分が続くもの  例: [A-Za-z0-9._%+-]+@
+unwanted = re.compile(
+    r"[*#^\「\」\『\』\〈\〉:;\<\>\{\}\"\(\)\[\]]+")   # 間違って 空白を入れてしまわないように注意する
+msc = re.compile(r"\\\\|\t|\\\\t|\r|\\\\r")
+newlines = re.compile(r"\\\n|\n")
+# 以前の (?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+ と同じ文字の集合を、一つの文字クラスで表す
+# ([$-_] は "$" から "_" までの範囲で、数字、大文字、"%" などを含む)
+urls = re.compile(r"https?://[!$-_a-z]+")
+# ローカル部とドメインの長さの上限は RFC 5321 に従う
+email = re.compile(
+    r"\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,255}\.[A-Z|a-z]{2,}\b"
+)
+encoding_err = re.compile("0000,0000,0000,\w*?")
+multi_space = re.compile("[ 　]{2,}")
+emoji = regex.compile("\p{Emoji_Presentation=Yes}+")
+hiragana_rare = re.compile(
+    "[\U0001B001-\U0001B11F\U0001B150-\U0001B152\U0001F200]+")
+katakana_rare = re.compile(
+    "[\u31F0-\u31FF\u32D0-\u32FE\u3300-\u3357\U0001AFF0-\U0001AFFE\U0001B000\U0001B120-\U0001B122\U0001B164-\U0001B167]+")
+
+# 取り除く括弧 (開き括弧: 閉じ括弧)
+BRACKETS = {"<": ">", "{": "}", "(": ")", "[": "]",
+            "【": "】", "（": "）", "〈": "〉", "《": "》", "「": "」", "『": "』",
+            "〔": "〕", "〖": "〗", "〘": "〙", "〚": "〛", "｛": "｝", "＜": "＞", "｟": "｠"}
+openers = re.compile("[" + re.escape("".join(BRACKETS)) + "]")
+
+
+def rm_brackets(sent):
+    """
+    括弧とその中身を取り除く関数
+    正規表現 \(.*?\)|\[.*?\]|... による置換と同じ結果を返すが、
+    閉じ括弧が見つからなかった種類の括弧は、それ以降探さないので、処理時間は文の長さに比例する。
+    """
+    if '\n' in sent:
+        # . は改行にマッチしないので、括弧が行をまたぐことはない
+        return '\n'.join(rm_brackets(line) for line in sent.split('\n'))
+
+    pieces, head, pos, unclosed = [], 0, 0, set()
+    while True:
+        m = openers.search(sent, pos)
+        if m is None:
+            break
+        start = m.start()
+        pos = start + 1
+        opener = sent[start]
+        if opener in unclosed:
+            continue
+        end = sent.find(BRACKETS[opener], pos)
+        if end < 0:
+            unclosed.add(opener)
+            continue
+        pieces.append(sent[head:start])
+        head = pos = end + 1
+    pieces.append(sent[head:])
+    return ''.join(pieces)
+
+
+def denoise_sent(sent, ja=False):
+    """
+    一文から正規表現を用いてノイズを除去する関数 (NFKC 正規化もここで一度だけ行う)
+    ja=True のときは、和文にのみ含まれるノイズ(まれにしか使われない仮名など)も除去する。
+    """
+    sent = unicodedata.normalize("NFKC", sent).strip()
+    sent = urls.sub('', sent)
+    if '@' in sent:
+        sent = email.sub('', sent)
+    sent = msc.sub(' ', sent)
+    sent = newlines.sub('', sent)
+    sent = emoji.sub('', sent)
+    sent = rm_brackets(sent)
+    sent = unwanted.sub('', sent)
+    if ja:
+        sent = hiragana_rare.sub('', sent)
+        sent = katakana_rare.sub('', sent)
+    sent = multi_space.sub(' ', sent)
+    sent = encoding_err.sub('', sent)
+    return sent.strip()
+
+
+class CleaningTimeout(Exception):
+    pass
+
+
+class TimeBudget():
+    """
+    with 文の中の処理が budget 秒を超えたときに、CleaningTimeout を送出するクラス
+    SIGALRM を用いるので、メインスレッドでのみ有効になる。(それ以外のスレッドでは何もしない)
+    (re による照合の途中でも、シグナルを受け取ると中断される。bench_cleaning.py --budget_check を参照)
 
-        en_sent = unwanted.sub('', en_sent)
-        ja_sent = unwanted.sub('', ja_sent)
+    タイマーは start で一度だけ設定し、以降は budget / 2 秒ごとに SIGALRM を受け取る。
+    with 文ではペアの処理を始めた時刻を記録するだけで、シグナルを受け取ったときに経過時間を確認する。
+    (ペアごとにシステムコールを呼ばない代わりに、budget 秒を超えてから中断されるまでに最大で budget / 2 秒かかる)
+    """
 
-        ja_sent = hiragana_rare.sub('', ja_sent)
-        ja_sent = katakana_rare.sub('', ja_sent)
+    def __init__(self, budget):
+        self.budget = budget
+        self.enabled = bool(budget) and threading.current_thread() is threading.main_thread()
+        self.began = None
+        self.prev = None
+
+    def on_alarm(self, signum, frame):
+        # ペアを処理していないとき(処理が終わった直後を含む)や、経過時間が budget 未満のときは何もしない
+        if self.began is not None and time.monotonic() - self.began >= self.budget:
+            self.began = None
+            raise CleaningTimeout()
+
+    def start(self):
+        if self.enabled:
+            try:
+                self.prev = signal.signal(signal.SIGALRM, self.on_alarm)
+            except ValueError:
+                # シグナルハンドラを設定できない(メインインタプリタのメインスレッドでない)ときは、上限を設けない
+                self.enabled = False
+                return self
+            interval = self.budget / 2
+            signal.setitimer(signal.ITIMER_REAL, interval, interval)
+        return self
+
+    def stop(self):
+        if self.enabled:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.prev)
+
+    def __enter__(self):
+        self.began = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.began = None
+        return False
+
+
+def quarantine_pair(path, en_sent, ja_sent):
+    """
+    処理時間の上限を超えたペアを、path に JSON Lines として追記する関数
+    (一度の write で書き込むので、複数のプロセスから追記しても行が混ざらない)
+    """
+    line = json.dumps({"en": en_sent, "ja": ja_sent}, ensure_ascii=False) + '\n'
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
 
-        en_sent = multi_space.sub(' ', en_sent)
-        ja_sent = multi_space.sub(' ', ja_sent)
 
-        en_sent = encoding_err.sub('', en_sent)
-        ja_sent = encoding_err.sub('', ja_sent)
+def denoise(en_sents, ja_sents, budget=None, quarantine=None):
+    """
+    正規表現を用いてデータセットに含まれるノイズ(記号, URL, メールアドレス, etc...)を除去する関数
+    budget:     1ペアあたりの処理時間の上限(秒)。超えたペアは隔離し、両方の文を空文に置き換える。(後の判定で取り除かれる)
+                None または 0 のときは上限を設けない。
+    quarantine: 隔離したペアを追記するファイルのパス (None のときは書き出さない)
+    """
+    # タイマーはチャンク(またはワーカー)ごとに一度だけ設定する
+    timer = TimeBudget(budget).start()
+    if not timer.enabled:
+        cleaned_en = [denoise_sent(en_sent) for en_sent in en_sents]
+        cleaned_ja = [denoise_sent(ja_sent, ja=True) for ja_sent in ja_sents]
+        return cleaned_en, cleaned_ja
 
-        cleaned_en.append(en_sent.strip())
-        cleaned_ja.append(ja_sent.strip())
+    cleaned_en, cleaned_ja = [], []
+    try:
+        for en_sent, ja_sent in zip(en_sents, ja_sents):
+            try:
+                with timer:
+                    en, ja = denoise_sent(en_sent), denoise_sent(ja_sent, ja=True)
+            except CleaningTimeout:
+                print("A pair exceeded the time budget of cleaning ({} seconds) and was quarantined: en {} chars, ja {} chars".format(
+                    budget, len(en_sent), len(ja_sent)))
+                if quarantine:
+                    quarantine_pair(quarantine, en_sent, ja_sent)
+                en, ja = '', ''
+            cleaned_en.append(en)
+            cleaned_ja.append(ja)
+    finally:
+        timer.stop()
+    return cleaned_en, cleaned_ja
+
+
+def rm_noise(idx, en_sents, ja_sents, queue, budget=None, quarantine=None):
+    print("Start denoising sentences... (Process ID: {})".format(os.getpid()))
+    cleaned_en, cleaned_ja = denoise(en_sents, ja_sents, budget, quarantine)
+    # 英文と和文は同じキューに入れる (別々のキューに入れると、異なるプロセスの結果が組み合わされることがある)
+    queue.put((idx, cleaned_en, cleaned_ja))
+    print("Finished denoising sentences... (Process ID: {})".format(os.getpid()))
 
-    en_q.put(cleaned_en)
-    ja_q.put(cleaned_ja)
 
-    print("Finished denoising sentences... (Process ID: {})".format(os.getpid()))
+def clean_pairs(en_sents, ja_sents, script_thld=1.0, budget=None, quarantine=None):
+    """
+    ノイズを除去したうえで、英文・和文として許容される文字の割合が script_thld 以上のペアのみを返す関数
+    (パイプライン処理の1ステージとして、小分けにしたペアごとに呼び出される)
+    budget と quarantine は denoise 関数を参照
+    """
+    cleaned_en, cleaned_ja = denoise(en_sents, ja_sents, budget, quarantine)
+    en_ls, ja_ls = [], []
+    for en, ja, en_tf, ja_tf in zip(cleaned_en, cleaned_ja, is_en(cleaned_en, script_thld), is_ja(cleaned_ja, script_thld)):
+        if en_tf and ja_tf:
+            en_ls.append(en)
+            ja_ls.append(ja)
+    return en_ls, ja_ls
 
 
-def clean(en_sents, ja_sents, workers=1):
+def clean(en_sents, ja_sents, workers=1, script_thld=1.0, budget=None, quarantine=None):
     """
     正規表現を用いてデータセットに含まれる各種のノイズ(記号, URL, メールアドレス, etc...)を除去するジェネレータ関数
     また、日英以外の言語の文も発見次第除去する。
+    (英文・和文として許容される文字の割合が script_thld 未満の文を、日英以外の言語の文とみなす)
     マルチプロセス対応済み(引数 workers を用いてプロセス数を指定する)
+    処理時間が budget 秒を超えたペアは、取り除いて quarantine に書き出す。(denoise 関数を参照)
     """
     min_workers = 1
     max_workers = 8
@@ -132,27 +253,27 @@ def clean(en_sents, ja_sents, workers=1):
     workers = 1 if workers < min_workers or workers > max_workers or workers > num_sents else workers
     size = int(num_sents/workers)
 
-    en_q = mp.Queue()
-    ja_q = mp.Queue()
+    queue = mp.Queue()
 
     tgt_fun = rm_noise
     for idx in range(workers):
         head = idx * size
         tail = (idx+1) * size if idx != (workers-1) else num_sents
         proc = mp.Process(target=tgt_fun, args=[
-                          en_sents[head:tail], ja_sents[head:tail], en_q, ja_q])
+                          idx, en_sents[head:tail], ja_sents[head:tail], queue, budget, quarantine])
         proc.start()
 
+    # 結果は終了した順に届くので、元の順序に並べ直す
+    results = sorted(queue.get() for _ in range(workers))
     cleaned_en, cleaned_ja = [], []
-    for _ in range(workers):
-        for en_sent, ja_sent in zip(en_q.get(), ja_q.get()):
-            cleaned_en.append(en_sent)
-            cleaned_ja.append(ja_sent)
+    for _, en_sents, ja_sents in results:
+        cleaned_en.extend(en_sents)
+        cleaned_ja.extend(ja_sents)
 
     print("\nChecking if downloaded sentences are truly English or Japanese sentences...")
 
     en_ls, ja_ls = [], []
-    for idx, (en_tf, ja_tf) in enumerate(zip(is_en(cleaned_en), is_ja(cleaned_ja))):
+    for idx, (en_tf, ja_tf) in enumerate(zip(is_en(cleaned_en, script_thld), is_ja(cleaned_ja, script_thld))):
         if en_tf and ja_tf:
             en_ls.append(cleaned_en[idx])
             ja_ls.append(cleaned_ja[idx])
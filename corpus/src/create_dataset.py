@@ -1,13 +1,12 @@
-from audioop import mul
-import dl_tatoeba as tatoeba
+# 指定されたオプションでのみ用いるモジュール(dataset_store, dl_tatoeba, dl_WikiMatrix, cleaning, pipeline, fused, sentence_array)は、
+# 起動やワーカープロセスの生成を速くするために、必要になった時点で読み込む
 import filter as fl
 import split_dataset as spl
 import argparse
-import dl_WikiMatrix as wiki
 import tokenize_enja as tkn
 import sys
 import time
-from cleaning import clean
+from functools import partial
 import gc
 
 
@@ -32,8 +31,22 @@ if __name__ == "__main__":
                         help="absolute path of Machine_Translation_Proto repository")
     parser.add_argument("--cleaning", action="store_true",
                         help="turn on/off the cleaning feature.")
+    parser.add_argument("--script_thld", type=float, default=1.0,
+                        help="minimum ratio of characters allowed in English/Japanese sentences. Sentences below it are removed while cleaning\nDefault: 1.0   Valid range: 0.0 < script_thld <= 1.0")
+    parser.add_argument("--clean_budget", type=float, default=1.0,
+                        help="maximum seconds spent on cleaning one pair. Pairs exceeding it are removed (quarantined) instead of stalling a worker\nDefault: 1.0   0 disables the budget")
+    parser.add_argument("--quarantine", type=str, default=None,
+                        help="path of a JSON Lines file to which the quarantined pairs are appended")
     parser.add_argument("--tatoeba", action="store_true",
                         help="use Tatoeba dataset")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="directory where downloaded datasets are stored and reused\nDefault: $BT_DATASET_CACHE or ~/.cache/back-translation/datasets")
+    parser.add_argument("--offline", action="store_true",
+                        help="never access the network; read datasets only from the cache or --mirror")
+    parser.add_argument("--mirror", type=str, default=None,
+                        help="file:// URL or directory laid out like the cache, used when a dataset is not cached")
+    parser.add_argument("--verify_cache", action="store_true",
+                        help="verify SHA-256 of cached datasets before using them")
     parser.add_argument("--WikiMatrix", action="store_true",
                         help="use WikiMatrix dataset.")
     parser.add_argument("--len_filter", action="store_true",
@@ -44,20 +57,48 @@ if __name__ == "__main__":
                         help="valid maximum length of sentences in a dataset")
     parser.add_argument("--overlap_filter", action="store_true",
                         help="turn on/off the length filter")
+    parser.add_argument("--near_dup_filter", action="store_true",
+                        help="turn on/off the near-duplicate filter")
+    parser.add_argument("--near_dup_thld", type=float, default=0.7,
+                        help="minimum estimated Jaccard similarity for pairs to be regarded as near-duplicates")
     parser.add_argument("--ratio_filter", action="store_true",
                         help="turn on/off the ratio filter")
     parser.add_argument("--freq_filter", action="store_true",
                         help="turn on/off the freq filter")
     parser.add_argument("--freq_thld", type=int, default=3,
                         help="threshold for filtering words by frequency")
+    parser.add_argument("--freq_sketch", action="store_true",
+                        help="count word frequencies approximately with fixed memory (Count-Min sketch and Space-Saving) instead of exact dictionaries")
+    parser.add_argument("--sketch_width", type=int, default=2**20,
+                        help="the number of counters in each row of the Count-Min sketch (rounded up to a power of 2)\nMemory per language: sketch_width * sketch_depth * 4 bytes")
+    parser.add_argument("--sketch_depth", type=int, default=4,
+                        help="the number of rows of the Count-Min sketch\nThe overestimate is at most e / sketch_width * (total tokens) with probability 1 - exp(-sketch_depth)")
     parser.add_argument("--workers_tkn", type=int, default=1,
                         help="the number of processes to accelerate tokenization\nDefault: 1   Valid range: 1 <= workers_tkn <= 12")
     parser.add_argument("--workers_freq", type=int, default=1,
                         help="the number of processes to accelerate creating frequency dictionaries\nDefault: 1   Valid range: 1 <= workers_freq <= 8")
+    parser.add_argument("--workers_dedup", type=int, default=1,
+                        help="the number of processes to accelerate creating MinHash signatures\nDefault: 1   Valid range: 1 <= workers_dedup <= 8")
     parser.add_argument("--workers_clean", type=int, default=1,
                         help="the number of processes to accelerate cleaning downloaded datasets\nDefault: 1   Valid range: 1 <= workers_clean <= 8")
+    parser.add_argument("--workers_filter", type=int, default=1,
+                        help="the number of processes to accelerate the per-pair filters in the pipeline\nDefault: 1   Valid range: 1 <= workers_filter <= 20")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run cleaning, tokenization and the length filter concurrently as pipeline stages connected by bounded queues")
+    parser.add_argument("--fused", action="store_true",
+                        help="run cleaning, tokenization and the length filter in one pipeline stage per pair, skipping pairs that are certain to be filtered out before tokenizing them (implies --pipeline, uses --workers_tkn processes)")
+    parser.add_argument("--chunk_size", type=int, default=10000,
+                        help="the number of pairs passed between pipeline stages at once")
+    parser.add_argument("--queue_size", type=int, default=4,
+                        help="the maximum number of chunks waiting between two pipeline stages")
+    parser.add_argument("--stream_write", action="store_true",
+                        help="with --pipeline or --fused, write the train/valid/test files while the pipeline runs. Pairs are assigned to the datasets at random, so their sizes are only approximately 98:1:1. Ignored with --overlap_filter, --near_dup_filter, --ratio_filter, --freq_filter or --append, which need all pairs")
+    parser.add_argument("--compact", action="store_true",
+                        help="hold tokenized sentences as compact SentenceArrays during filtering and splitting to reduce memory usage")
     parser.add_argument("--div_size", type=int, default=250000,
                         help="the number of sentences contained in each divided file if division of a dataset is enabled")
+    parser.add_argument("--append", action="store_true",
+                        help="append the specified datasets to the existing train dataset instead of creating a new dataset. Pairs already in the dataset or overlapping with valid/test datasets are dropped.")
     parser.add_argument("--div_train", action="store_true",
                         help="divide a train dataset into several pieces when this optional parameter is given.")
     parser.add_argument("--div_valid", action="store_true",
@@ -70,16 +111,24 @@ if __name__ == "__main__":
 
     en_tmp_ls, ja_tmp_ls = [], []
 
+    # ダウンロードしたデータセットはキャッシュに保存し、次回以降はそのまま用いる
+    if args.tatoeba or args.WikiMatrix:
+        import dataset_store as ds
+        store = ds.DatasetStore(args.cache_dir, offline=args.offline,
+                                mirror=args.mirror, verify=args.verify_cache)
+
     # Tatoebaデータセットをダウンロードしてリスト化する
     if args.tatoeba:
-        tatoeba.dl_tatoeba(repo_path)
-        tatoeba_en, tatoeba_ja = tatoeba.json2list(repo_path)
+        import dl_tatoeba as tatoeba
+        tatoeba_path = tatoeba.dl_tatoeba(repo_path, store)
+        tatoeba_en, tatoeba_ja = tatoeba.json2list(tatoeba_path)
         en_tmp_ls.append(tatoeba_en)
         ja_tmp_ls.append(tatoeba_ja)
 
     # WikiMatrixデータセットをダウンロードしてリスト化する
     if args.WikiMatrix:
-        wiki_en, wiki_ja = wiki.dl_WikiMatrix(repo_path)
+        import dl_WikiMatrix as wiki
+        wiki_en, wiki_ja = wiki.dl_WikiMatrix(repo_path, store)
 
         # 後で各データセットを結合する時のために小分けにしてリストに保存しておく。
         # それによって、結合時のメモリの使用率を下げることができる。
@@ -106,53 +155,157 @@ if __name__ == "__main__":
         del ja_tmp_ls[:]
         gc.collect()
 
-    if args.cleaning:
-        workers_clean = args.workers_clean
-        min_workers_clean = 1
-        max_workers_clean = 20
-        workers_clean = check_workers(
-            workers_clean, "clean", min_workers_clean, max_workers_clean)
+    workers_clean = args.workers_clean
+    min_workers_clean = 1
+    max_workers_clean = 20
+    workers_clean = check_workers(
+        workers_clean, "clean", min_workers_clean, max_workers_clean)
 
-        start = time.time()
-        en_ls, ja_ls = clean(en_ls, ja_ls, workers_clean)
-        end = time.time()
-        print("%d seconds for cleaning datasets" % int(end - start))
+    script_thld = args.script_thld
+    if script_thld <= 0.0 or script_thld > 1.0:
+        print("The value script_thld {} is invalid. ".format(script_thld))
+        print("It is replaced by 1.0.")
+        script_thld = 1.0
 
-    print("\n{} sentences".format(min(len(en_ls), len(ja_ls))))
-
-    # 英文と日本文をそれぞれトークン化する
     workers_tkn = args.workers_tkn
     min_workers_tkn = 1
     max_workers_tkn = 20
     workers_tkn = check_workers(
         workers_tkn, "tkn", min_workers_tkn, max_workers_tkn)
 
-    print("\nTokenizing sentences...")
-    start = time.time()
-    tkn = tkn.Tokenization(workers=workers_tkn)
-    en_ls, ja_ls = tkn.tokenize(en_ls, ja_ls)
-    end = time.time()
-    print("%d seconds for tokenizing sentences" % int(end - start))
-
-    # フィルタリング
+    min_len = args.min_len
+    max_len = args.max_len
     if args.len_filter:
-        min = args.min_len
-        max = args.max_len
-        if min < 1 or min > 16:
+        if min_len < 1 or min_len > 16:
             print(
                 "The minimum length of sentences should be in a range: 1 <= min_len <= 16")
-            print("Specified min_len %d is replaced by %d" % (min, 5))
-            min = 5
-        if max < 16 or max > 256:
+            print("Specified min_len %d is replaced by %d" % (min_len, 5))
+            min_len = 5
+        if max_len < 16 or max_len > 256:
             print(
                 "The maximum length of sentences should be in a range: 16 <= min_len <= 256")
-            print("Specified max_len %d is replaced by %d" % (max, 32))
-            max = 32
-        en_ls, ja_ls = fl.len_filter(en_ls, ja_ls, min, max, truncate=True)
+            print("Specified max_len %d is replaced by %d" % (max_len, 32))
+            max_len = 32
+
+    split_ratio = {"train": 0.98, "valid": 0.01, "test": 0.01}
+
+    # 書き込みをパイプラインと並行して行う (全てのペアを必要とするフィルタや追加とは併用できない)
+    stream = None
+    if args.stream_write:
+        if not (args.pipeline or args.fused):
+            print("--stream_write requires --pipeline or --fused. The dataset is written after all pairs are processed.")
+        elif args.overlap_filter or args.near_dup_filter or args.ratio_filter or args.freq_filter or args.append:
+            print("--stream_write is ignored because the specified filters or --append need all pairs.")
+        else:
+            stream = spl.StreamingSplit(split_ratio, repo_path, div_size=args.div_size,
+                                        div_train=args.div_train, div_valid=args.div_valid, div_test=args.div_test)
+
+    if args.fused:
+        # クリーニング、トークン化、ペアごとのフィルタを一つのステージでまとめて実行する
+        import pipeline as pl
+        from fused import fused_pairs
+
+        stage = pl.Stage("fused", partial(
+            fused_pairs, cleaning=args.cleaning, script_thld=script_thld,
+            budget=args.clean_budget, quarantine=args.quarantine,
+            min_len=min_len if args.len_filter else None, max_len=max_len), workers_tkn)
+        start = time.time()
+        pipeline = pl.Pipeline([stage], queue_size=args.queue_size,
+                               chunk_size=args.chunk_size)
+        if stream is None:
+            en_ls, ja_ls = pipeline.run(en_ls, ja_ls)
+        else:
+            pipeline.run(en_ls, ja_ls, sink=stream)
+        end = time.time()
+        print("%d seconds for running the fused pipeline" % int(end - start))
+        if stream is None:
+            print("\n{} sentences".format(min(len(en_ls), len(ja_ls))))
+    elif args.pipeline:
+        # クリーニング、トークン化、ペアごとのフィルタを並行して実行する
+        workers_filter = args.workers_filter
+        min_workers_filter = 1
+        max_workers_filter = 20
+        workers_filter = check_workers(
+            workers_filter, "filter", min_workers_filter, max_workers_filter)
+
+        import pipeline as pl
+
+        stages = []
+        if args.cleaning:
+            from cleaning import clean_pairs
+            stages.append(pl.Stage("clean", partial(
+                clean_pairs, script_thld=script_thld,
+                budget=args.clean_budget, quarantine=args.quarantine), workers_clean))
+        tkn = tkn.Tokenization()
+        stages.append(pl.Stage("tokenize", tkn.tokenize_pairs, workers_tkn))
+        if args.len_filter:
+            stages.append(pl.Stage("len_filter", partial(
+                fl.len_filter_pairs, min=min_len, max=max_len, truncate=True), workers_filter))
+
+        start = time.time()
+        pipeline = pl.Pipeline(stages, queue_size=args.queue_size,
+                               chunk_size=args.chunk_size)
+        if stream is None:
+            en_ls, ja_ls = pipeline.run(en_ls, ja_ls)
+        else:
+            pipeline.run(en_ls, ja_ls, sink=stream)
+        end = time.time()
+        print("%d seconds for running the pipeline" % int(end - start))
+        if stream is None:
+            print("\n{} sentences".format(min(len(en_ls), len(ja_ls))))
+    else:
+        if args.cleaning:
+            start = time.time()
+            from cleaning import clean
+            en_ls, ja_ls = clean(en_ls, ja_ls, workers_clean, script_thld,
+                                 args.clean_budget, args.quarantine)
+            end = time.time()
+            print("%d seconds for cleaning datasets" % int(end - start))
+
+        print("\n{} sentences".format(min(len(en_ls), len(ja_ls))))
+
+        # 英文と日本文をそれぞれトークン化する
+        print("\nTokenizing sentences...")
+        start = time.time()
+        tkn = tkn.Tokenization(workers=workers_tkn)
+        en_ls, ja_ls = tkn.tokenize(en_ls, ja_ls)
+        end = time.time()
+        print("%d seconds for tokenizing sentences" % int(end - start))
+
+        # フィルタリング
+        if args.len_filter:
+            en_ls, ja_ls = fl.len_filter(
+                en_ls, ja_ls, min_len, max_len, truncate=True)
+
+    if stream is not None:
+        # データセットはパイプラインの実行中に書き込まれている
+        stream.close()
+        print("\n{} sentences".format(sum(shard["sents"] for shards in stream.manifest.values() for shard in shards)))
+        sys.exit()
+
+    # 以降の処理では、文を SentenceArray としてコンパクトに保持する
+    if args.compact:
+        import sentence_array as sa
+        en_ls = sa.SentenceArray.from_iter(en_ls)
+        ja_ls = sa.SentenceArray.from_iter(ja_ls)
+        gc.collect()
 
     if args.overlap_filter:
         en_ls, ja_ls = fl.overlap_filter(en_ls, ja_ls)
 
+    if args.near_dup_filter:
+        workers_dedup = args.workers_dedup
+        min_workers_dedup = 1
+        max_workers_dedup = fl.MAX_WORKERS_DEDUP
+        workers_dedup = check_workers(
+            workers_dedup, "dedup", min_workers_dedup, max_workers_dedup)
+
+        start = time.time()
+        en_ls, ja_ls = fl.near_dup_filter(
+            en_ls, ja_ls, args.near_dup_thld, workers=workers_dedup)
+        end = time.time()
+        print("%d seconds for filtering near-duplicates" % int(end - start))
+
     if args.ratio_filter:
         en_ls, ja_ls = fl.ratio_filter(en_ls, ja_ls)
 
@@ -164,8 +317,11 @@ if __name__ == "__main__":
             workers_freq, "freq", min_workers_freq, max_workers_freq)
 
         en_ls, ja_ls = fl.freq_filter(
-            en_ls, ja_ls, args.freq_thld, workers=workers_freq)
+            en_ls, ja_ls, args.freq_thld, workers=workers_freq,
+            sketch=args.freq_sketch, width=args.sketch_width, depth=args.sketch_depth)
 
-    split_ratio = {"train": 0.98, "valid": 0.01, "test": 0.01}
-    spl.split_dataset(en_ls, ja_ls, split_ratio, repo_path,
-                      div_size=args.div_size, div_train=args.div_train, div_valid=args.div_valid, div_test=args.div_test)
+    if args.append:
+        spl.append_dataset(en_ls, ja_ls, repo_path, div_size=args.div_size)
+    else:
+        spl.split_dataset(en_ls, ja_ls, split_ratio, repo_path,
+                          div_size=args.div_size, div_train=args.div_train, div_valid=args.div_valid, div_test=args.div_test)
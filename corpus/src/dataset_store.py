@@ -0,0 +1,203 @@
+"""
+=== DESCRIPTION
+このファイルには、ダウンロードしたデータセットをローカルに保存して再利用するための DatasetStore が実装されています。
+
+データセットは (名前, バージョン) ごとに cache_dir/名前/バージョン/ファイル名 に保存され、
+同じディレクトリに SHA-256 とファイルサイズなどを記録したメタデータ(ファイル名.json)が作成されます。
+一度保存したデータセットは、次回以降はネットワークにアクセスせずにそのまま用いられます。
+
+1. ダウンロードは ファイル名.part に書き込みながら行い、途中で中断されたときは、次回その続きから再開します。(HTTP の Range リクエスト)
+2. ダウンロードが完了したときに SHA-256 を計算し、既知の値(SOURCES)があればそれと照合します。
+   既知の値がない(None の)データセットは、最初にダウンロードしたファイルをそのまま信頼し、その値をメタデータに記録します。
+   (改ざんや破損を検出できるのは、それ以降に保存済みのファイルが変わった場合だけです。照合したいときは SOURCES に値を書いてください)
+   verify=True のときは、保存済みのファイルについてもメタデータの値と照合します。
+3. offline=True のときはネットワークにアクセスせず、キャッシュまたはミラー(file:// またはディレクトリ)からのみ読み込みます。
+   ミラーのディレクトリ構成はキャッシュと同じです。(別のマシンのキャッシュをそのままミラーとして用いることができる)
+
+キャッシュの場所は、引数 cache_dir、環境変数 BT_DATASET_CACHE、~/.cache/back-translation/datasets の順に決まります。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from tqdm import tqdm
+
+# 既知のデータセット  (名前, バージョン): {"url": ダウンロード元, "file": ファイル名, "sha256": 既知のハッシュ値(不明なときは None)}
+# WikiMatrix は配布元が SHA-256 を公開していないので None とし、最初にダウンロードしたものを信頼する
+SOURCES = {
+    ("WikiMatrix", "v1"): {
+        "url": "https://dl.fbaipublicfiles.com/laser/WikiMatrix/v1/WikiMatrix.en-ja.tsv.gz",
+        "file": "WikiMatrix.en-ja.tsv.gz",
+        "sha256": None,
+    },
+}
+
+CHUNK_SIZE = 1 << 20
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def sha256sum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def default_cache_dir():
+    return os.environ.get("BT_DATASET_CACHE", os.path.join(
+        os.path.expanduser("~"), ".cache", "back-translation", "datasets"))
+
+
+class DatasetStore():
+    def __init__(self, cache_dir=None, offline=False, mirror=None, verify=False):
+        """
+        cache_dir:  データセットを保存するディレクトリ
+        offline:    True のときはネットワークにアクセスしない
+        mirror:     キャッシュにないときに参照するミラー (file:// から始まる URL またはディレクトリのパス)
+        verify:     True のときは、保存済みのファイルの SHA-256 もメタデータと照合する
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.offline = offline
+        self.mirror = mirror
+        self.verify = verify
+
+    def path(self, name, version, file):
+        return os.path.join(self.cache_dir, name, version, file)
+
+    def load_meta(self, path):
+        meta_path = path + ".json"
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_meta(self, path, origin, sha256):
+        meta = {"origin": origin, "sha256": sha256, "size": os.path.getsize(path),
+                "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        tmp = path + ".json.tmp"
+        with open(tmp, 'w', encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, path + ".json")
+
+    def cached(self, path, expected=None):
+        """
+        path が保存済みで、メタデータと一致していれば True を返す関数
+        """
+        meta = self.load_meta(path)
+        if meta is None or not os.path.exists(path) or os.path.getsize(path) != meta["size"]:
+            return False
+        if expected is not None and meta["sha256"] != expected:
+            raise ChecksumError("Error: %s has SHA-256 %s, but %s is expected." % (
+                path, meta["sha256"], expected))
+        if self.verify and sha256sum(path) != meta["sha256"]:
+            raise ChecksumError(
+                "Error: %s is corrupted (SHA-256 does not match its metadata). Delete it and download again." % path)
+        return True
+
+    def finish(self, tmp, path, origin, expected=None):
+        # 完了したファイルのハッシュ値を確認してから、保存先に移す
+        digest = sha256sum(tmp)
+        if expected is not None and digest != expected:
+            os.remove(tmp)
+            raise ChecksumError("Error: %s has SHA-256 %s, but %s is expected." % (
+                origin, digest, expected))
+        if expected is None:
+            print("No known SHA-256 for {}; trusting this copy and recording {}.".format(origin, digest))
+        os.replace(tmp, path)
+        self.save_meta(path, origin, digest)
+
+    def mirror_path(self, name, version, file):
+        if self.mirror is None:
+            return None
+        root = self.mirror
+        if root.startswith("file://"):
+            root = urllib.request.url2pathname(urllib.parse.urlparse(root).path)
+        path = os.path.join(root, name, version, file)
+        return path if os.path.exists(path) else None
+
+    def fetch(self, name, version, url=None, file=None, sha256=None, export=None):
+        """
+        データセットのファイルのパスを返す関数
+        キャッシュにないときは、ミラー、url (ダウンロード)、export (ファイルを作成する関数) の順に取得を試みる。
+
+        export: 保存先のパスを受け取り、そこにファイルを作成する関数 (ダウンロード用のライブラリを用いるデータセットに用いる)
+        """
+        source = SOURCES.get((name, version), {})
+        url = url or source.get("url")
+        file = file or source.get("file") or os.path.basename(urllib.parse.urlparse(url).path)
+        sha256 = sha256 or source.get("sha256")
+        path = self.path(name, version, file)
+        if self.cached(path, sha256):
+            print("Using cached {} {}: {}".format(name, version, path))
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".part"
+        mirrored = self.mirror_path(name, version, file)
+        if mirrored is not None:
+            print("Copying {} {} from the mirror {}".format(name, version, mirrored))
+            shutil.copyfile(mirrored, tmp)
+            self.finish(tmp, path, "file://" + os.path.abspath(mirrored), sha256)
+        elif self.offline:
+            raise FileNotFoundError(
+                "Error: %s %s is not in the cache %s or the mirror, and the store is offline." % (
+                    name, version, self.cache_dir))
+        elif url is not None:
+            print("Downloading {} {} from {}".format(name, version, url))
+            download(url, tmp)
+            self.finish(tmp, path, url, sha256)
+        elif export is not None:
+            print("Exporting {} {} to {}".format(name, version, path))
+            export(tmp)
+            self.finish(tmp, path, "export:{}".format(name), sha256)
+        else:
+            raise ValueError("Error: no source is known for %s %s." % (name, version))
+        return path
+
+
+def download(url, tmp):
+    """
+    url のファイルを tmp に書き込む関数
+    tmp が既に存在するときは、その続きからダウンロードする。(サーバが Range に対応していないときは最初からやり直す)
+    """
+    done = os.path.getsize(tmp) if os.path.exists(tmp) else 0
+    request = urllib.request.Request(url)
+    if done:
+        request.add_header("Range", "bytes={}-".format(done))
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        if not (done and e.code == 416):
+            raise
+        # 416 (Range Not Satisfiable): tmp が既に全体を含んでいるか、サーバのファイルより大きい
+        # (ハッシュ値は呼び出し元の finish で確認する)
+        total = e.headers.get("Content-Range", "").rpartition("/")[2]
+        if not total.isdigit():
+            # Content-Range にファイルサイズがないときは、HEAD リクエストで確認する
+            with urllib.request.urlopen(urllib.request.Request(url, method="HEAD")) as head:
+                total = head.headers.get("Content-Length") or ""
+        if total.isdigit() and int(total) == done:
+            return
+        print("{} does not match the file on the server; downloading it again.".format(tmp))
+        os.remove(tmp)
+        return download(url, tmp)
+    with response:
+        if done and response.status != 206:
+            # Range を無視して全体が返されたときは、最初から書き直す
+            done = 0
+        total = response.headers.get("Content-Length")
+        total = int(total) + done if total is not None else None
+        with open(tmp, "ab" if done else "wb") as f, \
+                tqdm(total=total, initial=done, unit="B", unit_scale=True) as bar:
+            for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+                f.write(block)
+                bar.update(len(block))
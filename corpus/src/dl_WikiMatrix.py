@@ -1,21 +1,26 @@
 from tqdm import tqdm
-import os
+import gzip
+import dataset_store as ds
 
+VERSION = "v1"
 
-def dl_WikiMatrix(repo_path):
+
+def dl_WikiMatrix(repo_path, store=None):
+    """
+    WikiMatrix データセットを読み込み、英文と和文のリストを返す関数
+    アーカイブは DatasetStore に保存され、次回以降はダウンロードせずにそのまま読み込む。(展開もしない)
+    """
     num_sents = 3895992
+    store = store or ds.DatasetStore()
     print("\nDownloading WikiMatrix dataset...")
-    os.system(
-        "wget --progress=bar https://dl.fbaipublicfiles.com/laser/WikiMatrix/v1/WikiMatrix.en-ja.tsv.gz")
-    os.system("gunzip WikiMatrix.en-ja.tsv.gz")
+    path = store.fetch("WikiMatrix", VERSION)
 
     en_ls, ja_ls = [], []
-    with open("WikiMatrix.en-ja.tsv", 'r') as f:
+    with gzip.open(path, 'rt', encoding="utf-8") as f:
         for line in tqdm(f, total=num_sents):
             _, en, ja = line.rstrip().split('\t')
             en_ls.append(en + '\n')
             ja_ls.append(ja + '\n')
-    os.system("rm WikiMatrix.en-ja.tsv")
     return en_ls, ja_ls
 
 
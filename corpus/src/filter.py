@@ -1,21 +1,26 @@
 """
 === DESCRIPTION
-このファイルには、長さ、重複、英文と和文の長さの比率、単語の出現頻度に基づいたフィルタ関数が実装されています。
+このファイルには、長さ、重複、近似的な重複、英文と和文の長さの比率、単語の出現頻度に基づいたフィルタ関数が実装されています。
 
 各フィルタ関数への入力形式として、MosesTokenizer (英語) や MeCab (日本語) を用いてトークン化された文字列のリストを想定しています。
 また、トークン化の前にクリーニング処理を行って、ノイズ(URL、日本語と英語以外の言語の文が紛れ込んでいるなど)を取り除いておくことをおすすめします。
 
-freq_filter関数は、処理の高速化のためにマルチプロセス処理に対応しています。
+各フィルタ関数は、str のリストの代わりに SentenceArray (sentence_array.py) を受け取ることもでき、受け取った型と同じ型で結果を返します。
+
+freq_filter関数とnear_dup_filter関数は、処理の高速化のためにマルチプロセス処理に対応しています。
+また、freq_filter関数に sketch=True を指定すると、出現頻度表(辞書)の代わりに一定のメモリで近似的に数えるスケッチ(freq_sketch.py)を用います。
 """
 
 from tqdm import tqdm
 import numpy as np
 import multiprocessing as mp
 import os
+import re
 import time
+import zlib
 from collections import defaultdict
-from matplotlib import pyplot as plt
-import japanize_matplotlib
+import sentence_array as sa
+import freq_sketch as fs
 
 
 def lens(s1, s2):
@@ -37,9 +42,18 @@ def len_filter(en_sents, ja_sents, min, max, truncate=True):
     2. 少なくとも一方の文の長さがmaxよりも長いときは、適切な長さになるようにカットされます。
        (この場合は、1と2の両方に該当しない限り、取り除かれない)
     """
-    en_ls, ja_ls = [], []
     print("\nFiltering by length...")
-    for en, ja in tqdm(zip(en_sents, ja_sents), total=len(en_sents)):
+    return len_filter_pairs(en_sents, ja_sents, min, max, truncate, progress=True)
+
+
+def len_filter_pairs(en_sents, ja_sents, min, max, truncate=True, progress=False):
+    """
+    len_filter関数の本体 (progress=True のときのみ進捗を表示する)
+    パイプライン処理の1ステージとして、小分けにしたペアごとに呼び出すこともできる。
+    """
+    en_ls, ja_ls = sa.empty_like(en_sents), sa.empty_like(ja_sents)
+    pairs = zip(en_sents, ja_sents)
+    for en, ja in tqdm(pairs, total=len(en_sents)) if progress else pairs:
         en_len, ja_len = lens(en, ja)
         if min <= en_len <= max and min <= ja_len <= max:
             en_ls.append(en)
@@ -48,7 +62,7 @@ def len_filter(en_sents, ja_sents, min, max, truncate=True):
             en_ls.append(trunc(en, max))
             ja_ls.append(trunc(ja, max))
 
-    return en_ls, ja_ls
+    return sa.finish(en_ls), sa.finish(ja_ls)
 
 
 def overlap_filter(en_sents, ja_sents):
@@ -60,23 +74,181 @@ def overlap_filter(en_sents, ja_sents):
     削除されるケース    (I am a hungry., 私はお腹がすいた。) (I am a hungry., 私はお腹がすいた。)
     削除されないケース  (I am a hungry., 私はお腹がすいた。) (I am a hungry., 私は腹ペコだ。)
     """
-    en_ls, ja_ls = [], []
+    keep = np.zeros(min(len(en_sents), len(ja_sents)), dtype=bool)
     en_dict = {sent: 0 for sent in en_sents}
     ja_dict = {sent: 0 for sent in ja_sents}
 
     print("\nFiltering by overlap...")
-    for en, ja in tqdm(zip(en_sents, ja_sents), total=len(en_sents)):
+    for idx, (en, ja) in enumerate(tqdm(zip(en_sents, ja_sents), total=len(en_sents))):
         if en_dict[en] == 0 and ja_dict[ja] == 0:
-            en_ls.append(en)
-            ja_ls.append(ja)
+            keep[idx] = True
             en_dict[en] += 1
             ja_dict[ja] += 1
         elif (en_dict[en] == 0) ^ (ja_dict[ja] == 0):
-            en_ls.append(en)
-            ja_ls.append(ja)
+            keep[idx] = True
             en_dict[en] += 1
             ja_dict[ja] += 1
 
+    return sa.select(en_sents, keep), sa.select(ja_sents, keep)
+
+
+# MinHash で用いるハッシュ関数の定数
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+norm_punct = re.compile(r"[\W_]+")
+norm_digits = re.compile(r"\d+")
+
+
+def shingles(sent, n=3):
+    """
+    文を正規化したトークン列から、長さnの単語シングル(n-gram)のハッシュ値のリストを作成する関数
+    記号を取り除き、数字を0に置き換えてから作成するので、記号や数字だけが異なる文は同じシングルを持つ。
+    """
+    tokens = [norm_digits.sub('0', norm_punct.sub('', w.lower()))
+              for w in sent.strip().split()]
+    tokens = [w for w in tokens if w]
+    if len(tokens) < n:
+        return [zlib.crc32(' '.join(tokens).encode("utf-8"))]
+    return [zlib.crc32(' '.join(tokens[i:i+n]).encode("utf-8"))
+            for i in range(len(tokens) - n + 1)]
+
+
+def minhash_params(num_perm, seed=1):
+    """
+    MinHash の各ハッシュ関数 (a * x + b) mod p の係数 a, b を作成する関数
+    全てのワーカーで同じ係数を用いるために、シードを固定して作成する。
+    """
+    gen = np.random.RandomState(seed)
+    a = gen.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+    b = gen.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(en_sents, ja_sents, num_perm, n=3, chunk_size=2000):
+    """
+    各ペアの MinHash シグネチャ (形状: (ペアの数, num_perm)) をまとめて計算する関数
+    英文と和文のシングルを区別して一つの集合とみなす。
+    """
+    a, b = minhash_params(num_perm)
+    num_sents = min(len(en_sents), len(ja_sents))
+    sigs = np.empty((num_sents, num_perm), dtype=np.uint32)
+    for head in range(0, num_sents, chunk_size):
+        tail = min(head + chunk_size, num_sents)
+        hashes, offsets = [], []
+        for en, ja in zip(en_sents[head:tail], ja_sents[head:tail]):
+            offsets.append(len(hashes))
+            hashes.extend(shingles(en, n))
+            hashes.extend(h ^ MAX_HASH for h in shingles(ja, n))
+
+        # 全てのシングルに対して num_perm 個のハッシュ関数を一度に適用し、ペアごとの最小値を取る
+        h = np.array(hashes, dtype=np.uint64)
+        phv = ((a[:, None] * h[None, :] + b[:, None]) %
+               MERSENNE_PRIME) & MAX_HASH
+        sigs[head:tail] = np.minimum.reduceat(phv, offsets, axis=1).T
+    return sigs
+
+
+def get_minhash(idx, en_sents, ja_sents, num_perm, n, queue):
+    print("Creating MinHash signatures...  (PID {})".format(os.getpid()))
+    queue.put((idx, minhash(en_sents, ja_sents, num_perm, n)))
+    print("Finished creating MinHash signatures...: (PID {})".format(os.getpid()))
+
+
+def find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def lsh_clusters(sigs, bands, thld):
+    """
+    LSH (バンド分割) を用いて、近似的に重複しているペアのクラスタを求める関数
+    各ペアが属するクラスタの代表(クラスタ内で最も小さいインデックス)の配列を返す。
+
+    同じバケツに入ったペアのうち、バケツの先頭のペアとシグネチャの一致率が thld 以上のものだけを同じクラスタとみなす。
+    全てのペアの組を比較しないので、計算量はペアの数に対してほぼ線形になる。
+    """
+    num_sents, num_perm = sigs.shape
+    rows = num_perm // bands
+    parent = np.arange(num_sents)
+    gen = np.random.RandomState(bands)
+    coef = gen.randint(1, MAX_HASH, size=rows, dtype=np.uint64) | 1
+
+    for band in tqdm(range(bands)):
+        # バンドごとにシグネチャを一つのハッシュ値にまとめ、同じ値を持つペアを同じバケツに入れる
+        keys = (sigs[:, band*rows:(band+1)*rows].astype(np.uint64)
+                * coef).sum(axis=1)
+        _, first, inverse = np.unique(
+            keys, return_index=True, return_inverse=True)
+        head = first[inverse.ravel()]
+        cand = np.nonzero(head != np.arange(num_sents))[0]
+        if len(cand) == 0:
+            continue
+
+        sim = (sigs[cand] == sigs[head[cand]]).mean(axis=1)
+        for x, y in zip(cand[sim >= thld], head[cand][sim >= thld]):
+            rx, ry = find(parent, x), find(parent, y)
+            if rx != ry:
+                parent[max(rx, ry)] = min(rx, ry)
+
+    return np.array([find(parent, x) for x in range(num_sents)])
+
+
+# near_dup_filter のプロセス数の上限 (create_dataset.py の --workers_dedup と共通)
+MAX_WORKERS_DEDUP = 8
+
+
+def near_dup_filter(en_sents, ja_sents, thld=0.7, num_perm=64, bands=16, n=3, workers=1):
+    """
+    MinHash と LSH を用いて、ほぼ重複しているペアを取り除く関数
+    記号や数字、一部の単語だけが異なるペアを一つのクラスタにまとめ、各クラスタの代表(最初に現れたペア)のみを残す。
+
+    thld:       同じクラスタとみなすシングル集合の推定Jaccard係数の下限
+    num_perm:   MinHash のハッシュ関数の数 (bands で割り切れる必要がある)
+    bands:      LSH のバンド数 (バンド数を増やすほど、類似度の低いペアも候補として見つかる)
+    n:          シングルの長さ(単語数)
+    workers:    シグネチャの計算に用いるプロセス数
+    """
+    if num_perm % bands != 0:
+        raise ValueError(
+            "Error: num_perm %d is not divisible by bands %d." % (num_perm, bands))
+
+    queue = mp.Queue()
+    num_sents = min(len(en_sents), len(ja_sents))
+    min_workers = 1
+    max_workers = MAX_WORKERS_DEDUP
+    if workers < min_workers or workers > max_workers:
+        print("The number of processes for near_dup_filter {} is invalid (valid range: {} <= workers <= {}). It is replaced by 1.".format(
+            workers, min_workers, max_workers))
+        workers = 1
+    workers = workers if workers <= num_sents else 1
+    size = int(num_sents / workers)
+
+    print("\nFiltering by near duplication...")
+    start = time.time()
+    procs = []
+    for idx in range(workers):
+        head = idx * size
+        tail = (idx+1) * size if idx != (workers-1) else num_sents
+        proc = mp.Process(target=get_minhash, args=[
+            idx, en_sents[head:tail], ja_sents[head:tail], num_perm, n, queue])
+        proc.start()
+        procs.append(proc)
+
+    # キューからは終了した順に取り出されるので、インデックス順に並べ直す
+    results = sorted([queue.get() for _ in range(workers)], key=lambda x: x[0])
+    for proc in procs:
+        proc.join()
+    sigs = np.concatenate([sig for _, sig in results])
+    end = time.time()
+    print("{} seconds for creating MinHash signatures".format(end-start))
+
+    reps = lsh_clusters(sigs, bands, thld)
+    keep = reps == np.arange(num_sents)
+    en_ls, ja_ls = sa.select(en_sents, keep), sa.select(ja_sents, keep)
+    print("Removed {} near-duplicate pairs".format(num_sents - len(en_ls)))
+
     return en_ls, ja_ls
 
 
@@ -88,32 +260,24 @@ def ratio_filter(en_sents, ja_sents, alpha=1.96):
     """
     英文と和文の長さの比率に基づいて、フィルタをかける関数
     """
-    ratios, en_ls, ja_ls = [], [], []
+    num_sents = min(len(en_sents), len(ja_sents))
+    ratios = np.zeros(num_sents, dtype=np.float64)
+    valid = np.zeros(num_sents, dtype=bool)
 
     print("\nFiltering by ratio...")
-    for en, ja in tqdm(zip(en_sents, ja_sents), total=len(en_sents)):
+    for idx, (en, ja) in enumerate(tqdm(zip(en_sents, ja_sents), total=len(en_sents))):
         len_en, len_ja = lens(en, ja)
         if len_en == 0 or len_ja == 0:
             continue
-        ratios.append(ratio(len_en, len_ja))
+        ratios[idx] = ratio(len_en, len_ja)
+        valid[idx] = True
 
     # 英文と和文の長さの比率に関する統計情報を計算
-    ratios = sorted(ratios)
-    N = len(ratios)
-    mean = np.mean(ratios)
-    std = np.std(ratios)  # 標準偏差(データの散らばり具合を表す)
+    mean = np.mean(ratios[valid])
+    std = np.std(ratios[valid])  # 標準偏差(データの散らばり具合を表す)
 
-    for en, ja in tqdm(zip(en_sents, ja_sents), total=len(en_sents)):
-        len_en, len_ja = lens(en, ja)
-        if len_en == 0 or len_ja == 0:
-            continue
-        r = ratio(len_en, len_ja)
-        if (r < mean - alpha * std) or (r > mean + alpha * std):
-            continue
-        en_ls.append(en)
-        ja_ls.append(ja)
-
-    return en_ls, ja_ls
+    keep = valid & (ratios >= mean - alpha * std) & (ratios <= mean + alpha * std)
+    return sa.select(en_sents, keep), sa.select(ja_sents, keep)
 
 
 def get_freq_dict(en_sents, ja_sents, en_queue, ja_queue):
@@ -138,6 +302,22 @@ def get_freq_dict(en_sents, ja_sents, en_queue, ja_queue):
     print("Finished creating frequency lists...: (PID {})".format(os.getpid()))
 
 
+def get_freq_sketch(en_sents, ja_sents, width, depth, top_k, en_queue, ja_queue):
+    """
+    単語の出現頻度を近似的に数えるスケッチ(FreqSketch)を作成する関数
+    文を小分けにして正確に数え、その結果をスケッチに加えるので、メモリ使用量は語彙の数に依らない。
+    """
+    en_sketch = fs.FreqSketch(width, depth, top_k)
+    ja_sketch = fs.FreqSketch(width, depth, top_k)
+    print("Creating frequency sketches...  (PID {})".format(os.getpid()))
+    en_sketch.add_sents(en_sents)
+    ja_sketch.add_sents(ja_sents)
+
+    en_queue.put(en_sketch)
+    ja_queue.put(ja_sketch)
+    print("Finished creating frequency sketches...: (PID {})".format(os.getpid()))
+
+
 def sort_freq_dict(freq_dict, descending=True):
     freq_ls = list(freq_dict.items())
     if descending:
@@ -175,17 +355,48 @@ def concat_freq_dicts(en_queue, ja_queue, workers=1):
     return en_freq_dict, ja_freq_dict
 
 
+def concat_freq_sketches(en_queue, ja_queue, workers=1):
+    en_sketch, ja_sketch = en_queue.get(), ja_queue.get()
+    for _ in range(workers - 1):
+        en_sketch.merge(en_queue.get())
+        ja_sketch.merge(ja_queue.get())
+    return en_sketch, ja_sketch
+
+
 def replace_by_unk(sent, freq_dict, freq_thld):
     w_ls = [w if freq_dict[w] >=
             freq_thld else "<unk>" for w in sent.strip().split()]
     return ' '.join(w_ls)
 
 
+def replace_by_unk_sketch(sents, sketch, freq_thld, chunk_size=100000):
+    """
+    スケッチを用いて、出現頻度の推定値がしきい値よりも低い単語を<unk>トークンで置き換える関数
+    文を小分けにし、その中の異なり語についてまとめて推定値を求める。
+    """
+    for head in tqdm(range(0, len(sents), chunk_size)):
+        chunk = [sent.strip().split() for sent in sents[head:head + chunk_size]]
+        vocab = list({w for words in chunk for w in words})
+        keep = {w for w, est in zip(vocab, sketch.estimate(vocab)) if est >= freq_thld}
+        for words in chunk:
+            yield ' '.join([w if w in keep else "<unk>" for w in words])
+
+
 def save_freq_distr(freq_dict, path, lang, descending=True, top_n=10):
     """
     単語の出現頻度に関するヒストグラムをPNG形式の画像として保存する関数
+    matplotlib の読み込みには時間がかかるので、この関数を呼び出したときにのみ読み込む。
+    freq_dict には FreqSketch を与えることもできる。(その場合は、高頻度語のヒストグラムのみ作成できる)
     """
-    freq_dict = sort_freq_dict(freq_dict, descending)
+    from matplotlib import pyplot as plt
+    import japanize_matplotlib
+    if isinstance(freq_dict, fs.FreqSketch):
+        if not descending:
+            raise ValueError(
+                "Error: a frequency sketch only keeps the most frequent words. Use descending=True.")
+        freq_dict = dict(freq_dict.top(top_n))
+    else:
+        freq_dict = sort_freq_dict(freq_dict, descending)
     y = [int(freq) for freq in freq_dict.values()][:top_n]
     _min, _max = min(y), max(y)
     plt.bar(range(top_n), y)
@@ -200,9 +411,16 @@ def save_freq_distr(freq_dict, path, lang, descending=True, top_n=10):
     plt.savefig(os.path.join(path, "{}_fd.png".format(lang)))
 
 
-def freq_filter(en_sents, ja_sents, freq_thld, workers=1, return_freq_dict=False):
+def freq_filter(en_sents, ja_sents, freq_thld, workers=1, return_freq_dict=False,
+                sketch=False, width=2**20, depth=4, top_k=1000):
     """
     指定されたしきい値よりも低い出現頻度を持つ単語を<unk>トークンで置き換える関数
+
+    sketch=True のときは、出現頻度表(辞書)の代わりに FreqSketch を用いる。
+    メモリ使用量は語彙の数に依らず、英語と日本語のそれぞれで width * depth * 4 バイト(と top_k 個のカウンタ)になる。
+    推定値は真の値以上になるので、しきい値以上の単語が置き換えられることはないが、
+    確率 1 - exp(-depth) 以上で e / width * (トークンの総数) 以下の過大評価により、一部の低頻度語が置き換えられずに残る。
+    return_freq_dict=True のときは、出現頻度表の代わりにスケッチを返す。
     """
     en_queue = mp.Queue()
     ja_queue = mp.Queue()
@@ -215,24 +433,38 @@ def freq_filter(en_sents, ja_sents, freq_thld, workers=1, return_freq_dict=False
     en_ls, ja_ls = [], []
 
     start = time.time()
-    tgt_fun = get_freq_dict
+    tgt_fun = get_freq_sketch if sketch else get_freq_dict
+    params = [width, depth, top_k] if sketch else []
     for idx in range(workers):
         head = idx * size
         tail = (idx+1) * size if idx != (workers-1) else num_sents
         proc = mp.Process(target=tgt_fun, args=[
-            en_sents[head:tail], ja_sents[head:tail], en_queue, ja_queue])
+            en_sents[head:tail], ja_sents[head:tail], *params, en_queue, ja_queue])
         proc.start()
 
     end = time.time()
 
-    en_freq, ja_freq = concat_freq_dicts(
-        en_queue, ja_queue, workers)
+    if sketch:
+        en_freq, ja_freq = concat_freq_sketches(en_queue, ja_queue, workers)
+        print("EN: " + en_freq.summary())
+        print("JA: " + ja_freq.summary())
+    else:
+        en_freq, ja_freq = concat_freq_dicts(
+            en_queue, ja_queue, workers)
     print("{} seconds for creating a frequency dict".format(end-start))
     print("\nFiltering by frequency...")
-    en_ls = [replace_by_unk(en_sent, en_freq, freq_thld)
-             for en_sent in tqdm(en_sents)]
-    ja_ls = [replace_by_unk(ja_sent, ja_freq, freq_thld)
-             for ja_sent in tqdm(ja_sents)]
+    en_ls, ja_ls = sa.empty_like(en_sents), sa.empty_like(ja_sents)
+    if sketch:
+        for en_sent in replace_by_unk_sketch(en_sents, en_freq, freq_thld):
+            en_ls.append(en_sent)
+        for ja_sent in replace_by_unk_sketch(ja_sents, ja_freq, freq_thld):
+            ja_ls.append(ja_sent)
+    else:
+        for en_sent in tqdm(en_sents):
+            en_ls.append(replace_by_unk(en_sent, en_freq, freq_thld))
+        for ja_sent in tqdm(ja_sents):
+            ja_ls.append(replace_by_unk(ja_sent, ja_freq, freq_thld))
+    en_ls, ja_ls = sa.finish(en_ls), sa.finish(ja_ls)
 
     if return_freq_dict:
         return en_ls, ja_ls, en_freq, ja_freq
@@ -249,6 +481,7 @@ if __name__ == "__main__":
              "私 は 愛犬家 です 。", "私 は バイリンガル です 。"]
     en_ls, ja_ls = len_filter(en_ls, ja_ls, 6, 16)
     en_ls, ja_ls = overlap_filter(en_ls, ja_ls)
+    en_ls, ja_ls = near_dup_filter(en_ls, ja_ls, workers=2)
     en_ls, ja_ls = freq_filter(
         en_ls, ja_ls, freq_thld=2, workers=8)
     print(en_ls)
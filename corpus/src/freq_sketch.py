@@ -0,0 +1,219 @@
+"""
+=== DESCRIPTION
+このファイルには、単語の出現頻度を一定のメモリで近似的に数えるためのスケッチが実装されています。
+
+ノイズの多いコーパスでは、出現頻度表(辞書)の単語の数が数千万になることがあり、その大半は一度しか現れない単語です。
+FreqSketch は、次の二つのデータ構造を組み合わせて、語彙の数に依らない一定のメモリで出現頻度を数えます。
+
+1. Count-Min スケッチ (CountMinSketch)
+   depth 行 width 列のカウンタの表を用いて、任意の単語の出現頻度を推定します。
+   推定値は真の値以上になり(過小評価はしない)、確率 1 - exp(-depth) 以上で、過大評価の幅は e / width * N 以下です。
+   (N はトークンの総数、e はネイピア数)
+   freq_filter では「出現頻度がしきい値以上かどうか」の判定に用います。
+   過大評価により <unk> に置き換えられない低頻度語が残ることはありますが、高頻度語が誤って置き換えられることはありません。
+   メモリ使用量は width * depth * 4 バイトです。(例 width=2^20, depth=4 のとき 16MB)
+
+2. Space-Saving (SpaceSaving)
+   top_k 個のカウンタだけを保持して、高頻度語とその出現頻度を求めます。
+   出現頻度が N / top_k より大きい単語は必ず保持され、保持されている単語の出現頻度の過大評価の幅は N / top_k 以下です。
+   save_freq_distr で上位の単語のヒストグラムを作成するときに用います。
+
+どちらのデータ構造も、別々のプロセスで作成したものを merge で結合できます。
+"""
+
+import heapq
+import math
+import zlib
+from collections import Counter
+import numpy as np
+
+# 単語の 64bit ハッシュ値を作成するために、crc32 の二つ目の初期値として用いる定数
+CRC_SEED = 0x9E3779B9
+
+
+def word_hashes(words):
+    """
+    単語のリストから 64bit のハッシュ値の配列を作成する関数
+    プロセスごとに値が変わる組み込みの hash は、スケッチを結合できなくなるので用いない。
+    """
+    hashes = np.empty(len(words), dtype=np.uint64)
+    for idx, word in enumerate(words):
+        data = word.encode("utf-8")
+        hashes[idx] = zlib.crc32(data) | (zlib.crc32(data, CRC_SEED) << 32)
+    return hashes
+
+
+class CountMinSketch():
+    def __init__(self, width=2**20, depth=4, seed=1):
+        """
+        width:  各行のカウンタの数 (2のべき乗に切り上げる)
+        depth:  行の数(ハッシュ関数の数)
+        """
+        self.bits = max(1, math.ceil(math.log2(width)))
+        self.width = 1 << self.bits
+        self.depth = depth
+        # multiply-shift 法のハッシュ関数の係数 (全てのプロセスで同じ値を用いるために、シードを固定して作成する)
+        gen = np.random.RandomState(seed)
+        self.coef = gen.randint(1, 2**63 - 1, size=depth,
+                                dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.table = np.zeros((depth, self.width), dtype=np.uint32)
+        self.total = 0
+
+    @classmethod
+    def from_error(cls, eps, delta, seed=1):
+        """
+        確率 1 - delta 以上で、過大評価の幅が eps * N 以下になるようなスケッチを作成する関数
+        """
+        return cls(math.ceil(math.e / eps), math.ceil(math.log(1 / delta)), seed)
+
+    def buckets(self, hashes):
+        # 形状: (depth, 単語の数)
+        return (self.coef[:, None] * hashes[None, :]) >> np.uint64(64 - self.bits)
+
+    def add(self, words, counts):
+        """
+        単語のリスト words の各単語の出現頻度に counts を加える関数
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, idx in enumerate(self.buckets(word_hashes(words))):
+            self.table[row] += np.bincount(idx.astype(np.int64), weights=counts,
+                                           minlength=self.width).astype(np.uint32)
+        self.total += int(counts.sum())
+
+    def estimate(self, words):
+        """
+        単語のリスト words の各単語の出現頻度の推定値の配列を返す関数
+        """
+        idx = self.buckets(word_hashes(words)).astype(np.int64)
+        return self.table[np.arange(self.depth)[:, None], idx].min(axis=0)
+
+    def __getitem__(self, word):
+        return int(self.estimate([word])[0])
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth) or not np.array_equal(self.coef, other.coef):
+            raise ValueError(
+                "Error: Count-Min sketches with different parameters cannot be merged.")
+        self.table += other.table
+        self.total += other.total
+
+    def error_bound(self):
+        """
+        確率 1 - exp(-depth) 以上で成り立つ、過大評価の幅の上限を返す関数
+        """
+        return math.e / self.width * self.total
+
+
+class SpaceSaving():
+    def __init__(self, k=1000):
+        """
+        k:  保持するカウンタ(単語)の数
+        """
+        self.k = k
+        self.counts = {}
+        self.total = 0
+
+    def floor(self):
+        """
+        保持されていない単語の出現頻度の上限 (カウンタが k 個に満たないときは 0)
+        """
+        return min(self.counts.values()) if len(self.counts) >= self.k else 0
+
+    def update(self, counts, floor=0, total=None):
+        """
+        別の要約 (単語と出現頻度の辞書、保持されていない単語の出現頻度の上限 floor) を結合する関数
+        一部の文について正確に数えた出現頻度表を与えるときは floor=0 とする。
+        """
+        own_floor = self.floor()
+        merged = {word: count + counts.get(word, floor)
+                  for word, count in self.counts.items()}
+        for word, count in counts.items():
+            if word not in merged:
+                merged[word] = count + own_floor
+        if len(merged) > self.k:
+            merged = dict(heapq.nlargest(
+                self.k, merged.items(), key=lambda x: x[1]))
+        self.counts = merged
+        self.total += sum(counts.values()) if total is None else total
+
+    def merge(self, other):
+        self.update(other.counts, other.floor(), other.total)
+
+    def top(self, n):
+        """
+        出現頻度の推定値が大きい順に、上位 n 個の (単語, 出現頻度) のリストを返す関数
+        """
+        return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+    def error_bound(self):
+        return self.total / self.k
+
+
+class FreqSketch():
+    """
+    出現頻度表(辞書)の代わりに用いる、Count-Min スケッチと Space-Saving の組
+    freq_sketch[word] で出現頻度の推定値を、top(n) で高頻度語を求めることができる。
+    """
+
+    def __init__(self, width=2**20, depth=4, top_k=1000):
+        self.cms = CountMinSketch(width, depth)
+        self.ss = SpaceSaving(top_k)
+
+    def update(self, counter):
+        """
+        一部の文について正確に数えた出現頻度表 counter を加える関数
+        counter の大きさは、その文に含まれる異なり語数に限られる。
+        """
+        words = list(counter.keys())
+        self.cms.add(words, [counter[w] for w in words])
+        self.ss.update(counter)
+
+    def add_sents(self, sents, chunk_size=100000):
+        for head in range(0, len(sents), chunk_size):
+            counter = Counter()
+            for sent in sents[head:head + chunk_size]:
+                counter.update(sent.strip().split())
+            self.update(counter)
+
+    def merge(self, other):
+        self.cms.merge(other.cms)
+        self.ss.merge(other.ss)
+
+    def __getitem__(self, word):
+        return self.cms[word]
+
+    def estimate(self, words):
+        return self.cms.estimate(words)
+
+    def top(self, n):
+        return self.ss.top(n)
+
+    def nbytes(self):
+        return self.cms.table.nbytes
+
+    def summary(self):
+        return "Count-Min sketch {}x{} ({:.1f} MB, overestimate <= {:.1f} w.p. {:.3f}), Space-Saving top-{} (overestimate <= {:.1f})".format(
+            self.cms.depth, self.cms.width, self.nbytes() / 2**20, self.cms.error_bound(),
+            1 - math.exp(-self.cms.depth), self.ss.k, self.ss.error_bound())
+
+
+# テストコード
+if __name__ == "__main__":
+    gen = np.random.RandomState(0)
+    words = ["w{}".format(i) for i in gen.zipf(1.3, size=200000)]
+    exact = Counter(words)
+
+    sketch = FreqSketch(width=2**12, depth=4, top_k=100)
+    for head in range(0, len(words), 50000):
+        part = FreqSketch(width=2**12, depth=4, top_k=100)
+        part.update(Counter(words[head:head + 50000]))
+        sketch.merge(part)
+    print(sketch.summary())
+
+    vocab = list(exact.keys())
+    est = sketch.estimate(vocab)
+    true = np.array([exact[w] for w in vocab])
+    print("max overestimate: {}  (never underestimates: {})".format(
+        int((est - true).max()), bool((est >= true).all())))
+    print("top-10 (sketch):", sketch.top(10))
+    print("top-10 (exact): ", exact.most_common(10))
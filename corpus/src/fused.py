@@ -0,0 +1,105 @@
+"""
+=== DESCRIPTION
+このファイルには、クリーニング、トークン化、ペアごとの長さのフィルタを一つにまとめた処理(ステージ)が実装されています。
+
+パイプライン(pipeline.py)の各ステージを別々に実行すると、
+    - 各文は、クリーニングとトークン化のそれぞれで NFKC 正規化される
+    - 長さのフィルタで取り除かれるペアも、MeCab と MosesTokenizer でトークン化される
+fused_pairs 関数は、一つのペアに対して次の処理を順に行い、途中で取り除かれることが確定したペアはそこで処理を打ち切ります。
+
+    正規化とクリーニング -> 文字の種類の判定 -> 文字数による足切り -> トークン化(和文) -> トークン数による判定 -> トークン化(英文) -> 長さのフィルタ
+
+文字数による足切りでは、トークン化した後のトークン数は空白以外の文字数を超えないことを用いて、
+トークン数が min_len に届かないことが確実なペアだけを取り除きます。
+そのため、残るペアとその内容は、ステージごとに実行した場合 (clean_pairs -> tokenize_pairs -> len_filter_pairs) と全く同じになります。
+
+ratio_filter はコーパス全体の平均と標準偏差を用いるので、ペアごとの処理には含められません。
+"""
+
+import unicodedata
+from cleaning import denoise, is_en, is_ja
+import filter as fl
+import tokenize_enja as tkn
+
+# トークン化を行う関数は、ワーカープロセスごとに一度だけ作成する
+_tokenizers = None
+
+
+def get_tokenizers():
+    global _tokenizers
+    if _tokenizers is None:
+        tokenization = tkn.Tokenization()
+        _tokenizers = (tokenization.en_tokenizer(normalized=True),
+                       tokenization.ja_tokenizer(normalized=True))
+    return _tokenizers
+
+
+def nfkc(sent):
+    """
+    NFKC 正規化されていない文のみを正規化する関数
+    クリーニング済みの文は正規化済みなので、ほとんどの場合は確認だけで済む。
+    (正規化済みの文から一部を取り除くと、まれに正規化されていない文になることがある)
+    """
+    return sent if unicodedata.is_normalized("NFKC", sent) else unicodedata.normalize("NFKC", sent)
+
+
+def num_chars(sent):
+    """
+    空白以外の文字数 (トークン化した後のトークン数の上限) を返す関数
+    """
+    return len(''.join(sent.split()))
+
+
+def fused_pairs(en_sents, ja_sents, cleaning=True, script_thld=1.0, min_len=None, max_len=None,
+                budget=None, quarantine=None):
+    """
+    クリーニング、トークン化、長さのフィルタを一つのプロセス内でまとめて行う関数
+    (パイプライン処理の1ステージとして、小分けにしたペアごとに呼び出される)
+    cleaning=False のときはクリーニングを、min_len=None のときは長さのフィルタを行わない。
+    budget と quarantine は cleaning.denoise 関数を参照
+    """
+    if cleaning:
+        en_sents, ja_sents = denoise(en_sents, ja_sents, budget, quarantine)
+        keep = [en_tf and ja_tf for en_tf, ja_tf in zip(
+            is_en(en_sents, script_thld), is_ja(ja_sents, script_thld))]
+    else:
+        keep = [True] * min(len(en_sents), len(ja_sents))
+
+    tokenize_en, tokenize_ja = get_tokenizers()
+    en_ls, ja_ls = [], []
+    for en, ja, tf in zip(en_sents, ja_sents, keep):
+        if not tf:
+            continue
+        en, ja = nfkc(en), nfkc(ja)
+        if min_len is not None and (num_chars(en) < min_len or num_chars(ja) < min_len):
+            continue
+        # MeCab は MosesTokenizer よりも速いので、和文を先にトークン化する
+        ja = tokenize_ja(ja).replace('\t', '').strip()
+        if min_len is not None and len(ja.split()) < min_len:
+            continue
+        en = tokenize_en(en).replace('\t', '').strip()
+        en_ls.append(en)
+        ja_ls.append(ja)
+
+    if min_len is not None:
+        en_ls, ja_ls = fl.len_filter_pairs(en_ls, ja_ls, min_len, max_len, truncate=True)
+    return en_ls, ja_ls
+
+
+# テスト用コード
+if __name__ == "__main__":
+    from cleaning import clean_pairs
+
+    en_sents = ["I have to sleep.", "Hi.",
+                "Michael is twenty years old today. https://example.com",
+                "He said (私は日系アメリカ人二世です。).", "The password is Muriel."]
+    ja_sents = ["私は眠らなければなりません。", "やあ。",
+                "マイケルは今日２０歳になりました。",
+                "彼は「日系アメリカ人二世です。０IV」と言った。", "パスワードは「Muiriel」です。"]
+
+    expected = clean_pairs(en_sents, ja_sents)
+    expected = tkn.Tokenization().tokenize_pairs(*expected)
+    expected = fl.len_filter_pairs(*expected, min=4, max=32)
+    actual = fused_pairs(en_sents, ja_sents, min_len=4, max_len=32)
+    print(actual)
+    print(actual == expected)
@@ -0,0 +1,186 @@
+"""
+=== DESCRIPTION
+このファイルには、Back-Translation 用の単言語コーパスを作成する関数が実装されています。
+
+1. 単言語のファイル(一行一文)を一行ずつ読み込み、シードを固定したリザーバサンプリングで指定した数の文を抽出します。
+   ファイル全体をメモリに載せないので、どれだけ大きなファイルでも扱うことができます。
+2. 平行コーパス(corpus/genuine_bilingual)の train/valid/test に含まれる文は、ハッシュ値の集合を用いて取り除きます。
+3. 抽出した文を一定の大きさのファイル(例 monotext1.ja, monotext2.ja, ...)に分けて保存し、マニフェストを作成します。
+
+Back-Translation を並列に実行するときは、各ワーカーが claim_shard 関数で未処理のファイルを一つずつ確保します。
+確保はファイルの排他的な作成によって行うので、ワーカー同士で調整する必要はありません。
+"""
+
+import json
+import os
+import random as rd
+import numpy as np
+import tqdm as t
+import pair_index as pidx
+
+MANIFEST = "manifest.json"
+
+
+def normalize(sent):
+    return ' '.join(sent.split())
+
+
+def bilingual_hashes(repo_path, lang):
+    """
+    平行コーパスの train/valid/test に含まれる言語 lang の文のハッシュ値を、ソートした配列として返す関数
+    """
+    data_path = os.path.join(repo_path, "corpus/genuine_bilingual/")
+    manifest = pidx.load_manifest(data_path)
+    if not any(manifest[split] for split in pidx.SPLITS):
+        manifest = pidx.scan_manifest(data_path)
+
+    hashes = [np.zeros(0, dtype=np.uint64)]
+    for split in pidx.SPLITS:
+        for shard in manifest[split]:
+            with open(os.path.join(data_path, "{}.{}".format(shard["name"], lang)), 'r') as f:
+                hashes.append(pidx.hash_sents(
+                    [normalize(sent) for sent in f]))
+    return np.unique(np.concatenate(hashes))
+
+
+def read_chunks(path, chunk_size=10000):
+    """
+    ファイルを一行ずつ読み込み、空行を除いた文を chunk_size 文ずつまとめて返すジェネレータ関数
+    """
+    chunk = []
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            sent = normalize(line)
+            if not sent:
+                continue
+            chunk.append(sent)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def reservoir_sample(chunks, size, seed, exclude):
+    """
+    チャンクごとに与えられる文から、リザーバサンプリングで size 文を一様に抽出する関数
+    ハッシュ値が exclude (ソート済みの配列) に含まれる文は抽出の対象としない。
+    """
+    gen = rd.Random(seed)
+    reservoir, seen, dropped = [], 0, 0
+    for chunk in t.tqdm(chunks):
+        mask = pidx.contains(exclude, pidx.hash_sents(chunk))
+        dropped += int(mask.sum())
+        for sent, drop in zip(chunk, mask):
+            if drop:
+                continue
+            if seen < size:
+                reservoir.append(sent)
+            else:
+                idx = gen.randint(0, seen)
+                if idx < size:
+                    reservoir[idx] = sent
+            seen += 1
+
+    # リザーバ内の文の順序には入力の順序が残るので、最後にシャッフルする
+    gen.shuffle(reservoir)
+    print("{} sentences sampled from {} sentences ({} sentences dropped as they are in the bilingual corpus)".format(
+        len(reservoir), seen, dropped))
+    return reservoir
+
+
+def remove_shards(data_path):
+    path = os.path.join(data_path, MANIFEST)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding="utf-8") as f:
+        manifest = json.load(f)
+    for shard in manifest["shards"]:
+        shard_path = os.path.join(data_path, "{}.{}".format(
+            shard["name"], manifest["lang"]))
+        for p in (shard_path, shard_path + ".claim"):
+            if os.path.exists(p):
+                os.remove(p)
+    os.remove(path)
+
+
+def build_mono(path, lang, repo_path, size, shard_size=100000, seed=1):
+    """
+    単言語のファイル path から size 文を抽出し、shard_size 文ずつのファイルに分けて corpus/monolingual に保存する関数
+    """
+    data_path = os.path.join(repo_path, "corpus/monolingual/")
+    exclude = bilingual_hashes(repo_path, lang)
+
+    print("\nSampling sentences from {} ...".format(path))
+    sample = reservoir_sample(read_chunks(path), size, seed, exclude)
+
+    # 前回作成したファイルと、その確保を表すファイルを削除しておく
+    remove_shards(data_path)
+
+    shards = []
+    for idx, head in enumerate(range(0, len(sample), shard_size)):
+        name = "monotext{}".format(idx+1)
+        sents = sample[head:head + shard_size]
+        with open(os.path.join(data_path, "{}.{}".format(name, lang)), 'w', encoding="utf-8") as f:
+            for sent in sents:
+                f.write(sent + '\n')
+        shards.append({"name": name, "sents": len(sents)})
+        print("Finished writing {}.{}   ({} sents)".format(name, lang, len(sents)))
+
+    manifest = {"lang": lang, "source": os.path.abspath(path), "seed": seed,
+                "sents": len(sample), "shards": shards}
+    with open(os.path.join(data_path, MANIFEST), 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def claim_shard(repo_path, worker="worker"):
+    """
+    まだどのワーカーにも確保されていないファイルを一つ確保し、そのファイルのパスを返す関数
+    全てのファイルが確保済みのときは None を返す。
+    確保したことを表すファイル(例 monotext1.ja.claim)を排他的に作成するので、複数のプロセスやマシンから同時に呼び出してもよい。
+    """
+    data_path = os.path.join(repo_path, "corpus/monolingual/")
+    with open(os.path.join(data_path, MANIFEST), 'r', encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    for shard in manifest["shards"]:
+        path = os.path.join(data_path, "{}.{}".format(
+            shard["name"], manifest["lang"]))
+        try:
+            fd = os.open(path + ".claim", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write("{} {}\n".format(worker, os.getpid()))
+        return path
+    return None
+
+
+def release_shard(path):
+    """
+    claim_shard で確保したファイルを解放する関数 (処理に失敗したときに、他のワーカーが処理できるようにする)
+    """
+    os.remove(path + ".claim")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='usage')
+    parser.add_argument("--repo_path", type=str,
+                        help="absolute path of Machine_Translation_Proto repository")
+    parser.add_argument("--input", type=str,
+                        help="monolingual file (one sentence per line) to sample sentences from")
+    parser.add_argument("--lang", type=str, default="ja",
+                        help="language of the monolingual file (en or ja)")
+    parser.add_argument("--size", type=int, default=800000,
+                        help="the number of sentences to sample")
+    parser.add_argument("--shard_size", type=int, default=100000,
+                        help="the number of sentences contained in each shard")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed for sampling")
+    args = parser.parse_args()
+
+    build_mono(args.input, args.lang, args.repo_path,
+               args.size, args.shard_size, args.seed)
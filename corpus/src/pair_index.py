@@ -0,0 +1,204 @@
+"""
+=== DESCRIPTION
+このファイルには、corpus/genuine_bilingual に保存されているペアのハッシュ値の索引(インデックス)と、
+保存されているファイルの一覧(マニフェスト)を管理する関数が実装されています。
+
+索引は、各ペア(英文と和文)の64ビットのハッシュ値をソートした numpy 配列として index/ 以下に保存されます。
+    train.npy       訓練用データのペアのハッシュ値
+    eval.npy        評価用・テスト用データ(valid, test)のペアのハッシュ値
+    eval_sents.npy  評価用・テスト用データに含まれる各文(英文・和文)のハッシュ値
+
+索引はメモリマップで読み込んで二分探索するので、新しいペアの検索にかかる時間は新しいペアの数にほぼ比例します。
+"""
+
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+INDEX_DIR = "index"
+INDEX_NAMES = ["train", "eval", "eval_sents"]
+MANIFEST = "manifest.json"
+SPLITS = ["train", "valid", "test"]
+
+
+def sent_hash(sent):
+    return int.from_bytes(hashlib.blake2b(sent.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_pairs(en_sents, ja_sents):
+    """
+    各ペアのハッシュ値の配列を返す関数
+    ファイルに書き込まれる形式(英文と和文をタブで区切った形式)でハッシュ値を計算する。
+    """
+    return np.fromiter((sent_hash(en + '\t' + ja) for en, ja in zip(en_sents, ja_sents)),
+                       dtype=np.uint64, count=min(len(en_sents), len(ja_sents)))
+
+
+def hash_sents(sents):
+    return np.fromiter((sent_hash(sent) for sent in sents), dtype=np.uint64, count=len(sents))
+
+
+def index_path(data_path, name):
+    return os.path.join(data_path, INDEX_DIR, "{}.npy".format(name))
+
+
+def load_index(data_path, name):
+    """
+    索引を読み込む関数 (索引が存在しないときは空の配列を返す)
+    """
+    path = index_path(data_path, name)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.uint64)
+    return np.load(path, mmap_mode='r')
+
+
+def save_index(data_path, name, hashes, sorted=False):
+    """
+    索引を保存する関数 (sorted=True のときは、hashes がソート済みで重複を含まないものとみなす)
+    読み込み中の索引(メモリマップ)を壊さないように、一時ファイルに書き込んでから置き換える。
+    """
+    os.makedirs(os.path.join(data_path, INDEX_DIR), exist_ok=True)
+    path = index_path(data_path, name)
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, hashes if sorted else np.unique(hashes))
+    os.replace(path + ".tmp", path)
+
+
+def contains(index, hashes):
+    """
+    各ハッシュ値がソート済みの索引 index に含まれているかどうかを表す真偽値の配列を返す関数
+    """
+    if len(index) == 0:
+        return np.zeros(len(hashes), dtype=bool)
+    pos = np.searchsorted(index, hashes)
+    pos[pos == len(index)] = 0
+    return np.asarray(index)[pos] == hashes
+
+
+def merge_index(data_path, name, hashes):
+    """
+    索引に新しいハッシュ値を追加して保存する関数
+    索引全体をソートし直さずに、ソートした新しいハッシュ値を既存の索引の適切な位置に挿入する。
+    """
+    index = load_index(data_path, name)
+    hashes = np.unique(hashes)
+    hashes = hashes[~contains(index, hashes)]
+    merged = np.insert(np.asarray(index), np.searchsorted(index, hashes), hashes)
+    save_index(data_path, name, merged, sorted=True)
+
+
+def load_manifest(data_path):
+    """
+    マニフェストを読み込む関数 (マニフェストが存在しないときは空のマニフェストを返す)
+    マニフェストには、分割ごとに保存されているファイル名(拡張子を除く)と文の数が記録されている。
+    例 {"train": [{"name": "train1", "sents": 250000}, ...], "valid": [...], "test": [...]}
+    """
+    path = os.path.join(data_path, MANIFEST)
+    if not os.path.exists(path):
+        return {split: [] for split in SPLITS}
+    with open(path, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(data_path, manifest):
+    path = os.path.join(data_path, MANIFEST)
+    with open(path + ".tmp", 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def scan_manifest(data_path):
+    """
+    マニフェストが存在しない既存のデータセットについて、ファイル名(例 train1.en, train1.ja)からマニフェストを作成する関数
+    """
+    manifest = {split: [] for split in SPLITS}
+    shard = re.compile(r"(train|valid|test)(\d+)\.en")
+    for f_name in sorted(os.listdir(data_path)):
+        m = shard.fullmatch(f_name)
+        if m is None or not os.path.exists(os.path.join(data_path, f_name[:-3] + ".ja")):
+            continue
+        with open(os.path.join(data_path, f_name), 'r') as f:
+            sents = sum(1 for _ in f)
+        manifest[m.group(1)].append(
+            (int(m.group(2)), {"name": f_name[:-3], "sents": sents}))
+
+    for split in SPLITS:
+        manifest[split] = [shard for _, shard in sorted(
+            manifest[split], key=lambda x: x[0])]
+    return manifest
+
+
+def read_shard(data_path, name):
+    with open(os.path.join(data_path, name + ".en"), 'r') as f_en, open(os.path.join(data_path, name + ".ja"), 'r') as f_ja:
+        en_sents = [en.rstrip('\n') for en in f_en]
+        ja_sents = [ja.rstrip('\n') for ja in f_ja]
+    return en_sents, ja_sents
+
+
+def build_index(data_path):
+    """
+    マニフェストに記録されている全てのファイルを読み込んで、索引を作り直す関数
+    索引が存在しない既存のデータセットに対して、一度だけ実行すればよい。
+    (マニフェストも存在しないときは、ファイル名からマニフェストを作成する)
+    """
+    manifest = load_manifest(data_path)
+    if not any(manifest[split] for split in SPLITS):
+        manifest = scan_manifest(data_path)
+        save_manifest(data_path, manifest)
+
+    train, evals, eval_sents = [], [], []
+    for split in SPLITS:
+        for shard in manifest[split]:
+            en_sents, ja_sents = read_shard(data_path, shard["name"])
+            if split == "train":
+                train.append(hash_pairs(en_sents, ja_sents))
+            else:
+                evals.append(hash_pairs(en_sents, ja_sents))
+                eval_sents.append(hash_sents(en_sents))
+                eval_sents.append(hash_sents(ja_sents))
+
+    empty = [np.zeros(0, dtype=np.uint64)]
+    save_index(data_path, "train", np.concatenate(train + empty))
+    save_index(data_path, "eval", np.concatenate(evals + empty))
+    save_index(data_path, "eval_sents", np.concatenate(eval_sents + empty))
+
+
+def ensure_index(data_path):
+    """
+    マニフェストと索引がそろっていることを確かめ、欠けているときは保存されているファイルから作り直す関数
+    (マニフェストや索引がない既存のデータセットに追加するときに、既存のファイルを上書きしたり、重複の判定を誤ったりしないようにする)
+    """
+    os.makedirs(data_path, exist_ok=True)
+    rebuild = False
+    if not os.path.exists(os.path.join(data_path, MANIFEST)):
+        print("\nNo manifest found in {}. Scanning the existing files...".format(data_path))
+        save_manifest(data_path, scan_manifest(data_path))
+        rebuild = True
+    if rebuild or not all(os.path.exists(index_path(data_path, name)) for name in INDEX_NAMES):
+        print("\nBuilding the pair index from the existing files...")
+        build_index(data_path)
+
+
+def next_shard(data_path, split, manifest):
+    """
+    split の次のファイルの番号を返す関数
+    マニフェストに記録されていないファイル(例 train3.en)があっても上書きしないように、保存されているファイル名も確かめる。
+    """
+    shard = re.compile(r"{}(\d+)(?:\.en|\.ja)?".format(split))
+    names = [s["name"] for s in manifest[split]] + os.listdir(data_path)
+    nums = [int(m.group(1)) for m in map(shard.fullmatch, names) if m is not None]
+    return max(nums, default=0) + 1
+
+
+# 既存のデータセットの索引を作成する
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='usage')
+    parser.add_argument("--repo_path", type=str,
+                        help="absolute path of Machine_Translation_Proto repository")
+    args = parser.parse_args()
+
+    build_index(os.path.join(args.repo_path, "corpus/genuine_bilingual/"))
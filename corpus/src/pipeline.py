@@ -0,0 +1,179 @@
+"""
+=== DESCRIPTION
+このファイルには、データセット作成の各処理(ステージ)を並行して実行するパイプラインが実装されています。
+
+    読み込み -> クリーニング -> トークン化 -> ペアごとのフィルタ -> 書き込み(集約)
+
+書き込みステージは、run に sink を与えたときは届いたチャンクをそのまま sink に渡してファイルに書き込み(split_dataset.StreamingSplit)、
+与えないときは全てのチャンクを集めて元の順序で返します。(その後のフィルタや split_dataset が全てのペアを必要とするため)
+
+ペアは小分け(チャンク)にしてステージ間を流れ、各ステージには指定した数のワーカープロセスが割り当てられます。
+ステージ間は上限付きのキューでつながっているので、後段のステージが遅いときは前段のステージが待たされ(バックプレッシャー)、
+メモリ上に溜まるチャンクの数は一定に保たれます。
+
+全てのステージが同時に動くので、処理全体にかかる時間は、各ステージの処理時間の合計ではなく、
+最も遅いステージの処理時間に近づきます。
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import wait
+
+# キューの終端を表す値
+STOP = None
+
+
+class Stage():
+    def __init__(self, name, fun, workers=1):
+        """
+        name:       ステージ名 (進捗の表示に用いる)
+        fun:        英文と和文のリストを受け取り、処理後の英文と和文のリストを返す関数
+        workers:    このステージに割り当てるプロセス数
+        """
+        self.name = name
+        self.fun = fun
+        self.workers = workers
+
+
+def stage_worker(stage, in_q, out_q):
+    """
+    キューからチャンクを取り出し、ステージの処理を施して次のキューに入れる関数
+    STOP を受け取ったら終了する。
+    """
+    busy, num_chunks = 0.0, 0
+    while True:
+        item = in_q.get()
+        if item is STOP:
+            break
+        idx, en_sents, ja_sents = item
+        start = time.time()
+        en_sents, ja_sents = stage.fun(en_sents, ja_sents)
+        busy += time.time() - start
+        num_chunks += 1
+        out_q.put((idx, en_sents, ja_sents))
+
+    print("Stage {} (Process ID: {}) finished: {} chunks, {:.1f} seconds busy".format(
+        stage.name, os.getpid(), num_chunks, busy))
+
+
+class Pipeline():
+    def __init__(self, stages, queue_size=4, chunk_size=10000):
+        """
+        stages:     Stage のリスト (先頭から順に適用される)
+        queue_size: 各ステージ間のキューに溜められるチャンク数の上限
+        chunk_size: 一つのチャンクに含まれるペアの数
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.num_chunks = 0
+        self.error = None
+
+    def feed(self, queue, en_sents, ja_sents):
+        """
+        読み込みステージ: 英文と和文のリストをチャンクに分けて最初のキューに入れる
+        """
+        num_sents = min(len(en_sents), len(ja_sents))
+        self.num_chunks = len(range(0, num_sents, self.chunk_size))
+        for idx, head in enumerate(range(0, num_sents, self.chunk_size)):
+            tail = min(head + self.chunk_size, num_sents)
+            queue.put((idx, en_sents[head:tail], ja_sents[head:tail]))
+        for _ in range(self.stages[0].workers):
+            queue.put(STOP)
+
+    def find_failed(self, procs):
+        """
+        異常終了した(例外、OOM による強制終了、MeCab のセグメンテーション違反など)プロセスがあれば、その説明を返す関数
+        """
+        for stage, stage_procs in zip(self.stages, procs):
+            for proc in stage_procs:
+                if proc.exitcode not in (None, 0):
+                    return "a worker of stage {} (Process ID: {}) exited with code {}".format(
+                        stage.name, proc.pid, proc.exitcode)
+        return None
+
+    def shutdown(self, procs, queues):
+        """
+        前段のステージの全プロセスが終了してから、後段のステージのプロセス数だけ STOP を送る
+        いずれかのプロセスが異常終了したときは、全てのプロセスを終了させて、その原因を self.error に記録する。
+        (異常終了したプロセスが処理していたチャンクは失われ、前段のプロセスはキューが空かずに止まってしまうため)
+        """
+        for k, stage_procs in enumerate(procs):
+            while True:
+                self.error = self.find_failed(procs)
+                if self.error is not None:
+                    for proc in (proc for stage_procs in procs for proc in stage_procs):
+                        if proc.is_alive():
+                            proc.terminate()
+                    return
+                if not any(proc.is_alive() for proc in stage_procs):
+                    break
+                # いずれかのプロセスが終了するまで待つ
+                wait([proc.sentinel for stage_procs in procs for proc in stage_procs if proc.is_alive()],
+                     timeout=1.0)
+            workers = self.stages[k+1].workers if k+1 < len(self.stages) else 1
+            for _ in range(workers):
+                queues[k+1].put(STOP)
+
+    def run(self, en_sents, ja_sents, sink=None):
+        """
+        パイプラインを実行し、全てのステージを通過したペアを元の順序で返す関数
+        sink:   英文と和文のリストを受け取る関数。与えたときは、最後のステージから届いたチャンクを届いた順にすぐ sink に渡し、
+                他のステージの実行中に書き込みを進める。(ペアはメモリに溜めず、None を返す)
+        """
+        queues = [mp.Queue(maxsize=self.queue_size)
+                  for _ in range(len(self.stages) + 1)]
+        procs = []
+        for k, stage in enumerate(self.stages):
+            stage_procs = []
+            for _ in range(stage.workers):
+                proc = mp.Process(target=stage_worker, args=[
+                                  stage, queues[k], queues[k+1]])
+                proc.start()
+                stage_procs.append(proc)
+            procs.append(stage_procs)
+
+        feeder = threading.Thread(target=self.feed, args=[
+                                  queues[0], en_sents, ja_sents], daemon=True)
+        closer = threading.Thread(target=self.shutdown, args=[
+                                  procs, queues], daemon=True)
+        feeder.start()
+        closer.start()
+
+        # 書き込み(集約)ステージ: チャンクは終了した順に届くので、sink がないときはインデックス順に並べ直す
+        chunks, received = {}, set()
+        while True:
+            try:
+                item = queues[-1].get(timeout=1.0)
+            except queue.Empty:
+                if self.error is not None:
+                    break
+                continue
+            if item is STOP:
+                break
+            idx, en_ls, ja_ls = item
+            received.add(idx)
+            if sink is not None:
+                sink(en_ls, ja_ls)
+            else:
+                chunks[idx] = (en_ls, ja_ls)
+
+        closer.join()
+        if self.error is not None:
+            raise RuntimeError("The pipeline failed: {}".format(self.error))
+        feeder.join()
+        missing = sorted(set(range(self.num_chunks)) - received)
+        if missing:
+            raise RuntimeError("The pipeline lost {} of {} chunks (e.g. chunk {})".format(
+                len(missing), self.num_chunks, missing[0]))
+        if sink is not None:
+            return None
+
+        en_ls, ja_ls = [], []
+        for idx in sorted(chunks):
+            en_ls.extend(chunks[idx][0])
+            ja_ls.extend(chunks[idx][1])
+        return en_ls, ja_ls
@@ -0,0 +1,180 @@
+"""
+=== DESCRIPTION
+このファイルには、文字(コードポイント)を文字種に対応付ける表を用いた、英文・和文の判定機能が実装されています。
+
+全コードポイント(U+0000 ~ U+10FFFF)に対する文字種とEN/JAの許容フラグを、一度だけ numpy の配列(約1.1MB)として作成しておきます。
+判定時には、文のリストをまとめて UTF-32 の配列に変換し、表を引くだけで各文の文字種の割合を求めます。
+そのため、正規表現を一文ずつ fullmatch するよりも、大量の文を高速に判定できます。
+
+判定のしきい値 threshold は「許容される文字の割合」の下限です。
+threshold=1.0 のときは、従来の is_en / is_ja (正規表現の fullmatch) と同じ判定結果になります。
+"""
+
+import re
+import regex
+import numpy as np
+
+# 従来の is_en / is_ja で用いていた文字クラス
+# 表の作成に用いるので、判定結果を一致させるために内容を変更しないこと
+EN_CHARS = re.compile("""[a-zA-Z   # アルファベット
+                        0-9      # アラビア数字
+                        \u2160-\u2188   # ローマ数字
+                        \u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E   # ASCII記号の半角版
+    ]+""")
+
+JA_CHARS = regex.compile("""[\u3041-\u309F                    # ひらがな
+                            \u30A1-\u30FF\uFF66-\uFF9F      # カタカナ
+                            0-9０-９                        # アラビア数字
+                            \p{Numeric_Type=Numeric}        # 漢数字、ローマ数字
+                            \p{Script_Extensions=Han}       # 漢字
+                            # ASCII文字(記号)の半角版
+                            \u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E
+                            # ASCII文字(記号)全角版と日本語の記号の半角版
+                            \uFF01-\uFF0F\uFF1A-\uFF20\uFF3B-\uFF40\uFF5B-\uFF65\u3000-\u303F
+    ]+""")
+
+# 文字種 (表の下位3ビット)
+LATIN, KANA, HAN, DIGIT, SYMBOL, OTHER = range(6)
+SCRIPTS = ["latin", "kana", "han", "digit", "symbol", "other"]
+NUM_SCRIPTS = len(SCRIPTS)
+
+# 文字種ごとの文字クラス (後に書かれたものが優先される)
+SCRIPT_CHARS = [
+    (SYMBOL, regex.compile("[\u0020-\u002F\u003A-\u0040\u005B-\u0060\u007B-\u007E"
+                           "\uFF01-\uFF0F\uFF1A-\uFF20\uFF3B-\uFF40\uFF5B-\uFF65\u3000-\u303F]+")),
+    (DIGIT, regex.compile("[0-9０-９\u2160-\u2188\\p{Numeric_Type=Numeric}]+")),
+    (LATIN, regex.compile("[a-zA-Zａ-ｚＡ-Ｚ]+")),
+    (KANA, regex.compile("[\u3041-\u309F\u30A1-\u30FF\uFF66-\uFF9F]+")),
+    (HAN, regex.compile(r"\p{Script=Han}+")),
+]
+
+SCRIPT_MASK = 0x07
+EN_BIT = 0x08
+JA_BIT = 0x10
+LANG_BITS = {"en": EN_BIT, "ja": JA_BIT}
+
+NUM_CODEPOINTS = 0x110000
+
+_table = None
+
+
+def build_table():
+    """
+    全コードポイントに対する文字種とEN/JAの許容フラグの表を作成する関数
+    各文字クラスを全コードポイントを並べた文字列に一度だけ適用して作成する。
+    """
+    table = np.full(NUM_CODEPOINTS, OTHER, dtype=np.uint8)
+    codepoints = ''.join(map(chr, range(NUM_CODEPOINTS)))
+
+    for script, chars in SCRIPT_CHARS:
+        for m in chars.finditer(codepoints):
+            table[m.start():m.end()] = script
+    for bit, chars in ((EN_BIT, EN_CHARS), (JA_BIT, JA_CHARS)):
+        for m in chars.finditer(codepoints):
+            table[m.start():m.end()] |= bit
+
+    return table
+
+
+def get_table():
+    """
+    表を返す関数 (初回の呼び出し時にのみ作成する)
+    fork したワーカープロセスは親プロセスで作成済みの表をそのまま共有する。
+    """
+    global _table
+    if _table is None:
+        _table = build_table()
+    return _table
+
+
+def lookup(sents):
+    """
+    文のリストをまとめて表で引き、(各文字の表の値, 各文の先頭位置, 各文の末尾位置) を返す関数
+    """
+    lens = np.fromiter(map(len, sents), dtype=np.int64, count=len(sents))
+    ends = np.cumsum(lens)
+    starts = ends - lens
+    buf = np.frombuffer(''.join(sents).encode(
+        "utf-32-le", "surrogatepass"), dtype=np.uint32)
+    return get_table()[buf], starts, ends
+
+
+def count_segments(flags, starts, ends):
+    """
+    各文(starts[i]からends[i]まで)に含まれる真の要素の数を数える関数
+    """
+    cum = np.zeros(len(flags) + 1, dtype=np.int64)
+    np.cumsum(flags, out=cum[1:])
+    return cum[ends] - cum[starts]
+
+
+def script_ratios(sents, batch_size=100000):
+    """
+    各文に含まれる文字種ごとの割合を返す関数
+    返り値の形状は (文の数, NUM_SCRIPTS) で、列の並びは SCRIPTS と同じ。
+    空文の行はすべて 0 になる。
+    """
+    ratios = np.zeros((len(sents), NUM_SCRIPTS), dtype=np.float64)
+    for head in range(0, len(sents), batch_size):
+        batch = sents[head:head + batch_size]
+        codes, starts, ends = lookup(batch)
+        lens = np.maximum(ends - starts, 1)
+        seg = np.repeat(np.arange(len(batch)), ends - starts)
+        counts = np.bincount(seg * NUM_SCRIPTS + (codes & SCRIPT_MASK),
+                             minlength=len(batch) * NUM_SCRIPTS)
+        ratios[head:head + len(batch)] = counts.reshape(
+            len(batch), NUM_SCRIPTS) / lens[:, None]
+    return ratios
+
+
+def lang_ratios(sents, lang, batch_size=100000):
+    """
+    各文に含まれる文字のうち、言語 lang ("en" または "ja") の文として許容される文字の割合を返す関数
+    空文の割合は 0 になる。
+    """
+    if lang not in LANG_BITS:
+        raise ValueError("Error: Language %s is not supported." % lang)
+
+    bit = LANG_BITS[lang]
+    ratios = np.zeros(len(sents), dtype=np.float64)
+    for head in range(0, len(sents), batch_size):
+        batch = sents[head:head + batch_size]
+        codes, starts, ends = lookup(batch)
+        counts = count_segments((codes & bit) != 0, starts, ends)
+        ratios[head:head + len(batch)] = counts / \
+            np.maximum(ends - starts, 1)
+    return ratios
+
+
+def classify(sents, lang, threshold=1.0, batch_size=100000):
+    """
+    各文が言語 lang の文であるかどうかを判定し、真偽値の配列を返す関数
+    許容される文字の割合が threshold 以上の文を lang の文とみなす。(空文は常に偽)
+    """
+    return lang_ratios(sents, lang, batch_size) >= max(threshold, np.finfo(np.float64).tiny)
+
+
+# テスト用コード
+if __name__ == "__main__":
+    import time
+
+    en_sents = ["I have a pen.", "He said (私は日系アメリカ人二世です。).",
+                "er wurde in haarlem als sohn von aart jansz geboren.", "Größe", ""]
+    ja_sents = ["私はペンを持っています。", "彼は「日系アメリカ人二世です。０IV」と言った。",
+                "私は pen を持っています。", "私はペン😀を持っています。", ""]
+
+    print(classify(en_sents, "en"))
+    print(classify(ja_sents, "ja"))
+    print(classify(ja_sents, "ja", threshold=0.9))
+    print(script_ratios(ja_sents))
+
+    # 正規表現の fullmatch との判定結果・処理時間の比較
+    sents = (en_sents + ja_sents) * 100000
+    start = time.time()
+    expected = [EN_CHARS.fullmatch(s) is not None for s in sents]
+    print("fullmatch:   %.2f seconds" % (time.time() - start))
+    get_table()
+    start = time.time()
+    actual = classify(sents, "en").tolist()
+    print("table:       %.2f seconds" % (time.time() - start))
+    print("identical decisions: {}".format(expected == actual))
@@ -0,0 +1,155 @@
+"""
+=== DESCRIPTION
+このファイルには、大量の文をメモリ上にコンパクトに保持するための SentenceArray が実装されています。
+
+SentenceArray は、全ての文を UTF-8 で連結した一つのバイト列と、各文の開始位置を表す numpy 配列(offsets)から成ります。
+Python の str のリストと比べて、文ごとのオブジェクトを持たないので、数百万文を保持するときのメモリ使用量が大幅に少なくなります。
+
+    len(arr), arr[i]        リストと同じように文の数を求めたり、i番目の文(str)を取り出したりできる
+    arr[head:tail]          バイト列をコピーせずに、一部の文を参照する SentenceArray を返す
+    arr[mask], arr[idx]     真偽値の配列やインデックスの配列で選択した文から成る SentenceArray を返す
+    for sent in arr         リストと同じように文(str)を順に取り出せる
+
+filter.py のフィルタ関数や split_dataset.py の関数は、str のリストと SentenceArray のどちらも受け取ることができ、
+受け取った型と同じ型で結果を返します。
+"""
+
+from array import array
+import numpy as np
+
+
+class SentenceArray():
+    def __init__(self, buf, offsets):
+        """
+        buf:        全ての文を UTF-8 で連結したバイト列
+        offsets:    各文の開始位置と、最後の文の終了位置を並べた配列 (長さは文の数 + 1)
+        """
+        self.buf = buf
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_iter(cls, sents):
+        """
+        文(str)を順に取り出せるオブジェクトから SentenceArray を作成する関数
+        """
+        builder = SentenceArrayBuilder()
+        for sent in sents:
+            builder.append(sent)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return SentenceArray(self.buf, self.offsets[start:max(start, stop)+1])
+            key = np.arange(start, stop, step)
+
+        if isinstance(key, (int, np.integer)):
+            idx = key + len(self) if key < 0 else key
+            if not 0 <= idx < len(self):
+                raise IndexError("SentenceArray index out of range")
+            return bytes(self.buf[self.offsets[idx]:self.offsets[idx+1]]).decode("utf-8")
+
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.nonzero(key)[0]
+        return self.take(key)
+
+    def __iter__(self):
+        buf = self.buf
+        offsets = self.offsets.tolist()
+        for head, tail in zip(offsets[:-1], offsets[1:]):
+            yield bytes(buf[head:tail]).decode("utf-8")
+
+    def __reduce__(self):
+        # スライスで共有しているバイト列全体を送らないように、必要な部分だけを複製してから pickle する
+        head, tail = self.offsets[0], self.offsets[-1]
+        return (SentenceArray, (bytes(self.buf[head:tail]), self.offsets - head))
+
+    def take(self, idx):
+        """
+        インデックスの配列 idx で指定した文から成る、新しい SentenceArray を返す関数
+        """
+        heads = self.offsets[idx]
+        tails = self.offsets[np.asarray(idx) + 1]
+        offsets = np.zeros(len(heads) + 1, dtype=np.int64)
+        np.cumsum(tails - heads, out=offsets[1:])
+        view = memoryview(self.buf)
+        buf = b''.join([view[head:tail]
+                       for head, tail in zip(heads.tolist(), tails.tolist())])
+        return SentenceArray(buf, offsets)
+
+    def lengths(self):
+        """
+        各文のバイト数の配列を返す関数
+        """
+        return np.diff(self.offsets)
+
+    def tolist(self):
+        return list(self)
+
+    def write(self, f):
+        """
+        各文を一行ずつバイナリモードのファイル f に書き込む関数
+        """
+        view = memoryview(self.buf)
+        offsets = self.offsets.tolist()
+        for head, tail in zip(offsets[:-1], offsets[1:]):
+            f.write(view[head:tail])
+            f.write(b'\n')
+
+
+class SentenceArrayBuilder():
+    """
+    文を一つずつ追加して SentenceArray を作成するためのクラス
+    str のリストと同じように append で文を追加し、最後に build を呼び出す。
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.offsets = array('q', [0])
+
+    def append(self, sent):
+        self.buf += sent.encode("utf-8")
+        self.offsets.append(len(self.buf))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def build(self):
+        return SentenceArray(bytes(self.buf), np.frombuffer(self.offsets, dtype=np.int64).copy())
+
+
+def empty_like(sents):
+    """
+    sents と同じ型の結果を作成するための、空のリストまたは SentenceArrayBuilder を返す関数
+    """
+    return SentenceArrayBuilder() if isinstance(sents, SentenceArray) else []
+
+
+def finish(sents):
+    """
+    empty_like で作成したオブジェクトを、リストまたは SentenceArray に変換する関数
+    """
+    return sents.build() if isinstance(sents, SentenceArrayBuilder) else sents
+
+
+def select(sents, mask):
+    """
+    真偽値の配列 mask で選択した文を、sents と同じ型で返す関数
+    """
+    if isinstance(sents, SentenceArray):
+        return sents[np.asarray(mask, dtype=bool)]
+    return [sent for sent, keep in zip(sents, mask) if keep]
+
+
+def gather(sents, idx):
+    """
+    インデックスの配列 idx で指定した文を、sents と同じ型で返す関数
+    """
+    if isinstance(sents, SentenceArray):
+        return sents.take(np.asarray(idx, dtype=np.int64))
+    return [sents[i] for i in idx]
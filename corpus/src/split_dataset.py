@@ -1,8 +1,9 @@
-import random as rd
 import tqdm as t
 import typing
 import numpy as np
 import os
+import pair_index as pidx
+import sentence_array as sa
 
 
 def replace_all(text, pattern: typing.Dict[str, str]):
@@ -23,40 +24,70 @@ def check_ratio(split_ratio: typing.Dict[str, float]):
     return False if len(ratio) != 3 or not all([val > 0.0 for val in vals]) or not (1.0 - eps < sum < 1.0 + eps) else True
 
 
-def write_ds(f_name, f_path, bitexts, div_size):
+def sanitize(sents):
+    """
+    各文からタブと改行を取り除く関数 (sents と同じ型で返す)
+    SentenceArray にタブと改行が含まれていないときは、そのまま返す。
+    """
+    pattern = {'\t': '', '\n': ''}
+    if isinstance(sents, sa.SentenceArray):
+        head, tail = int(sents.offsets[0]), int(sents.offsets[-1])
+        if sents.buf.find(b'\t', head, tail) < 0 and sents.buf.find(b'\n', head, tail) < 0:
+            return sents
+        return sa.SentenceArray.from_iter(replace_all(sent, pattern) for sent in sents)
+    return [replace_all(sent, pattern) for sent in sents]
+
+
+def write_lines(path, sents):
+    if isinstance(sents, sa.SentenceArray):
+        with open(path, 'wb') as f:
+            sents.write(f)
+    else:
+        with open(path, 'w') as f:
+            for sent in t.tqdm(sents):
+                f.write(sent + '\n')
+
+
+def write_ds(f_name, f_path, en_sents, ja_sents, div_size, start=1):
     """
     作成したデータセットをファイルに書き込む関数
     複数ファイルへの分割書き込みに対応 (大きなデータセットの場合に有効)
+    ファイル名の番号は start から始まる。書き込んだファイルの一覧(マニフェストの形式)を返す。
     """
-    total = len(bitexts)
+    total = min(len(en_sents), len(ja_sents))
     num_split = 1 if div_size >= total else int(total / div_size)
     size = total if div_size >= total else div_size
     num_split = num_split if num_split * size == total else num_split+1
+    shards = []
 
     for idx in range(num_split):
-        en_path = os.path.join(f_path, "{}{}.en".format(f_name, idx+1))
-        ja_path = os.path.join(f_path, "{}{}.ja".format(f_name, idx+1))
-        with open(en_path, 'w') as f_en, open(ja_path, 'w') as f_ja:
-            print("\nWriting {}{}.en and {}{}.ja ...".format(
-                f_name, idx+1, f_name, idx+1))
-            head = idx * size
-            tail = total if idx == (num_split-1) else (idx+1) * size
-            for bitext in t.tqdm(bitexts[head:tail]):
-                en, ja = bitext.split('\t')
-                f_en.write(en + '\n')
-                f_ja.write(ja + '\n')
-            print("Finished writing {}{}.en and {}{}.ja   ({} sents)".format(
-                f_name, idx+1, f_name, idx+1, tail-head))
+        num = start + idx
+        print("\nWriting {}{}.en and {}{}.ja ...".format(
+            f_name, num, f_name, num))
+        head = idx * size
+        tail = total if idx == (num_split-1) else (idx+1) * size
+        write_lines(os.path.join(f_path, "{}{}.en".format(
+            f_name, num)), en_sents[head:tail])
+        write_lines(os.path.join(f_path, "{}{}.ja".format(
+            f_name, num)), ja_sents[head:tail])
+        print("Finished writing {}{}.en and {}{}.ja   ({} sents)".format(
+            f_name, num, f_name, num, tail-head))
+        shards.append({"name": "{}{}".format(f_name, num), "sents": tail-head})
+
+    return shards
 
 
 def split_dataset(en_sents, ja_sents, split_ratio: typing.Dict[str, float], repo_path, div_size=1000000, div_train=False, div_valid=False, div_test=False):
+    """
+    データセットをシャッフルしてから訓練用・評価用・テスト用データに分割し、ファイルに書き込む関数
+    en_sents, ja_sents には str のリストと SentenceArray のどちらも指定できる。
+    (ペアを連結した文字列を作らずに、インデックスの配列をシャッフルして分割する)
+    """
     data_path = os.path.join(repo_path, "corpus/genuine_bilingual/")
-    pattern = {'\t': '', '\n': ''}
-    en_ja = [replace_all(en, pattern) + '\t' + replace_all(ja, pattern)
-             for en, ja in zip(en_sents, ja_sents)]
-    rd.shuffle(en_ja)
+    en_sents, ja_sents = sanitize(en_sents), sanitize(ja_sents)
 
-    total = len(en_ja)
+    total = min(len(en_sents), len(ja_sents))
+    perm = np.random.permutation(total)
     if check_ratio:
         train_size = int(split_ratio["train"] * total)
         #train_size = 182423
@@ -64,16 +95,159 @@ def split_dataset(en_sents, ja_sents, split_ratio: typing.Dict[str, float], repo
         #valid_size = 5404
         test_size = total - (train_size + valid_size)
         #test_size = 5404
-        train = en_ja[:train_size]
-        valid = en_ja[train_size:train_size + valid_size]
-        test = en_ja[train_size + valid_size:]
+        splits = {
+            "train": perm[:train_size],
+            "valid": perm[train_size:train_size + valid_size],
+            "test": perm[train_size + valid_size:]
+        }
 
         # 各データセットを分割する場合は、分割後のサイズを指定する。
         # 分割後の各ファイルのサイズが、分割前のサイズ(例 len(valid) や len(test)など)
         # を上回る場合は分割前のサイズに合わせて保存される
-        _size = div_size if div_train else train_size
-        write_ds('train', data_path, train, _size)
-        _size = div_size if div_valid else valid_size
-        write_ds('valid', data_path, valid, _size)
-        _size = div_size if div_test else test_size
-        write_ds('test', data_path, test, _size)
+        div = {"train": div_train, "valid": div_valid, "test": div_test}
+        manifest, hashes = {}, {"train": [], "eval": [], "eval_sents": []}
+        for split, idx in splits.items():
+            en_ls, ja_ls = sa.gather(en_sents, idx), sa.gather(ja_sents, idx)
+            _size = div_size if div[split] else len(idx)
+            manifest[split] = write_ds(split, data_path, en_ls, ja_ls, _size)
+
+            # 後からペアを追加するときのために、索引を作成しておく
+            if split == "train":
+                hashes["train"].append(pidx.hash_pairs(en_ls, ja_ls))
+            else:
+                hashes["eval"].append(pidx.hash_pairs(en_ls, ja_ls))
+                hashes["eval_sents"].append(pidx.hash_sents(en_ls))
+                hashes["eval_sents"].append(pidx.hash_sents(ja_ls))
+
+        pidx.save_manifest(data_path, manifest)
+        for name, arrays in hashes.items():
+            pidx.save_index(data_path, name, np.concatenate(arrays))
+
+
+class StreamingSplit():
+    def __init__(self, split_ratio: typing.Dict[str, float], repo_path, div_size=1000000,
+                 div_train=False, div_valid=False, div_test=False, seed=None):
+        """
+        パイプラインの最後のステージから届いたチャンクを、その場で訓練用・評価用・テスト用データのファイルに書き込むクラス
+        split_dataset と異なり全てのペアを集めてからシャッフルしないので、書き込みを他のステージと並行して行える。
+        各ペアは split_ratio の確率でいずれかのデータに割り当てられ、チャンクの中でシャッフルされる。
+        (そのため、各データの大きさは split_ratio にほぼ比例するが、split_dataset のように正確には一致しない)
+        ファイル名、マニフェスト、索引は split_dataset と同じ形式で作成する。(close を呼び出したときに保存する)
+        """
+        self.data_path = os.path.join(repo_path, "corpus/genuine_bilingual/")
+        self.splits = list(split_ratio)
+        ratio = np.array([split_ratio[split] for split in self.splits], dtype=np.float64)
+        self.ratio = ratio / ratio.sum()
+        div = {"train": div_train, "valid": div_valid, "test": div_test}
+        self.div_size = {split: div_size if div.get(split) else None for split in self.splits}
+        self.rng = np.random.default_rng(seed)
+        self.manifest = {split: [] for split in self.splits}
+        self.files = {}
+        self.hashes = {"train": [], "eval": [], "eval_sents": []}
+
+    def open_shard(self, split):
+        name = "{}{}".format(split, len(self.manifest[split]) + 1)
+        print("\nWriting {}.en and {}.ja ...".format(name, name))
+        self.manifest[split].append({"name": name, "sents": 0})
+        self.files[split] = [open(os.path.join(self.data_path, "{}.{}".format(name, lang)), 'w', encoding="utf-8")
+                             for lang in ("en", "ja")]
+
+    def close_shard(self, split):
+        for f in self.files.pop(split):
+            f.close()
+        shard = self.manifest[split][-1]
+        print("Finished writing {}.en and {}.ja   ({} sents)".format(shard["name"], shard["name"], shard["sents"]))
+
+    def write_split(self, split, en_ls, ja_ls):
+        """
+        ペアを split の書き込み中のファイルに追加する関数 (ファイルが div_size に達したら、次のファイルに切り替える)
+        """
+        head = 0
+        while head < len(en_ls):
+            if split not in self.files:
+                self.open_shard(split)
+            shard = self.manifest[split][-1]
+            tail = len(en_ls)
+            if self.div_size[split] is not None:
+                tail = min(tail, head + self.div_size[split] - shard["sents"])
+            for f, sents in zip(self.files[split], (en_ls, ja_ls)):
+                f.write(''.join(sent + '\n' for sent in sents[head:tail]))
+            shard["sents"] += tail - head
+            head = tail
+            if self.div_size[split] is not None and shard["sents"] >= self.div_size[split]:
+                self.close_shard(split)
+
+    def __call__(self, en_sents, ja_sents):
+        """
+        一つのチャンクのペアを、各データのファイルに書き込む関数 (Pipeline.run の sink として渡す)
+        """
+        en_sents, ja_sents = sanitize(en_sents), sanitize(ja_sents)
+        total = min(len(en_sents), len(ja_sents))
+        assign = self.rng.choice(len(self.splits), size=total, p=self.ratio)
+        perm = self.rng.permutation(total)
+        assign = assign[perm]
+        for k, split in enumerate(self.splits):
+            idx = perm[assign == k]
+            if len(idx) == 0:
+                continue
+            en_ls, ja_ls = sa.gather(en_sents, idx), sa.gather(ja_sents, idx)
+            self.write_split(split, en_ls, ja_ls)
+            if split == "train":
+                self.hashes["train"].append(pidx.hash_pairs(en_ls, ja_ls))
+            else:
+                self.hashes["eval"].append(pidx.hash_pairs(en_ls, ja_ls))
+                self.hashes["eval_sents"].append(pidx.hash_sents(en_ls))
+                self.hashes["eval_sents"].append(pidx.hash_sents(ja_ls))
+
+    def close(self):
+        """
+        書き込み中のファイルを閉じ、マニフェストと索引を保存する関数
+        ペアが一つも割り当てられなかったデータは、split_dataset と同じく空のファイルを作成する。
+        """
+        for split in self.splits:
+            if not self.manifest[split]:
+                self.open_shard(split)
+            if split in self.files:
+                self.close_shard(split)
+        pidx.save_manifest(self.data_path, self.manifest)
+        empty = [np.zeros(0, dtype=np.uint64)]
+        for name, arrays in self.hashes.items():
+            pidx.save_index(self.data_path, name, np.concatenate(arrays + empty))
+
+
+def append_dataset(en_sents, ja_sents, repo_path, div_size=1000000):
+    """
+    新しいデータセットのペアを、既存のデータセットに訓練用データとして追加する関数
+    既存のファイルは書き換えずに、新しいファイル(例 train5.en, train5.ja)を作成してマニフェストと索引を更新する。
+
+    次のペアは追加されない。
+    1. 既存の訓練用データに含まれるペア、または新しいデータセットの中で重複しているペア
+    2. 評価用・テスト用データに含まれるペア、または評価用・テスト用データの英文・和文を含むペア (リークを防ぐため)
+
+    索引を用いて判定するので、処理にかかる時間は新しいデータセットの大きさにほぼ比例する。
+    マニフェストや索引が存在しない既存のデータセットに追加するときは、保存されているファイルから先に作り直す。
+    """
+    data_path = os.path.join(repo_path, "corpus/genuine_bilingual/")
+    pidx.ensure_index(data_path)
+    en_ls, ja_ls = sanitize(en_sents), sanitize(ja_sents)
+
+    pairs = pidx.hash_pairs(en_ls, ja_ls)
+    _, first = np.unique(pairs, return_index=True)
+    keep = np.zeros(len(pairs), dtype=bool)
+    keep[first] = True
+    keep &= ~pidx.contains(pidx.load_index(data_path, "train"), pairs)
+    keep &= ~pidx.contains(pidx.load_index(data_path, "eval"), pairs)
+    eval_sents = pidx.load_index(data_path, "eval_sents")
+    keep &= ~pidx.contains(eval_sents, pidx.hash_sents(en_ls))
+    keep &= ~pidx.contains(eval_sents, pidx.hash_sents(ja_ls))
+
+    idx = np.random.permutation(np.nonzero(keep)[0])
+    print("\n{} of {} pairs are new".format(len(idx), len(pairs)))
+    if len(idx) == 0:
+        return
+
+    manifest = pidx.load_manifest(data_path)
+    manifest["train"] += write_ds('train', data_path, sa.gather(en_ls, idx), sa.gather(ja_ls, idx),
+                                  div_size, start=pidx.next_shard(data_path, "train", manifest))
+    pidx.merge_index(data_path, "train", pairs[keep])
+    pidx.save_manifest(data_path, manifest)
@@ -1,39 +1,83 @@
 import re
-import sacremoses as sm
 import unicodedata
-import MeCab
 from typing import List
 import multiprocessing as mp
 import os
 import gc
 
+# トークン化を行う関数は、プロセスごとに一度だけ作成する (normalized ごと)
+# パイプラインではチャンクごとに tokenize_pairs が呼び出されるので、そのたびに MosesTokenizer と MeCab.Tagger を作らないようにする
+_en_tokenizers, _ja_tokenizers = {}, {}
+
 
 class Tokenization():
     def __init__(self, workers=1):
         self.workers = mp.Value('i', workers)
 
-    def tokenize_en(self, en_sents: List[str]):
+    # sacremoses と MeCab の読み込みには時間がかかるので、トークン化を行うプロセスの中でのみ読み込む
+    def en_tokenizer(self, normalized=False):
+        """
+        英文を一文ずつトークン化する関数を返す関数
+        normalized=True のときは、入力が NFKC 正規化済みであるとみなし、正規化を省略する。
+        """
+        if normalized in _en_tokenizers:
+            return _en_tokenizers[normalized]
+        import sacremoses as sm
         mt = sm.MosesTokenizer(lang='en')
-        for en in en_sents:
-            en = unicodedata.normalize("NFKC", en)
+
+        def tokenize(en):
+            if not normalized:
+                en = unicodedata.normalize("NFKC", en)
             en = re.sub(
                 mt.AGGRESSIVE_HYPHEN_SPLIT[0], r'\1 - ', en)
             en = mt.tokenize(en, escape=False)
-            en = ' '.join(en).lower()
-            yield en
+            return ' '.join(en).lower()
+        _en_tokenizers[normalized] = tokenize
+        return tokenize
 
-    def tokenize_ja(self, ja_sents: List[str]):
+    def ja_tokenizer(self, normalized=False):
+        """
+        和文を一文ずつトークン化する関数を返す関数
+        normalized=True のときは、入力が NFKC 正規化済みであるとみなし、正規化を省略する。
+        """
+        if normalized in _ja_tokenizers:
+            return _ja_tokenizers[normalized]
+        import MeCab
         mecab = MeCab.Tagger("-Owakati")
+
+        def tokenize(ja):
+            if not normalized:
+                ja = unicodedata.normalize("NFKC", ja)
+            return mecab.parse(ja)
+        _ja_tokenizers[normalized] = tokenize
+        return tokenize
+
+    def tokenize_en(self, en_sents: List[str]):
+        tokenize = self.en_tokenizer()
+        for en in en_sents:
+            yield tokenize(en)
+
+    def tokenize_ja(self, ja_sents: List[str]):
+        tokenize = self.ja_tokenizer()
         for ja in ja_sents:
-            ja = unicodedata.normalize("NFKC", ja)
-            ja = mecab.parse(ja)
-            yield ja
+            yield tokenize(ja)
+
+    def tokenize_pairs(self, en_sents: List[str], ja_sents: List[str]):
+        """
+        引数で与えられた英文と和文のリストを、このプロセス内でトークン化する関数
+        (パイプライン処理の1ステージとして、小分けにしたペアごとに呼び出される)
+        """
+        en_ls, ja_ls = [], []
+        for en, ja in zip(self.tokenize_en(en_sents), self.tokenize_ja(ja_sents)):
+            en_ls.append(en.replace('\t', '').strip())
+            ja_ls.append(ja.replace('\t', '').strip())
+        return en_ls, ja_ls
 
-    def tokenize_en_ja(self, queue, en_sents: List[str], ja_sents: List[str]):
+    def tokenize_en_ja(self, queue, idx, en_sents: List[str], ja_sents: List[str]):
         print("Tokenization (Process ID: {}) started.".format(
             os.getpid()))
-        queue.put([en.replace('\t', '') + '\t' + ja.replace('\t', '')
-                   for en, ja in zip(self.tokenize_en(en_sents), self.tokenize_ja(ja_sents))])
+        queue.put((idx, [en.replace('\t', '') + '\t' + ja.replace('\t', '')
+                   for en, ja in zip(self.tokenize_en(en_sents), self.tokenize_ja(ja_sents))]))
         print("Tokenization [Process ID: {}] has finished.".format(
             os.getpid()))
 
@@ -54,14 +98,13 @@ class Tokenization():
         for idx in range(self.workers.value):
             head = idx * size
             tail = (idx+1) * size if idx != (self.workers.value-1) else num_sents
-            proc = mp.Process(target=self.tokenize_en_ja, args=[queue,
+            proc = mp.Process(target=self.tokenize_en_ja, args=[queue, idx,
                                                                 en_sents[head: tail], ja_sents[head: tail]])
             proc.start()
 
-        tmp = []
-        for _ in range(self.workers.value):
-            tmp.append(queue.get())
-        tmp_gen = (sents for sents in tmp)
+        # 結果は終了した順に届くので、元の順序に並べ直す
+        tmp = sorted((queue.get() for _ in range(self.workers.value)), key=lambda item: item[0])
+        tmp_gen = (sents for _, sents in tmp)
         bitexts = [sent for sents in tmp_gen for sent in sents]
         del tmp[:]
         gc.collect()
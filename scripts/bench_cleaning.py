@@ -0,0 +1,193 @@
+"""
+クリーニング (corpus/src/cleaning.py) の各パターンの処理時間が、文の長さに比例することを確かめるベンチマーク
+
+括弧や URL、メールアドレスの一部が大量に並んだ文(クロールしたデータに含まれる、壊れた HTML など)を長さを変えて作り、
+各パターンと denoise_sent 全体の処理時間を計る。
+処理時間と文の長さの両対数の傾きが --max_slope を超えたパターンを、長い文で処理時間が急激に増えるパターンとして報告する。
+(傾きが 1 なら長さに比例し、2 なら長さの2乗に比例する)
+
+--legacy を指定すると、書き換える前のパターンも計測する。
+
+--budget_check を指定すると、処理時間の上限(cleaning.TimeBudget)が、長さの2乗の時間がかかる書き換える前のパターンを
+照合の途中で中断できることを確かめる。(上限を設けるワーカープロセスと同じく、fork したプロセスのメインスレッドで実行する)
+
+usage:
+    python bench_cleaning.py
+    python bench_cleaning.py --legacy --max_len 8192
+    python bench_cleaning.py --budget_check --budget 0.5
+"""
+
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_PATH, "corpus", "src"))
+import cleaning  # noqa: E402
+
+# 書き換える前のパターン
+LEGACY = {
+    "brackets": re.compile(r"""\<.*?\>|\{.*?\}|\(.*?\)|\[.*?\]|   # 括弧（半角）
+                            |【.*?】|（.*?）|〈.*?〉|《.*?》|「.*?」|『.*?』|【.*?】|                # 括弧（全角）
+                            |〔.*?〕|〖.*?〗|〘.*?〙|〚.*?〛|｛.*?｝|＜.*?＞|｛.*?｝|｟.*?｠|＜.*?＞  # 括弧（全角）
+                            """),
+    "urls": re.compile(
+        r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"),
+    "email": re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"),
+}
+
+# 長さ n の悪意のある入力を作る関数
+INPUTS = {
+    "open brackets": lambda n: "(" * n,
+    "open brackets (mixed)": lambda n: ("(<[{「『【〈" * n)[:n],
+    "unclosed brackets": lambda n: ("(a " * n)[:n],
+    "nested brackets": lambda n: "(" * (n // 2) + ")" * (n // 2),
+    "url prefixes": lambda n: ("http://" * n)[:n],
+    "url percent": lambda n: "http://" + "%" * (n - 7),
+    "email local part": lambda n: ("a." * n)[:n - 1] + "@",
+    "email domain": lambda n: "a@" + ("a." * n)[:n - 3] + "_",
+    "email repeated": lambda n: ("a@b." * n)[:n],
+    "spaces": lambda n: (" 　" * n)[:n],
+    "crawl line": lambda n: ("<td class=(x [http://a.b/%7e a.b@c 「引用 " * n)[:n],
+}
+
+
+def patterns(legacy=False):
+    """
+    (パターン名, 一文を処理する関数) のリストを返す関数
+    """
+    ls = [
+        ("urls", lambda s: cleaning.urls.sub('', s)),
+        ("email", lambda s: cleaning.email.sub('', s)),
+        ("msc", lambda s: cleaning.msc.sub(' ', s)),
+        ("newlines", lambda s: cleaning.newlines.sub('', s)),
+        ("emoji", lambda s: cleaning.emoji.sub('', s)),
+        ("brackets", cleaning.rm_brackets),
+        ("unwanted", lambda s: cleaning.unwanted.sub('', s)),
+        ("hiragana_rare", lambda s: cleaning.hiragana_rare.sub('', s)),
+        ("katakana_rare", lambda s: cleaning.katakana_rare.sub('', s)),
+        ("multi_space", lambda s: cleaning.multi_space.sub(' ', s)),
+        ("encoding_err", lambda s: cleaning.encoding_err.sub('', s)),
+        ("denoise_sent", lambda s: cleaning.denoise_sent(s, ja=True)),
+    ]
+    if legacy:
+        ls += [("legacy " + name, lambda s, pattern=pattern: pattern.sub('', s))
+               for name, pattern in LEGACY.items()]
+    return ls
+
+
+def measure(fun, sent, min_time=0.02):
+    """
+    fun(sent) の一回あたりの処理時間(秒)を返す関数 (min_time 秒以上繰り返した平均のうち、最小のもの)
+    """
+    best = float("inf")
+    for _ in range(3):
+        count, start = 0, time.perf_counter()
+        while True:
+            fun(sent)
+            count += 1
+            sec = time.perf_counter() - start
+            if sec >= min_time:
+                break
+        best = min(best, sec / count)
+    return best
+
+
+def slope(lengths, secs):
+    """
+    処理時間と文の長さの両対数の傾きを返す関数
+    """
+    return np.polyfit(np.log(lengths), np.log(secs), 1)[0]
+
+
+def budget_worker(fun, sent, budget, queue):
+    """
+    fun(sent) を処理時間の上限 budget 秒で実行し、(中断されたかどうか, 経過時間) をキューに入れる関数
+    """
+    timer = cleaning.TimeBudget(budget).start()
+    start = time.perf_counter()
+    try:
+        with timer:
+            fun(sent)
+        timed_out = False
+    except cleaning.CleaningTimeout:
+        timed_out = True
+    finally:
+        timer.stop()
+    queue.put((timer.enabled, timed_out, time.perf_counter() - start))
+
+
+def budget_check(budget, length):
+    """
+    書き換える前の email のパターンと悪意のある入力(長さ length)の照合が、budget 秒の上限で中断されること、
+    書き換えた後のパターン(denoise_sent 全体)は同じ入力を上限内に処理できることを確かめる関数
+    問題がなければ True を返す。
+    """
+    sent = INPUTS["email local part"](length)
+    cases = [("legacy email", lambda s: LEGACY["email"].sub('', s), True),
+             ("denoise_sent", lambda s: cleaning.denoise_sent(s, ja=True), False)]
+    ok = True
+    for name, fun, expect_timeout in cases:
+        queue = mp.Queue()
+        proc = mp.Process(target=budget_worker, args=[fun, sent, budget, queue])
+        proc.start()
+        enabled, timed_out, sec = queue.get()
+        proc.join()
+        # 上限を超えてから中断されるまでに、最大で budget / 2 秒かかる (TimeBudget を参照)
+        passed = enabled and timed_out == expect_timeout and (not timed_out or sec < 1.5 * budget + 0.5)
+        ok &= passed
+        print("{:16s} {} chars: {} after {:.2f} s (budget {} s)  {}".format(
+            name, length, "interrupted" if timed_out else "finished", sec, budget, "ok" if passed else "FAILED"))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--min_len', type=int, default=2048)
+    parser.add_argument('--max_len', type=int, default=32768)
+    parser.add_argument('--max_slope', type=float, default=1.3,
+                        help='patterns whose log-log slope exceeds this value are reported as superlinear')
+    parser.add_argument('--legacy', action='store_true',
+                        help='also measure the patterns before they were rewritten')
+    parser.add_argument('--budget_check', action='store_true',
+                        help='check that the cleaning time budget interrupts a quadratic legacy pattern in the middle of matching')
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='time budget in seconds used by --budget_check')
+    parser.add_argument('--budget_len', type=int, default=200000,
+                        help='length of the adversarial line used by --budget_check')
+    args = parser.parse_args()
+
+    if args.budget_check:
+        sys.exit(0 if budget_check(args.budget, args.budget_len) else 1)
+
+    lengths = []
+    n = args.min_len
+    while n <= args.max_len:
+        lengths.append(n)
+        n *= 2
+
+    print("{:16s} {:24s} {:>12s} {:>7s}".format(
+        "pattern", "input", "ms @ {}".format(lengths[-1]), "slope"))
+    flagged = []
+    for name, fun in patterns(args.legacy):
+        worst = None
+        for input_name, make in INPUTS.items():
+            secs = [measure(fun, make(n)) for n in lengths]
+            k = slope(lengths, secs)
+            if worst is None or k > worst[0]:
+                worst = (k, input_name, secs[-1])
+        k, input_name, sec = worst
+        superlinear = k > args.max_slope
+        if superlinear and not name.startswith("legacy"):
+            flagged.append(name)
+        print("{:16s} {:24s} {:12.3f} {:7.2f}{}".format(
+            name, input_name, sec * 1000, k, "  superlinear" if superlinear else ""))
+
+    if flagged:
+        print("\nSuperlinear patterns: {}".format(", ".join(flagged)))
+        sys.exit(1)
+    print("\nAll patterns run in time linear in the line length (worst input shown for each pattern).")
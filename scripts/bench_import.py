@@ -0,0 +1,85 @@
+"""
+各モジュールの import にかかる時間を計測し、上限(budget)を超えていないかを確認するスクリプト
+
+CLI の起動やワーカープロセスの生成のたびに import が実行されるので、
+重いライブラリ(fairseq, MeCab, matplotlib, datasets など)は、必要な関数の中で読み込むようにしている。
+このスクリプトは、そのような遅延読み込みが崩れていないかを確認するために用いる。
+
+各モジュールは新しいインタプリタで repeat 回ずつ import され、その最小値を計測値とする。
+上限を超えたモジュールが一つでもあれば、終了コード 1 で終了する。
+
+usage:
+    python bench_import.py --budget 0.5 --repeat 5
+"""
+
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (モジュールのあるディレクトリ, モジュール名)
+MODULES = [
+    ("corpus/src", "cleaning"),
+    ("corpus/src", "create_dataset"),
+    ("corpus/src", "dataset_store"),
+    ("corpus/src", "dl_tatoeba"),
+    ("corpus/src", "dl_WikiMatrix"),
+    ("corpus/src", "filter"),
+    ("corpus/src", "freq_sketch"),
+    ("corpus/src", "fused"),
+    ("corpus/src", "mono_dataset"),
+    ("corpus/src", "pair_index"),
+    ("corpus/src", "pipeline"),
+    ("corpus/src", "script_classifier"),
+    ("corpus/src", "sentence_array"),
+    ("corpus/src", "split_dataset"),
+    ("corpus/src", "tokenize_enja"),
+    ("scripts", "mix_corpus"),
+    ("scripts", "translation"),
+]
+
+CODE = """
+import time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+"""
+
+
+def import_time(path, module):
+    """
+    新しいインタプリタでモジュールを import し、かかった時間(秒)を返す関数
+    """
+    proc = subprocess.run([sys.executable, "-c", CODE.format(module)],
+                          cwd=os.path.join(REPO_PATH, path), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='maximum import time of each module in seconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    over = 0
+    for path, module in MODULES:
+        name = "{}/{}".format(path, module)
+        try:
+            sec = min(import_time(path, module) for _ in range(args.repeat))
+        except RuntimeError as e:
+            print("{:32s}  ERROR  {}".format(name, e))
+            over += 1
+            continue
+        ok = sec <= args.budget
+        over += 0 if ok else 1
+        print("{:32s}  {:6.3f} s  {}".format(
+            name, sec, "ok" if ok else "OVER BUDGET"))
+
+    print("\n{} of {} modules exceeded the budget of {} seconds".format(
+        over, len(MODULES), args.budget))
+    sys.exit(1 if over else 0)
@@ -0,0 +1,88 @@
+"""
+translation_server.py で起動したサーバに同時にリクエストを送り、スループットとレイテンシを計測するスクリプト
+
+入力ファイルの各行を一文として、concurrency 本の接続から並行して POST /translate を送る。
+最後にサーバの /metrics (バッチの大きさ、待ち行列の長さなど) も表示する。
+
+usage:
+    python bench_server.py --input test.en --concurrency 32 --requests 1000 --port 8080
+"""
+
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+
+
+async def request(reader, writer, host, method, path, payload=None):
+    body = json.dumps(payload, ensure_ascii=False).encode(
+        "utf-8") if payload is not None else b""
+    writer.write("{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+        method, path, host, len(body)).encode("latin-1") + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, value = line.decode("latin-1").split(':', 1)
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, sents, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for sent in sents:
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, host, "POST", "/translate", {"text": sent})
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def bench(host, port, sents, concurrency):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, sents[i::concurrency], latencies, errors)
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, metrics = await request(reader, writer, host, "GET", "/metrics")
+    writer.close()
+    return latencies, errors, elapsed, metrics
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--input', required=True,
+                        help='file of source sentences (one sentence per line)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding="utf-8") as f:
+        sents = [line.strip() for line in f if line.strip()]
+    sents = (sents * (args.requests // len(sents) + 1))[:args.requests]
+
+    latencies, errors, elapsed, metrics = asyncio.run(
+        bench(args.host, args.port, sents, args.concurrency))
+
+    latencies = sorted(latencies)
+    print("{} requests ({} errors) in {:.2f} s  ->  {:.1f} sents/s".format(
+        len(sents), len(errors), elapsed, len(latencies) / elapsed))
+    if latencies:
+        for q in (0.5, 0.9, 0.99):
+            print("p{:<3d} latency  {:8.1f} ms".format(
+                int(q * 100), latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000))
+    print("server metrics:")
+    print(json.dumps(metrics, indent=2, ensure_ascii=False))
@@ -0,0 +1,77 @@
+"""
+語彙のショートリストを用いたデコードと、全ての語彙を用いたデコードの速度と BLEU を比較するスクリプト
+
+同じモデル、同じバッチで両方の設定を交互に翻訳し、翻訳速度(文/秒)、BLEU、出力層で計算した語彙の割合を表示する。
+
+usage:
+    python bench_shortlist.py --src en --tgt ja --checkpoint_dir checkpoints --checkpoint_file checkpoint_last.pt \
+        --data data-bin --bpe_model bpe.model --shortlist shortlist.en-ja.npz --input test.en --reference test.ja
+"""
+
+import time
+from argparse import ArgumentParser
+import numpy as np
+from translation import Translation
+
+
+def run(model, src_sents, batch_size, beam, lenpen):
+    """
+    前処理済みの文を batch_size 文ずつ翻訳し、(翻訳結果, 翻訳にかかった時間, 各バッチのショートリストの大きさ) を返す関数
+    """
+    hyps, sizes = [], []
+    start = time.perf_counter()
+    for head in range(0, len(src_sents), batch_size):
+        batch = src_sents[head:head + batch_size]
+        hyps.extend(model.generate(batch, beam, lenpen))
+        projection = model.projections[0]
+        sizes.append(len(projection.ids) if projection.ids is not None else len(model.model.tgt_dict))
+    return hyps, time.perf_counter() - start, sizes
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--src', default='en')
+    parser.add_argument('--tgt', default='ja')
+    parser.add_argument('--checkpoint_dir', default='checkpoints')
+    parser.add_argument('--checkpoint_file', default='checkpoint_last.pt')
+    parser.add_argument('--data', default='data-bin')
+    parser.add_argument('--bpe_model', default='bpe.model')
+    parser.add_argument('--shortlist', required=True)
+    parser.add_argument('--input', required=True,
+                        help='raw source sentences (one sentence per line)')
+    parser.add_argument('--reference', required=True,
+                        help='raw reference translations (one sentence per line)')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--beam', type=int, default=3)
+    parser.add_argument('--lenpen', type=float, default=0.6)
+    parser.add_argument('--tokenize', default='13a',
+                        help='tokenizer of sacrebleu (the same default as cli/test.sh)')
+    args = parser.parse_args()
+
+    import sacrebleu
+
+    model = Translation(args.src, args.tgt)
+    model.load(args.checkpoint_dir, args.checkpoint_file,
+               args.data, args.bpe_model, shortlist=args.shortlist)
+
+    with open(args.input, 'r', encoding="utf-8") as f:
+        src_sents = [model.preproc(line.strip()) for line in f]
+    with open(args.reference, 'r', encoding="utf-8") as f:
+        refs = [line.strip() for line in f]
+
+    # 一回目の翻訳はメモリの確保などで遅くなるので、計測の前に一度だけ翻訳しておく
+    model.generate(src_sents[:args.batch_size], args.beam, args.lenpen)
+
+    results = {}
+    for name, use_shortlist in (("full", False), ("shortlist", True)):
+        model.use_shortlist = use_shortlist
+        hyps, sec, sizes = run(model, src_sents, args.batch_size,
+                               args.beam, args.lenpen)
+        bleu = sacrebleu.corpus_bleu(hyps, [refs], tokenize=args.tokenize)
+        results[name] = (hyps, sec)
+        print("{:10s}  {:8.1f} sents/s  BLEU {:6.2f}  vocab per batch {:7.1f} / {}".format(
+            name, len(src_sents) / sec, bleu.score, np.mean(sizes), len(model.model.tgt_dict)))
+
+    same = sum(a == b for a, b in zip(results["full"][0], results["shortlist"][0]))
+    print("\nspeedup x{:.2f}, {} / {} translations identical".format(
+        results["full"][1] / results["shortlist"][1], same, len(src_sents)))
@@ -0,0 +1,286 @@
+"""
+学習用のチェックポイントから、推論に必要なものだけを含むディレクトリを書き出すスクリプト
+
+学習用のチェックポイント(checkpoint_last.pt など)には、モデルの重みのほかにオプティマイザーの状態(Adam では重みの2倍の大きさ)や
+学習の途中経過が含まれており、Translation.load のたびにその全てが読み込まれる。
+このスクリプトは、次のファイルだけを export_dir に書き出す。
+
+    model.pt        モデルの重み (fp32 または fp16)。テンソルだけを含むので、torch.load(weights_only=True) で読み込める
+    cfg.json        モデルの設定 (argparse.Namespace は辞書に変換して保存する)
+    dict.*.txt      辞書
+    bpe.model       SentencePiece のモデル
+    export.json     書き出し元のチェックポイントと、各ファイルの SHA-256
+
+torch 2.1 以降では model.pt を torch.load(mmap=True) で読み込むので、重みはファイルから必要な部分だけが読み込まれ、
+同じファイルを読み込む(または読み込んだ後に fork した)ワーカープロセスの間でページキャッシュとして共有される。
+(Translation.load_export を参照)
+requirements.txt の torch 1.9 では mmap と weights_only を使えないので、通常の torch.load で読み込んでパラメータにコピーする。
+(オプティマイザーの状態を読み込まない分は速くなるが、重みはワーカー間で共有されない)
+
+設定は、fairseq 0.10.2 (requirements.txt) のチェックポイントでは argparse.Namespace (state["args"]) として、
+Hydra に移行した後の fairseq では DictConfig (state["cfg"]) として保存されているので、どちらにも対応する。
+
+fp16 で書き出すとファイルの大きさは半分になるが、CPU で推論するときは読み込み時に fp32 に変換するので、ワーカー間で共有されなくなる。
+
+usage:
+    python export_model.py --checkpoint checkpoints/checkpoint_last.pt --data data-bin --bpe_model bpe.model \
+        --src en --tgt ja --export_dir model-en-ja --dtype fp32
+    python export_model.py --bench --checkpoint checkpoints/checkpoint_last.pt --data data-bin --bpe_model bpe.model \
+        --src en --tgt ja --export_dir model-en-ja --workers 4
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+
+MODEL_FILE = "model.pt"
+CFG_FILE = "cfg.json"
+BPE_FILE = "bpe.model"
+META_FILE = "export.json"
+
+
+def sha256sum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# cfg.json の中で、argparse.Namespace を変換した辞書であることを表すキー
+NAMESPACE_KEY = "__namespace__"
+
+
+def to_plain(obj):
+    """
+    設定を JSON で保存できる形に変換する関数
+    fairseq の古い形式のモデル (bart_base など) では cfg.model が argparse.Namespace なので、辞書に変換して印を付ける。
+    """
+    if isinstance(obj, Namespace):
+        return {NAMESPACE_KEY: to_plain(vars(obj))}
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    return obj
+
+
+def from_plain(obj):
+    """
+    to_plain で変換した設定を元に戻す関数
+    """
+    if isinstance(obj, dict):
+        if set(obj) == {NAMESPACE_KEY}:
+            return Namespace(**from_plain(obj[NAMESPACE_KEY]))
+        return {k: from_plain(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [from_plain(v) for v in obj]
+    return obj
+
+
+def create_cfg(plain):
+    """
+    cfg.json の内容から DictConfig を作る関数
+    Namespace を含む設定を DictConfig に入れるために、fairseq の checkpoint_utils.load_checkpoint_to_cpu と同じ方法を用いる。
+    """
+    from omegaconf import OmegaConf, _utils
+    old_primitive = _utils.is_primitive_type
+    _utils.is_primitive_type = lambda _: True
+    try:
+        cfg = OmegaConf.create(from_plain(plain))
+    finally:
+        _utils.is_primitive_type = old_primitive
+    OmegaConf.set_struct(cfg, True)
+    return cfg
+
+
+def torch_version():
+    import torch
+    return tuple(int(v) for v in re.match(r"(\d+)\.(\d+)", torch.__version__).groups())
+
+
+@contextmanager
+def skip_init():
+    """
+    with 文の中で作成したパラメータを初期化しないようにする関数
+    読み込んだ重みで置き換えるので、乱数による初期化は不要である。
+    (初期化しないパラメータのメモリは書き込まれないので、ほとんど物理メモリを消費しない)
+    meta デバイスで作成する方法では、パラメータ以外のテンソル(正弦波の位置埋め込みなど)も meta になってしまうので用いない。
+    """
+    import torch
+    names = [name for name in dir(torch.nn.init)
+             if name.endswith("_") and not name.startswith("_")]
+    originals = {name: getattr(torch.nn.init, name) for name in names}
+    for name in names:
+        setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, fun in originals.items():
+            setattr(torch.nn.init, name, fun)
+
+
+def export(checkpoint, data, bpe_model, src, tgt, export_dir, dtype="fp32"):
+    import torch
+    from fairseq import checkpoint_utils
+
+    # fairseq の読み込み関数を用いて、古い形式の設定や重みの名前を変換しておく
+    state = checkpoint_utils.load_checkpoint_to_cpu(checkpoint)
+    if state.get("cfg") is not None:
+        from omegaconf import OmegaConf
+        cfg = to_plain(OmegaConf.to_container(state["cfg"], resolve=True, enum_to_str=True))
+    else:
+        # fairseq 0.10.2 のチェックポイント (argparse.Namespace)
+        cfg = to_plain(state["args"])
+
+    weights = state["model"]
+    if dtype == "fp16":
+        weights = {k: v.half() if v.is_floating_point() else v for k, v in weights.items()}
+    weights = {k: v.contiguous() for k, v in weights.items()}
+    del state
+
+    os.makedirs(export_dir, exist_ok=True)
+    torch.save(weights, os.path.join(export_dir, MODEL_FILE))
+    with open(os.path.join(export_dir, CFG_FILE), 'w', encoding="utf-8") as f:
+        json.dump(cfg, f, indent=2)
+    files = [MODEL_FILE, CFG_FILE, BPE_FILE]
+    shutil.copyfile(bpe_model, os.path.join(export_dir, BPE_FILE))
+    for lang in sorted({src, tgt}):
+        name = "dict.{}.txt".format(lang)
+        shutil.copyfile(os.path.join(data, name), os.path.join(export_dir, name))
+        files.append(name)
+
+    meta = {"checkpoint": os.path.abspath(checkpoint), "src": src, "tgt": tgt, "dtype": dtype,
+            "files": {name: sha256sum(os.path.join(export_dir, name)) for name in files}}
+    with open(os.path.join(export_dir, META_FILE), 'w', encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    size = os.path.getsize(os.path.join(export_dir, MODEL_FILE))
+    print("{} ({:.1f} MB) -> {} ({:.1f} MB)".format(
+        checkpoint, os.path.getsize(checkpoint) / 2**20, export_dir, size / 2**20))
+
+
+def load_export(export_dir):
+    """
+    export で書き出したディレクトリから、fairseq のハブ(GeneratorHubInterface)を作成する関数
+    torch 2.1 以降では、重みは mmap したテンソルをそのままモデルのパラメータとして用いる。(コピーしない)
+    """
+    import torch
+    from fairseq import tasks
+    from fairseq.hub_utils import GeneratorHubInterface
+
+    version = torch_version()
+    path = os.path.join(export_dir, MODEL_FILE)
+    if version >= (2, 1):
+        weights = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    elif version >= (1, 13):
+        weights = torch.load(path, map_location="cpu", weights_only=True)
+    else:
+        weights = torch.load(path, map_location="cpu")
+
+    with open(os.path.join(export_dir, CFG_FILE), 'r', encoding="utf-8") as f:
+        plain = json.load(f)
+    if NAMESPACE_KEY in plain:
+        # fairseq 0.10.2 のチェックポイントから書き出したもの
+        cfg = from_plain(plain)
+        cfg.data = os.path.abspath(export_dir)
+        task = tasks.setup_task(cfg)
+        model_cfg = cfg
+    else:
+        from omegaconf import open_dict
+        cfg = create_cfg(plain)
+        with open_dict(cfg):
+            cfg.task.data = os.path.abspath(export_dir)
+        task = tasks.setup_task(cfg.task)
+        model_cfg = cfg.model
+
+    with skip_init():
+        model = task.build_model(model_cfg)
+    model.upgrade_state_dict(weights)
+    # CPU での推論のために fp16 の重みは fp32 に変換する (変換したものはワーカー間で共有されない)
+    weights = {k: v.float() if v.dtype == torch.float16 else v for k, v in weights.items()}
+    # fairseq のモデルの load_state_dict は assign に対応していないので、nn.Module のものを直接呼び出す
+    # (assign は torch 2.1 以降のみ。それより前はパラメータにコピーする)
+    if version >= (2, 1):
+        torch.nn.Module.load_state_dict(model, weights, strict=True, assign=True)
+    else:
+        torch.nn.Module.load_state_dict(model, weights, strict=True)
+    return GeneratorHubInterface(cfg, task, [model])
+
+
+def memory_usage():
+    """
+    (RSS, PSS) を MB で返す関数
+    PSS は、他のプロセスと共有しているページを共有しているプロセスの数で割って数えた値
+    """
+    usage = {}
+    with open("/proc/self/smaps_rollup", 'r') as f:
+        for line in f:
+            key, *value = line.split()
+            if key in ("Rss:", "Pss:"):
+                usage[key[:-1]] = int(value[0]) / 1024
+    return usage["Rss"], usage["Pss"]
+
+
+def bench_worker(load, barrier, queue):
+    start = time.perf_counter()
+    hub = load()
+    sec = time.perf_counter() - start
+    # 全てのワーカーが読み込みを終えてから計測する (共有されているページを正しく数えるため)
+    barrier.wait()
+    queue.put((sec,) + memory_usage())
+    barrier.wait()
+    del hub
+
+
+def bench(args):
+    import multiprocessing as mp
+    from fairseq.models.transformer import TransformerModel
+
+    loaders = {
+        "checkpoint": lambda: TransformerModel.from_pretrained(
+            os.path.dirname(os.path.abspath(args.checkpoint)),
+            checkpoint_file=os.path.basename(args.checkpoint),
+            data_name_or_path=os.path.abspath(args.data)),
+        "export": lambda: load_export(args.export_dir),
+    }
+    ctx = mp.get_context("fork")
+    for name, load in loaders.items():
+        barrier, queue = ctx.Barrier(args.workers), ctx.Queue()
+        procs = [ctx.Process(target=bench_worker, args=[load, barrier, queue])
+                 for _ in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        results = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        sec, rss, pss = (sum(r[i] for r in results) / len(results) for i in range(3))
+        print("{:10s}  load {:6.2f} s   RSS {:8.1f} MB   PSS {:8.1f} MB  (mean of {} workers)".format(
+            name, sec, rss, pss, args.workers))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--checkpoint', default='checkpoints/checkpoint_last.pt')
+    parser.add_argument('--data', default='data-bin')
+    parser.add_argument('--bpe_model', default='bpe.model')
+    parser.add_argument('--src', default='en')
+    parser.add_argument('--tgt', default='ja')
+    parser.add_argument('--export_dir', default=None)
+    parser.add_argument('--dtype', choices=['fp32', 'fp16'], default='fp32')
+    parser.add_argument('--bench', action='store_true',
+                        help='compare load time and per-worker memory of the checkpoint and the exported model')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    args.export_dir = args.export_dir or "model-{}-{}".format(args.src, args.tgt)
+
+    if args.bench:
+        bench(args)
+    else:
+        export(args.checkpoint, args.data, args.bpe_model,
+               args.src, args.tgt, args.export_dir, args.dtype)
@@ -0,0 +1,193 @@
+"""
+genuine_bilingual と synthetic_bilingual を、ファイルを複製せずに指定した比率で混ぜ合わせるスクリプト
+
+各コーパスは fairseq-preprocess で一度だけバイナリ化しておく(辞書は genuine のものを共有する)。
+このスクリプトは、バイナリ化された各コーパスの .bin を一つずつ連結し、
+各文の位置を指す索引(.idx)だけを比率に応じて作成する。
+例えば genuine:synthetic = 2:1 のときは、genuine の各文を指す位置が索引に二回ずつ書き込まれ、.bin の中身は複製されない。
+比率を変えるときは、エンコードやバイナリ化をやり直さずに、このスクリプトだけを実行し直せばよい。
+
+Tagged Back-Translation 用に、指定したコーパスの原言語側の各文の先頭にタグ(例 <BT>)を挿入することもできる。
+
+usage:
+    python mix_corpus.py --src en --tgt ja --destdir data-bin-mixed \
+        --source data-bin:2 --source data-bin-synthetic:1:tag --tag "<BT>"
+"""
+
+import os
+import shutil
+import struct
+import numpy as np
+from argparse import ArgumentParser
+
+# fairseq (MMapIndexedDataset) の索引ファイルの形式
+HDR_MAGIC = b"MMIDIDX\x00\x00"
+DTYPES = {1: np.uint8, 2: np.int8, 3: np.int16, 4: np.int32,
+          5: np.int64, 6: np.float64, 7: np.double, 8: np.uint16}
+
+# fairseq の辞書で、dict.txt に書かれた単語より前に置かれる特殊記号(<s>, <pad>, </s>, <unk>)の数
+NSPECIAL = 4
+
+
+def read_index(path):
+    """
+    索引ファイルを読み込み、(データ型のコード, 各文の長さ, 各文の .bin 内の位置(バイト)) を返す関数
+    各文の長さと位置は、ファイルを mmap した配列として返す。
+    """
+    with open(path, "rb") as f:
+        if f.read(9) != HDR_MAGIC:
+            raise ValueError(
+                "Error: %s is not an index file of MMapIndexedDataset." % path)
+        struct.unpack("<Q", f.read(8))
+        (code,) = struct.unpack("<B", f.read(1))
+        (num,) = struct.unpack("<Q", f.read(8))
+        offset = f.tell()
+    sizes = np.memmap(path, dtype=np.int32, mode='r', offset=offset, shape=(num,))
+    pointers = np.memmap(path, dtype=np.int64, mode='r', offset=offset + num * 4, shape=(num,))
+    return code, sizes, pointers
+
+
+def write_index(path, code, parts, block=1 << 20):
+    """
+    parts:  (各文の長さ, 各文の位置, 選択する文のインデックス, 位置に加える値(バイト)) のリスト
+    選択した文の長さと位置を block 文ずつ書き込む関数 (連結した配列を作らない)
+    """
+    with open(path, "wb") as f:
+        f.write(HDR_MAGIC)
+        f.write(struct.pack("<Q", 1))
+        f.write(struct.pack("<B", code))
+        f.write(struct.pack("<Q", sum(len(idx) for _, _, idx, _ in parts)))
+        for sizes, _, idx, _ in parts:
+            for head in range(0, len(idx), block):
+                f.write(np.asarray(sizes[idx[head:head + block]], dtype=np.int32).tobytes(order="C"))
+        for _, pointers, idx, offset in parts:
+            for head in range(0, len(idx), block):
+                f.write((np.asarray(pointers[idx[head:head + block]], dtype=np.int64) + offset).tobytes(order="C"))
+
+
+def add_tag(bin_path, code, sizes, pointers, tag_id, out, block_elems=1 << 22):
+    """
+    各文の先頭にタグを挿入したデータを out に書き込み、新しい (各文の長さ, 各文の位置, 書き込んだバイト数) を返す関数
+    .bin は mmap し、block_elems 要素を超えない範囲の文ごとにタグを挿入して書き込む。(.bin 全体をメモリに読み込まない)
+    文は索引の順に .bin に並んでいるものとする。(fairseq-preprocess が作成する .bin はこの形式になる)
+    """
+    dtype = np.dtype(DTYPES[code])
+    data = np.memmap(bin_path, dtype=dtype, mode='r')
+    starts = np.asarray(pointers, dtype=np.int64) // dtype.itemsize
+    ends = starts + np.asarray(sizes, dtype=np.int64)
+    new_sizes = np.asarray(sizes, dtype=np.int32) + 1
+    new_pointers = np.empty(len(sizes), dtype=np.int64)
+
+    written, head = 0, 0
+    while head < len(sizes):
+        # 一文だけで block_elems を超えるときは、その文だけを処理する
+        tail = max(head + 1, int(np.searchsorted(ends, starts[head] + block_elems, side='right')))
+        lo, hi = starts[head], ends[tail - 1]
+        tagged = np.insert(np.asarray(data[lo:hi]), starts[head:tail] - lo, dtype.type(tag_id))
+        out.write(tagged)
+        # タグの分だけ、各文の位置はその文より前の文の数だけ後ろにずれる
+        new_pointers[head:tail] = (written + starts[head:tail] - lo + np.arange(tail - head)) * dtype.itemsize
+        written += len(tagged)
+        head = tail
+    return new_sizes, new_pointers, written * dtype.itemsize
+
+
+def sample_index(num, ratio, gen):
+    """
+    比率 ratio に応じて、各文のインデックスを並べた配列を返す関数
+    整数部分の回数だけ全ての文を繰り返し、小数部分に相当する数の文は無作為に選ぶ。
+    """
+    full, frac = int(ratio), ratio - int(ratio)
+    idx = [np.tile(np.arange(num), full)]
+    if frac > 0:
+        idx.append(np.sort(gen.choice(num, int(round(frac * num)), replace=False)))
+    return np.concatenate(idx)
+
+
+def tag_id(dict_path, tag):
+    """
+    辞書ファイルにおけるタグの番号を返す関数 (辞書にタグがないときは末尾に追加する)
+    """
+    with open(dict_path, 'r', encoding="utf-8") as f:
+        words = [line.split()[0] for line in f if line.strip()]
+    if tag not in words:
+        with open(dict_path, 'a', encoding="utf-8") as f:
+            f.write("{} 0\n".format(tag))
+        words.append(tag)
+    return NSPECIAL + words.index(tag)
+
+
+def mix(sources, src, tgt, destdir, tag="<BT>", split="train", seed=1):
+    """
+    sources:    (バイナリ化されたコーパスのディレクトリ, 比率, タグを挿入するかどうか) のリスト
+                先頭のコーパスの辞書と valid/test を、混ぜ合わせたコーパスでも用いる。
+    """
+    os.makedirs(destdir, exist_ok=True)
+    gen = np.random.RandomState(seed)
+    primary = sources[0][0]
+    for lang in (src, tgt):
+        shutil.copyfile(os.path.join(primary, "dict.{}.txt".format(lang)),
+                        os.path.join(destdir, "dict.{}.txt".format(lang)))
+    tid = tag_id(os.path.join(destdir, "dict.{}.txt".format(src)), tag) if any(
+        tagged for _, _, tagged in sources) else None
+    if tid is not None and src != tgt:
+        # joined-dictionary で学習する場合に、両言語の辞書を同じ状態に保つ
+        tag_id(os.path.join(destdir, "dict.{}.txt".format(tgt)), tag)
+
+    # 各コーパスから同じ文の組を選ぶために、選択するインデックスは言語に依らず一度だけ決める
+    prefix = "{}.{}-{}".format(split, src, tgt)
+    selection = []
+    for path, ratio, _ in sources:
+        _, sizes, _ = read_index(os.path.join(
+            path, "{}.{}.idx".format(prefix, src)))
+        selection.append(sample_index(len(sizes), ratio, gen))
+
+    for lang in (src, tgt):
+        out_prefix = os.path.join(destdir, "{}.{}".format(prefix, lang))
+        parts, offset, code = [], 0, None
+        with open(out_prefix + ".bin", "wb") as out:
+            for (path, ratio, tagged), idx in zip(sources, selection):
+                in_prefix = os.path.join(path, "{}.{}".format(prefix, lang))
+                code, sizes, pointers = read_index(in_prefix + ".idx")
+                if tagged and lang == src:
+                    sizes, pointers, nbytes = add_tag(
+                        in_prefix + ".bin", code, sizes, pointers, tid, out)
+                else:
+                    with open(in_prefix + ".bin", "rb") as f:
+                        shutil.copyfileobj(f, out)
+                    nbytes = os.path.getsize(in_prefix + ".bin")
+
+                parts.append((sizes, pointers, idx, offset))
+                offset += nbytes
+                print("{}: {} sents x {} -> {} sents ({})".format(
+                    path, len(sizes), ratio, len(idx), lang))
+
+        write_index(out_prefix + ".idx", code, parts)
+
+    # 評価用・テスト用データは先頭のコーパスのものを参照する
+    for name in os.listdir(primary):
+        if name.startswith(("valid.", "test.")):
+            link = os.path.join(destdir, name)
+            if not os.path.lexists(link):
+                os.symlink(os.path.abspath(os.path.join(primary, name)), link)
+
+
+def parse_source(spec):
+    path, ratio, *rest = spec.split(':')
+    return path, float(ratio), rest == ["tag"]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--source', action='append', required=True,
+                        help='DIR:RATIO[:tag] of a binarized corpus. The first one is the primary corpus.')
+    parser.add_argument('-s', '--src', default='en')
+    parser.add_argument('-t', '--tgt', default='ja')
+    parser.add_argument('--destdir', default='data-bin-mixed')
+    parser.add_argument('--tag', default='<BT>',
+                        help='tag token prepended to source sentences of tagged corpora')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    mix([parse_source(spec) for spec in args.source], args.src, args.tgt,
+        args.destdir, tag=args.tag, seed=args.seed)
@@ -0,0 +1,257 @@
+"""
+Back-Translation で作成した合成ペアを、学習済みモデルの強制デコード(forced decoding)の対数確率で採点し、絞り込むスクリプト
+
+各ペア (原言語の文, 目的言語の文) について、モデルが目的言語の文を出力する対数確率を、目的言語のトークン数で割った値をスコアとする。
+(例 ja→en のモデルで作成した合成ペアを en→ja のモデルで採点すると、往復翻訳の整合性を表すスコアになる)
+
+大量のペアを効率よく採点するために、次のように処理する。
+1. 全てのペアを SentencePiece でエンコードし、ID の配列として連結して保持する。(文ごとのオブジェクトを持たない)
+2. ペアを長さ順に並べ、パディングを含めたトークン数が max_tokens 以下になるようにバッチを作る。
+3. モデルを一度だけ読み込んでから、ワーカープロセスを fork する。(重みはコピーオンライトで共有される)
+   各ワーカーはバッチ単位で一回ずつ順伝播を行い、スコアを返す。
+
+スコアは入力と同じ順序で .scores ファイルに書き込まれる。
+--min_score または --keep_ratio を指定したときは、条件を満たすペアだけを output_prefix.{src,tgt} に書き込む。
+
+usage:
+    python score_pairs.py -s en -t ja --checkpoint_dir checkpoints --checkpoint_file checkpoint_last.pt \
+        --data data-bin --bpe_model bpe.model --input_prefix corpus/synthetic_bilingual/train \
+        --output_prefix train_filtered --keep_ratio 0.8 --workers 4
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import time
+from argparse import ArgumentParser
+import numpy as np
+
+STOP = None
+
+
+def encode_file(path, sp, dictionary, max_len, batch_size=10000):
+    """
+    ファイルの各行を SentencePiece でエンコードし、(全ての文の ID を連結した配列, 各文の開始位置の配列) を返す関数
+    各文の末尾には </s> を付け、max_len を超える文は切り詰める。
+    """
+    chunks, lengths = [], []
+    with open(path, 'r', encoding="utf-8") as f:
+        lines = []
+        for line in f:
+            lines.append(line.strip())
+            if len(lines) == batch_size:
+                encode_lines(lines, sp, dictionary, max_len, chunks, lengths)
+                lines = []
+        if lines:
+            encode_lines(lines, sp, dictionary, max_len, chunks, lengths)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32), offsets
+
+
+def encode_lines(lines, sp, dictionary, max_len, chunks, lengths):
+    eos = dictionary.eos()
+    for pieces in sp.encode(lines, out_type=str):
+        ids = [dictionary.index(p) for p in pieces[:max_len-1]] + [eos]
+        chunks.append(np.array(ids, dtype=np.int32))
+        lengths.append(len(ids))
+
+
+def make_batches(src_lens, tgt_lens, max_tokens, max_sents=1000):
+    """
+    ペアを長さ順に並べ、パディングを含めたトークン数が max_tokens 以下になるように分けたバッチ(インデックスの配列)のリストを返す関数
+    """
+    order = np.lexsort((src_lens, tgt_lens))
+    batches, head = [], 0
+    while head < len(order):
+        tail, width = head, 0
+        while tail < len(order) and tail - head < max_sents:
+            idx = order[tail]
+            new_width = max(width, src_lens[idx], tgt_lens[idx])
+            if (tail - head + 1) * new_width > max_tokens and tail > head:
+                break
+            width = new_width
+            tail += 1
+        batches.append(order[head:tail])
+        head = tail
+    return batches
+
+
+def collate(ids, offsets, batch, pad, left_pad):
+    import torch
+    seqs = [ids[offsets[i]:offsets[i+1]] for i in batch]
+    width = max(len(s) for s in seqs)
+    out = np.full((len(seqs), width), pad, dtype=np.int64)
+    for row, seq in enumerate(seqs):
+        if left_pad:
+            out[row, width-len(seq):] = seq
+        else:
+            out[row, :len(seq)] = seq
+    return torch.from_numpy(out)
+
+
+def score_batch(model, src, tgt, batch, pad, eos):
+    """
+    バッチ内の各ペアについて、目的言語の文の対数確率をトークン数で割った値の配列を返す関数
+    """
+    import torch
+    src_ids, src_offsets = src
+    tgt_ids, tgt_offsets = tgt
+    src_tokens = collate(src_ids, src_offsets, batch, pad, left_pad=True)
+    src_lengths = torch.from_numpy((src_offsets[batch+1] - src_offsets[batch]).astype(np.int64))
+    target = collate(tgt_ids, tgt_offsets, batch, pad, left_pad=False)
+    # デコーダーへの入力は、目的言語の文の末尾の </s> を先頭に移したもの
+    prev_output_tokens = torch.cat([torch.full_like(target[:, :1], eos), target[:, :-1]], dim=1)
+    prev_output_tokens[prev_output_tokens == eos] = pad
+    prev_output_tokens[:, 0] = eos
+
+    with torch.inference_mode():
+        net_output = model(src_tokens, src_lengths, prev_output_tokens)
+        lprobs = model.get_normalized_probs(net_output, log_probs=True)
+        lprobs = lprobs.gather(-1, target.unsqueeze(-1)).squeeze(-1)
+        mask = target.ne(pad)
+        scores = (lprobs * mask).sum(dim=1) / mask.sum(dim=1)
+    return scores.float().numpy()
+
+
+def score_worker(model, src, tgt, pad, eos, threads, batch_queue, result_queue):
+    import torch
+    torch.set_num_threads(threads)
+    print("Scoring pairs...  (PID {})".format(os.getpid()))
+    while True:
+        batch = batch_queue.get()
+        if batch is STOP:
+            break
+        result_queue.put((batch, score_batch(model, src, tgt, batch, pad, eos)))
+    print("Finished scoring pairs...: (PID {})".format(os.getpid()))
+
+
+def score_pairs(model, src, tgt, pad, eos, max_tokens=8000, workers=1, timeout=5.0):
+    """
+    全てのペアのスコアを、入力と同じ順序の配列として返す関数
+    ワーカーが異常終了したときは、timeout 秒以内に RuntimeError を送出する。
+    """
+    src_lens = np.diff(src[1])
+    tgt_lens = np.diff(tgt[1])
+    batches = make_batches(src_lens, tgt_lens, max_tokens)
+    scores = np.zeros(len(src_lens), dtype=np.float32)
+
+    # モデルと ID の配列は、fork によってワーカープロセスと共有される
+    ctx = mp.get_context("fork")
+    batch_queue, result_queue = ctx.Queue(), ctx.Queue()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    procs = [ctx.Process(target=score_worker, args=[model, src, tgt, pad, eos, threads, batch_queue, result_queue])
+             for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    for batch in batches:
+        batch_queue.put(batch)
+    for _ in range(workers):
+        batch_queue.put(STOP)
+
+    from tqdm import tqdm
+    for _ in tqdm(range(len(batches))):
+        # ワーカーが異常終了(例外、OOM による強制終了など)すると結果が届かないので、待つ間にワーカーの状態を確認する
+        while True:
+            try:
+                batch, batch_scores = result_queue.get(timeout=timeout)
+                break
+            except queue.Empty:
+                failed = [proc for proc in procs if proc.exitcode not in (None, 0)]
+                if failed or not any(proc.is_alive() for proc in procs):
+                    for proc in procs:
+                        if proc.is_alive():
+                            proc.terminate()
+                    for proc in procs:
+                        proc.join()
+                    if failed:
+                        raise RuntimeError("Error: a scoring worker (Process ID: {}) exited with code {}.".format(
+                            failed[0].pid, failed[0].exitcode))
+                    raise RuntimeError("Error: all scoring workers exited before scoring every batch.")
+        scores[batch] = batch_scores
+    for proc in procs:
+        proc.join()
+    return scores
+
+
+def select(scores, min_score=None, keep_ratio=None):
+    """
+    スコアが min_score 以上のペア、またはスコアが上位 keep_ratio の割合に入るペアを表す真偽値の配列を返す関数
+    """
+    keep = np.ones(len(scores), dtype=bool)
+    if min_score is not None:
+        keep &= scores >= min_score
+    if keep_ratio is not None:
+        num = int(round(keep_ratio * len(scores)))
+        top = np.zeros(len(scores), dtype=bool)
+        top[np.argsort(-scores, kind="stable")[:num]] = True
+        keep &= top
+    return keep
+
+
+def write_selected(in_path, out_path, keep):
+    with open(in_path, 'r', encoding="utf-8") as fin, open(out_path, 'w', encoding="utf-8") as fout:
+        for line, k in zip(fin, keep):
+            if k:
+                fout.write(line)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--src', default='en',
+                        help='source language of the checkpoint')
+    parser.add_argument('-t', '--tgt', default='ja',
+                        help='target language of the checkpoint')
+    parser.add_argument('--checkpoint_dir', default='checkpoints')
+    parser.add_argument('--checkpoint_file', default='checkpoint_last.pt')
+    parser.add_argument('--data', default='data-bin')
+    parser.add_argument('--bpe_model', default='bpe.model')
+    parser.add_argument('--input_prefix', required=True,
+                        help='prefix of the word-tokenized pairs (e.g. corpus/synthetic_bilingual/train)')
+    parser.add_argument('--output_prefix', default=None,
+                        help='prefix of the filtered pairs (required with --min_score or --keep_ratio)')
+    parser.add_argument('--min_score', type=float, default=None,
+                        help='keep pairs whose length-normalized log-probability is at least this value')
+    parser.add_argument('--keep_ratio', type=float, default=None,
+                        help='keep this ratio of pairs with the highest scores')
+    parser.add_argument('--max_tokens', type=int, default=8000,
+                        help='maximum number of tokens (including padding) in a batch')
+    parser.add_argument('--max_len', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    if (args.min_score is not None or args.keep_ratio is not None) and args.output_prefix is None:
+        parser.error("--output_prefix is required with --min_score or --keep_ratio")
+
+    import sentencepiece as spm
+    from fairseq.models.transformer import TransformerModel
+
+    hub = TransformerModel.from_pretrained(
+        args.checkpoint_dir, checkpoint_file=args.checkpoint_file, data_name_or_path=args.data)
+    model = hub.models[0]
+    model.eval()
+    sp = spm.SentencePieceProcessor(model_file=args.bpe_model)
+
+    start = time.time()
+    src_path = "{}.{}".format(args.input_prefix, args.src)
+    tgt_path = "{}.{}".format(args.input_prefix, args.tgt)
+    src = encode_file(src_path, sp, hub.src_dict, args.max_len)
+    tgt = encode_file(tgt_path, sp, hub.tgt_dict, args.max_len)
+    if len(src[1]) != len(tgt[1]):
+        raise ValueError("Error: %s and %s have different numbers of lines." % (src_path, tgt_path))
+    print("{} seconds for encoding {} pairs".format(time.time() - start, len(src[1]) - 1))
+
+    start = time.time()
+    scores = score_pairs(model, src, tgt, hub.tgt_dict.pad(), hub.tgt_dict.eos(),
+                         args.max_tokens, args.workers)
+    print("{} seconds for scoring {} pairs".format(time.time() - start, len(scores)))
+
+    with open("{}.scores".format(args.input_prefix), 'w') as f:
+        for score in scores.tolist():
+            f.write("{:.6f}\n".format(score))
+
+    if args.min_score is not None or args.keep_ratio is not None:
+        keep = select(scores, args.min_score, args.keep_ratio)
+        for lang in (args.src, args.tgt):
+            write_selected("{}.{}".format(args.input_prefix, lang),
+                           "{}.{}".format(args.output_prefix, lang), keep)
+        print("Kept {} of {} pairs".format(int(keep.sum()), len(scores)))
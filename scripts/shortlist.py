@@ -0,0 +1,158 @@
+"""
+推論時に出力層で計算する語彙を絞り込むための、語彙のショートリスト(lexical shortlist)を作成するスクリプト
+
+SentencePiece でエンコードした訓練データ(pre-process.sh が作成する train.en, train.ja)の各ペアについて、
+原言語のピースと目的言語のピースが同じペアに現れた回数(共起回数)を数える。
+原言語の各ピースについて、Dice 係数 2 * c(s, t) / (c(s) + c(t)) が大きい順に目的言語のピースを topk 個選び、候補とする。
+さらに、目的言語で出現頻度の高いピース frequent 個と特殊記号は、常に候補に含める。
+
+翻訳時には、バッチに含まれる原言語のピースの候補の和集合だけについて出力層(線形変換)を計算する。(Translation.load の shortlist を参照)
+
+usage:
+    python shortlist.py -s en -t ja --trainpref train --data data-bin --output shortlist.en-ja.npz
+"""
+
+import hashlib
+import os
+from argparse import ArgumentParser
+import numpy as np
+
+# fairseq の辞書で、dict.txt に書かれた単語より前に置かれる特殊記号(<s>, <pad>, </s>, <unk>)の数
+NSPECIAL = 4
+
+
+def read_dict(path):
+    """
+    fairseq の辞書ファイルを読み込み、{ピース: 番号} の辞書を返す関数
+    """
+    with open(path, 'r', encoding="utf-8") as f:
+        words = [line.split()[0] for line in f if line.strip()]
+    return {word: NSPECIAL + idx for idx, word in enumerate(words)}
+
+
+def dict_checksum(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def to_ids(line, vocab):
+    # 辞書にないピースは <unk> (3) とみなす
+    return np.unique(np.array([vocab.get(w, 3) for w in line.split()], dtype=np.int64))
+
+
+def count_cooccurrence(src_path, tgt_path, src_vocab, tgt_vocab, max_codes=2**23):
+    """
+    (原言語のピースの番号 * 目的言語の語彙数 + 目的言語のピースの番号, 共起回数) の配列と、
+    各言語のピースが現れたペアの数を返す関数
+    密な行列(語彙数 x 語彙数)を作らずに、小分けにしたペアごとに数えた結果を結合する。
+    一つのペアから作られる組の数は (原言語のピース数 x 目的言語のピース数) なので、長いペアが多いと組の数が急激に増える。
+    そのため、ペアの数ではなく、まだ結合していない組の数が max_codes に達するたびに結合する。
+    """
+    nsrc, ntgt = NSPECIAL + len(src_vocab), NSPECIAL + len(tgt_vocab)
+    keys, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    src_count, tgt_count = np.zeros(nsrc, dtype=np.int64), np.zeros(ntgt, dtype=np.int64)
+
+    def merge(codes, keys, counts):
+        codes = np.concatenate([keys, np.concatenate(codes)])
+        weights = np.concatenate([counts, np.ones(len(codes) - len(keys), dtype=np.int64)])
+        uniq, inverse = np.unique(codes, return_inverse=True)
+        return uniq, np.bincount(inverse.ravel(), weights=weights).astype(np.int64)
+
+    codes, num_codes = [], 0
+    with open(src_path, 'r', encoding="utf-8") as fs, open(tgt_path, 'r', encoding="utf-8") as ft:
+        for src, tgt in zip(fs, ft):
+            s, t = to_ids(src, src_vocab), to_ids(tgt, tgt_vocab)
+            src_count[s] += 1
+            tgt_count[t] += 1
+            codes.append((s[:, None] * ntgt + t[None, :]).ravel())
+            num_codes += len(codes[-1])
+            if num_codes >= max_codes:
+                keys, counts = merge(codes, keys, counts)
+                codes, num_codes = [], 0
+    if codes:
+        keys, counts = merge(codes, keys, counts)
+    return keys, counts, src_count, tgt_count
+
+
+def build_shortlist(keys, counts, src_count, tgt_count, topk=50, frequent=500):
+    """
+    原言語の各ピースの候補を CSR 形式 (offsets, cands) で返す関数
+    """
+    ntgt = len(tgt_count)
+    src, tgt = keys // ntgt, keys % ntgt
+    dice = 2 * counts / (src_count[src] + tgt_count[tgt])
+
+    # 原言語のピースごとに Dice 係数の降順に並べ、上位 topk 個を残す
+    order = np.lexsort((-dice, src))
+    src, tgt = src[order], tgt[order]
+    starts = np.searchsorted(src, np.arange(len(src_count)))
+    rank = np.arange(len(src)) - starts[src]
+    keep = rank < topk
+    src, tgt = src[keep], tgt[keep]
+
+    offsets = np.zeros(len(src_count) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(src_count)), out=offsets[1:])
+    frequent_ids = np.union1d(np.arange(NSPECIAL), np.argsort(-tgt_count, kind="stable")[:frequent])
+    return offsets, tgt.astype(np.int32), frequent_ids.astype(np.int32)
+
+
+class Shortlist():
+    def __init__(self, offsets, cands, frequent):
+        self.offsets = offsets
+        self.cands = cands
+        self.frequent = frequent
+
+    @classmethod
+    def load(cls, path, src_dict=None, tgt_dict=None):
+        """
+        shortlist.py で作成したファイルを読み込む関数
+        辞書ファイルのパスを与えたときは、ショートリストの作成に用いた辞書と同じかどうかを確認する。
+        """
+        data = np.load(path)
+        for key, dict_path in (("src_dict", src_dict), ("tgt_dict", tgt_dict)):
+            if dict_path is not None and dict_checksum(dict_path) != str(data[key]):
+                raise ValueError(
+                    "Error: %s was built with a different dictionary from %s." % (path, dict_path))
+        return cls(data["offsets"], data["cands"], data["frequent"])
+
+    def candidates(self, src_ids):
+        """
+        原言語のピースの番号の配列 src_ids に対する候補の和集合(ソート済みの配列)を返す関数
+        """
+        src_ids = np.unique(np.asarray(src_ids, dtype=np.int64))
+        src_ids = src_ids[src_ids < len(self.offsets) - 1]
+        parts = [self.cands[self.offsets[i]:self.offsets[i+1]] for i in src_ids.tolist()]
+        return np.unique(np.concatenate([self.frequent] + parts))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--src', default='en')
+    parser.add_argument('-t', '--tgt', default='ja')
+    parser.add_argument('--trainpref', default='train',
+                        help='prefix of the SentencePiece-encoded training data (e.g. train -> train.en, train.ja)')
+    parser.add_argument('--data', default='data-bin',
+                        help='directory of the fairseq dictionaries')
+    parser.add_argument('--topk', type=int, default=50,
+                        help='the number of candidates for each source piece')
+    parser.add_argument('--frequent', type=int, default=500,
+                        help='the number of the most frequent target pieces always included')
+    parser.add_argument('--max_codes', type=int, default=2**23,
+                        help='the number of (source piece, target piece) pairs counted before merging them')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    src_dict = os.path.join(args.data, "dict.{}.txt".format(args.src))
+    tgt_dict = os.path.join(args.data, "dict.{}.txt".format(args.tgt))
+    src_vocab, tgt_vocab = read_dict(src_dict), read_dict(tgt_dict)
+    keys, counts, src_count, tgt_count = count_cooccurrence(
+        "{}.{}".format(args.trainpref, args.src), "{}.{}".format(args.trainpref, args.tgt),
+        src_vocab, tgt_vocab, args.max_codes)
+    offsets, cands, frequent = build_shortlist(
+        keys, counts, src_count, tgt_count, args.topk, args.frequent)
+
+    output = args.output or "shortlist.{}-{}.npz".format(args.src, args.tgt)
+    np.savez(output, offsets=offsets, cands=cands, frequent=frequent,
+             src_dict=dict_checksum(src_dict), tgt_dict=dict_checksum(tgt_dict))
+    print("{} source pieces, {} candidates ({} always included) -> {}".format(
+        len(offsets) - 1, len(cands), len(frequent), output))
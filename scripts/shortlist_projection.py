@@ -0,0 +1,55 @@
+"""
+デコーダーの出力層を、語彙のショートリストに含まれるピースだけについて計算する出力層に置き換えるモジュール
+(translation.py から、ショートリストを用いるときにのみ読み込まれる)
+"""
+
+import torch
+from torch import nn
+
+
+class ShortlistProjection(nn.Module):
+    def __init__(self, projection):
+        """
+        projection: 元の出力層 (nn.Linear。埋め込み層と重みを共有していてもよい)
+        """
+        super().__init__()
+        self.projection = projection
+        self.ids = None
+        self.weight = None
+        self.bias = None
+
+    def set_shortlist(self, ids):
+        """
+        出力層で計算するピースの番号を指定する関数 (None のときは全ての語彙について計算する)
+        デコードの各ステップで重みを選び直さないように、ここで一度だけ選んでおく。
+        """
+        if ids is None:
+            self.ids, self.weight, self.bias = None, None, None
+            return
+        with torch.no_grad():
+            weight = self.projection.weight
+            self.ids = torch.as_tensor(ids, dtype=torch.long, device=weight.device)
+            self.weight = weight.index_select(0, self.ids)
+            bias = getattr(self.projection, "bias", None)
+            self.bias = bias.index_select(0, self.ids) if bias is not None else None
+
+    def forward(self, x):
+        if self.ids is None:
+            return self.projection(x)
+        # ショートリストに含まれないピースのスコアは -inf とし、ビームサーチで選ばれないようにする
+        logits = x.new_full(x.shape[:-1] + (self.projection.weight.size(0),), float("-inf"))
+        logits[..., self.ids] = nn.functional.linear(x, self.weight, self.bias)
+        return logits
+
+
+def attach(models):
+    """
+    各モデルのデコーダーの出力層を ShortlistProjection に置き換え、そのリストを返す関数
+    """
+    projections = []
+    for model in models:
+        decoder = model.decoder
+        if not isinstance(decoder.output_projection, ShortlistProjection):
+            decoder.output_projection = ShortlistProjection(decoder.output_projection)
+        projections.append(decoder.output_projection)
+    return projections
@@ -0,0 +1,251 @@
+"""
+ベースラインと一つ以上のシステム(逆翻訳を用いたモデルなど)の翻訳結果の BLEU を、ペアブートストラップ法で比較するスクリプト
+
+cli/test.sh が出力する BLEU は一つの値だけなので、差が偶然によるものかどうかがわからない。
+sacrebleu の --paired-bs は、リサンプリングのたびに Python のループで BLEU を計算し直すので、テストセットが大きいと遅い。
+このスクリプトでは、次のようにして計算を速くする。
+1. 各文の BLEU の十分統計量 (n-gram の一致数と総数 (n = 1, ..., 4)、翻訳文と参照訳の長さ) を、システムごとに一度だけ計算する。
+2. リサンプリングは、各文が選ばれた回数の行列 (リサンプリング回数 x 文数) として表し、
+   十分統計量の和を行列積でまとめて求め、BLEU も NumPy の配列演算でまとめて計算する。
+   (全てのシステムに同じリサンプリングを用いるので、ペアブートストラップになる)
+
+BLEU は sacrebleu の corpus_bleu と同じ値 (smooth_method='exp') になる。(--check で確かめられる)
+sacrebleu は requirements.txt の 1.5.1 と 2.x のどちらでも動く。
+各システムの BLEU の信頼区間 (既定では 95%) と、ベースラインとの差の信頼区間、p 値を表示する。
+p 値は、差の分布を平均が 0 になるように平行移動したものから、観測された差以上に(両側で)大きな差が得られる割合として求める。
+
+usage:
+    python significance.py --reference test.ja --baseline output_baseline.txt \
+        --systems output_bt.txt output_bt_tagged.txt --resamples 1000
+    python significance.py --check --reference test.ja --baseline output_baseline.txt --systems output_bt.txt
+"""
+
+import time
+from argparse import ArgumentParser
+from collections import Counter
+import numpy as np
+
+MAX_ORDER = 4
+# 十分統計量の列: [一致数 (n = 1, ..., 4), 総数 (n = 1, ..., 4), 翻訳文の長さ, 参照訳の長さ]
+NUM_STATS = 2 * MAX_ORDER + 2
+
+
+def ngrams(tokens):
+    return Counter(tuple(tokens[i:i + n]) for n in range(1, MAX_ORDER + 1)
+                   for i in range(len(tokens) - n + 1))
+
+
+def get_tokenizer(tokenize):
+    """
+    sacrebleu のトークナイザーを返す関数
+    """
+    try:
+        # sacrebleu 1.5.x (requirements.txt)
+        from sacrebleu.tokenizers import TOKENIZERS
+    except ImportError:
+        # sacrebleu 2.x
+        from sacrebleu.metrics.bleu import BLEU
+        return BLEU(tokenize=tokenize).tokenizer
+    return TOKENIZERS[tokenize]()
+
+
+def sent_stats(hyps, refs, tokenize="13a"):
+    """
+    各文の十分統計量を (文数, NUM_STATS) の配列として返す関数
+    トークン化は sacrebleu のトークナイザーで行う。
+    """
+    tokenizer = get_tokenizer(tokenize)
+
+    stats = np.zeros((len(hyps), NUM_STATS), dtype=np.int64)
+    for idx, (hyp, ref) in enumerate(zip(hyps, refs)):
+        hyp_tokens = tokenizer(hyp.rstrip()).split()
+        ref_tokens = tokenizer(ref.rstrip()).split()
+        matches = ngrams(hyp_tokens) & ngrams(ref_tokens)
+        for ngram, count in matches.items():
+            stats[idx, len(ngram) - 1] += count
+        for n in range(1, MAX_ORDER + 1):
+            stats[idx, MAX_ORDER + n - 1] = max(0, len(hyp_tokens) - n + 1)
+        stats[idx, -2] = len(hyp_tokens)
+        stats[idx, -1] = len(ref_tokens)
+    return stats
+
+
+def no_match_is_zero():
+    """
+    一致する n-gram が一つもないときの BLEU を 0 とするかどうかを返す関数
+    sacrebleu 2.x は 0 とするが、1.5.x は平滑化した精度から計算する。
+    """
+    import sacrebleu
+    return int(sacrebleu.__version__.split(".")[0]) >= 2
+
+
+def bleu(stats, zero_if_no_match=False):
+    """
+    十分統計量の和 (..., NUM_STATS) から BLEU を計算する関数 (先頭の次元についてまとめて計算する)
+    sacrebleu の BLEU.compute_bleu (smooth_method='exp') と同じ値を返す。
+    zero_if_no_match には、sacrebleu 2.x と同じ値にするときは True を与える。(no_match_is_zero を参照)
+    """
+    stats = np.asarray(stats, dtype=np.float64)
+    correct, total = stats[..., :MAX_ORDER], stats[..., MAX_ORDER:2 * MAX_ORDER]
+    sys_len, ref_len = stats[..., -2], stats[..., -1]
+
+    # 一致数が 0 の n-gram の精度は、そのような n-gram が現れるたびに半分にした値で置き換える
+    smooth = 2.0 ** np.cumsum(correct == 0, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precisions = np.where(correct > 0, 100.0 * correct / total, 100.0 / (smooth * total))
+        precisions = np.where(total > 0, precisions, 0.0)
+        log_p = np.where(precisions > 0, np.log(precisions), -np.inf).mean(axis=-1)
+        bp = np.where(sys_len < ref_len, np.exp(1.0 - ref_len / sys_len), 1.0)
+    bp = np.where(sys_len > 0, bp, 0.0)
+    score = bp * np.exp(log_p)
+    if zero_if_no_match:
+        score = np.where(correct.sum(axis=-1) > 0, score, 0.0)
+    return score
+
+
+def resample_counts(rng, num_sents, resamples):
+    """
+    各リサンプリングで各文が選ばれた回数の行列 (resamples, num_sents) を返す関数
+    """
+    idx = rng.integers(0, num_sents, size=(resamples, num_sents))
+    idx += np.arange(resamples)[:, None] * num_sents
+    return np.bincount(idx.ravel(), minlength=resamples * num_sents).reshape(resamples, num_sents)
+
+
+def paired_bootstrap(stats_ls, resamples=1000, seed=12345, block_elems=2**24, zero_if_no_match=False):
+    """
+    各システムの十分統計量のリストを受け取り、各リサンプリングでの BLEU の配列 (システム数, resamples) を返す関数
+    メモリを節約するため、リサンプリングは (回数 x 文数) が block_elems を超えないようにまとめて行う。
+    """
+    rng = np.random.default_rng(seed)
+    num_sents = stats_ls[0].shape[0]
+    block_size = max(1, block_elems // num_sents)
+    # (システム数, 文数, NUM_STATS) を (文数, システム数 * NUM_STATS) に並べ替えて、一度の行列積で全システムの和を求める
+    stacked = np.stack(stats_ls, axis=1).reshape(num_sents, -1).astype(np.float64)
+    scores = []
+    for head in range(0, resamples, block_size):
+        counts = resample_counts(rng, num_sents, min(block_size, resamples - head))
+        sums = (counts @ stacked).reshape(len(counts), len(stats_ls), NUM_STATS)
+        scores.append(bleu(sums, zero_if_no_match).T)
+    return np.concatenate(scores, axis=1)
+
+
+def compare(stats_ls, resamples=1000, seed=12345, alpha=0.05, zero_if_no_match=False):
+    """
+    先頭をベースラインとして、各システムの BLEU、信頼区間、ベースラインとの差とその信頼区間、p 値を辞書のリストで返す関数
+    """
+    observed = np.array([bleu(stats.sum(axis=0), zero_if_no_match) for stats in stats_ls])
+    samples = paired_bootstrap(stats_ls, resamples, seed, zero_if_no_match=zero_if_no_match)
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+
+    results = []
+    for k in range(len(stats_ls)):
+        result = {"bleu": observed[k], "ci": np.percentile(samples[k], q)}
+        if k > 0:
+            delta = observed[k] - observed[0]
+            deltas = samples[k] - samples[0]
+            # 帰無仮説 (差がない) のもとでの分布として、平均が 0 になるように平行移動する
+            null = deltas - deltas.mean()
+            result["delta"] = delta
+            result["delta_ci"] = np.percentile(deltas, q)
+            result["p"] = (np.sum(np.abs(null) >= abs(delta)) + 1) / (resamples + 1)
+        results.append(result)
+    return results
+
+
+# check で確かめる、BLEU の計算で特別な扱いが必要な例 (翻訳文のリスト, 参照訳のリスト)
+EDGE_CASES = {
+    "no unigram matches": (["a b c d e"], ["v w x y z"]),
+    "no 4-gram matches": (["the cat sat on a mat ."], ["the cat sat on the mat ."]),
+    "empty hypothesis": ([""], ["the cat sat on the mat ."]),
+    "empty hypothesis in a corpus": (["", "the cat sat on the mat ."],
+                                     ["a dog .", "the cat sat on the mat ."]),
+    "hypotheses shorter than 4 tokens": (["the cat", "a"], ["the cat sat", "a dog"]),
+    "brevity penalty": (["the cat"], ["the cat sat on the mat ."]),
+    "longer than the reference": (["the cat sat on the mat on the mat ."], ["the cat sat on the mat ."]),
+    "exact match": (["Hello, world!"], ["Hello, world!"]),
+}
+
+
+def check(hyps_ls=(), refs=None, tokenize="13a", tol=1e-6):
+    """
+    bleu と sent_stats による BLEU が sacrebleu の corpus_bleu と一致するかを、EDGE_CASES と hyps_ls の各システムについて確かめる関数
+    一致しなかったものの (名前, この実装の値, sacrebleu の値) のリストを返す。
+    """
+    import sacrebleu
+    zero_if_no_match = no_match_is_zero()
+    cases = list(EDGE_CASES.items()) + [("system {}".format(k), (hyps, refs)) for k, hyps in enumerate(hyps_ls)]
+    mismatches = []
+    for name, (hyps, case_refs) in cases:
+        ours = float(bleu(sent_stats(hyps, case_refs, tokenize).sum(axis=0), zero_if_no_match))
+        expected = sacrebleu.corpus_bleu(hyps, [case_refs], tokenize=tokenize).score
+        if abs(ours - expected) > tol:
+            mismatches.append((name, ours, expected))
+    return mismatches
+
+
+def read_lines(path):
+    with open(path, 'r', encoding="utf-8") as f:
+        return [line.rstrip('\n') for line in f]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--reference', required=True,
+                        help='reference translations (one sentence per line)')
+    parser.add_argument('--baseline', required=True,
+                        help='detokenized output of the baseline system (e.g. output.txt of cli/test.sh)')
+    parser.add_argument('--systems', nargs='+', required=True,
+                        help='detokenized outputs of the systems compared with the baseline')
+    parser.add_argument('--resamples', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='significance level (the confidence intervals are 100 * (1 - alpha) %%)')
+    parser.add_argument('--tokenize', default='13a',
+                        help='tokenizer of sacrebleu (the same default as cli/test.sh)')
+    parser.add_argument('--check', action='store_true',
+                        help='check that the BLEU of each system and of edge cases agrees with sacrebleu.corpus_bleu')
+    args = parser.parse_args()
+
+    refs = read_lines(args.reference)
+    paths = [args.baseline] + args.systems
+    start = time.perf_counter()
+    stats_ls = []
+    for path in paths:
+        hyps = read_lines(path)
+        if len(hyps) != len(refs):
+            raise ValueError("{} has {} lines, but the reference has {} lines".format(
+                path, len(hyps), len(refs)))
+        stats_ls.append(sent_stats(hyps, refs, args.tokenize))
+    stats_time = time.perf_counter() - start
+
+    if args.check:
+        import sacrebleu
+        mismatches = check([read_lines(path) for path in paths], refs, args.tokenize)
+        for name, ours, expected in mismatches:
+            print("{}: {:.6f} (sacrebleu {}: {:.6f})".format(name, ours, sacrebleu.__version__, expected))
+        if mismatches:
+            raise RuntimeError("Error: BLEU differs from sacrebleu.corpus_bleu in {} case(s).".format(len(mismatches)))
+        print("BLEU agrees with sacrebleu {} on {} edge cases and {} systems.".format(
+            sacrebleu.__version__, len(EDGE_CASES), len(paths)))
+
+    start = time.perf_counter()
+    results = compare(stats_ls, args.resamples, args.seed, args.alpha, no_match_is_zero())
+    bootstrap_time = time.perf_counter() - start
+
+    level = int(round(100 * (1 - args.alpha)))
+    print("{:40s} {:>7s} {:>17s} {:>7s} {:>17s} {:>8s}".format(
+        "system", "BLEU", "{}% CI".format(level), "delta", "{}% CI".format(level), "p"))
+    for path, result in zip(paths, results):
+        line = "{:40s} {:7.2f}   [{:5.2f}, {:5.2f}]".format(
+            path[-40:], result["bleu"], *result["ci"])
+        if "delta" in result:
+            line += " {:+7.2f}   [{:+5.2f}, {:+5.2f}] {:8.4f}{}".format(
+                result["delta"], *result["delta_ci"], result["p"],
+                " *" if result["p"] < args.alpha else "")
+        else:
+            line += "  (baseline)"
+        print(line)
+
+    print("\n{} sentences, {} resamples: statistics {:.1f} s, bootstrap {:.1f} s".format(
+        len(refs), args.resamples, stats_time, bootstrap_time))
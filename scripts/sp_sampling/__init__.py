@@ -0,0 +1,5 @@
+"""
+fairseq の --user-dir に指定すると、translation_sp_sampling タスクが登録される (task.py を参照)
+"""
+
+from . import task  # noqa
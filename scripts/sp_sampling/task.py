@@ -0,0 +1,152 @@
+"""
+学習時に SentencePiece の分割をその場でサンプリングする fairseq のタスク (translation_sp_sampling)
+
+encode.py の --alpha でサンプリングした訓練データを作るには、エポックごとに訓練データ全体をエンコード・バイナリ化し直す必要がある。
+このタスクは、生のテキスト(corpus/genuine_bilingual の train*.en など)を読み込み、
+データローダーのワーカープロセスの中で、各文を取り出すたびにサンプリングした分割でエンコードする。
+そのため、前処理をやり直さずに、エポックごとに異なる分割で学習できる。
+
+    - 訓練用データ (train): 取り出すたびに alpha でサンプリングした分割を用いる
+    - 評価用データ (valid など): 読み込み時に一度だけ決定的にエンコードし、その結果をキャッシュして用いる
+
+バッチの作成(--max-tokens)には、決定的にエンコードしたときの長さを用いる。(長さは data-bin/sp_sampling に保存され、次回からは再計算しない)
+サンプリングした分割は決定的な分割より少し長くなることが多いので、--max-tokens は少し小さめに設定するとよい。
+
+usage:
+    fairseq-train data-bin --user-dir scripts/sp_sampling --task translation_sp_sampling -s en -t ja \
+        --raw-data corpus/genuine_bilingual --sp-model bpe.model --sp-alpha 0.1 --num-workers 4 ...
+"""
+
+import os
+from dataclasses import dataclass, field
+import numpy as np
+import torch
+from fairseq.data import FairseqDataset, LanguagePairDataset
+from fairseq.tasks import register_task
+from fairseq.tasks.translation import TranslationConfig, TranslationTask
+
+from .text_lines import SPEncoder, TextLines, piece_lengths, split_files
+
+
+class SampledTextDataset(FairseqDataset):
+    def __init__(self, lines, encoder, dictionary, sample, max_len, cache_dir=None):
+        """
+        lines:      TextLines (生のテキスト)
+        encoder:    SPEncoder
+        sample:     True のときは取り出すたびに分割をサンプリングし、False のときは決定的な分割をキャッシュして用いる
+        max_len:    </s> を含めた系列の長さの上限 (サンプリングで長くなった系列は切り詰める)
+        """
+        self.lines = lines
+        self.encoder = encoder
+        self.dictionary = dictionary
+        self.sample = sample
+        self.max_len = max_len
+        self.epoch = 1
+
+        if sample:
+            self.sizes = np.minimum(piece_lengths(lines, encoder, cache_dir) + 1, max_len)
+        else:
+            self.ids, self.offsets = self.encode_all()
+            self.sizes = np.diff(self.offsets).astype(np.int32)
+
+    def to_ids(self, pieces):
+        ids = self.dictionary.encode_line(' '.join(pieces), add_if_not_exist=False,
+                                          append_eos=True).long()
+        if len(ids) > self.max_len:
+            ids = torch.cat([ids[:self.max_len-1], ids[-1:]])
+        return ids
+
+    def encode_all(self, batch_size=10000):
+        """
+        全ての文を決定的にエンコードし、(全ての文の ID を連結した配列, 各文の開始位置の配列) を返す関数
+        """
+        chunks, lengths = [], []
+        for head in range(0, len(self.lines), batch_size):
+            tail = min(head + batch_size, len(self.lines))
+            sents = [self.lines[i] for i in range(head, tail)]
+            for pieces in self.encoder.encode(sents, sample=False):
+                ids = self.to_ids(pieces).numpy().astype(np.int32)
+                chunks.append(ids)
+                lengths.append(len(ids))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+        return ids, offsets
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __getitem__(self, idx):
+        if not self.sample:
+            return torch.from_numpy(self.ids[self.offsets[idx]:self.offsets[idx+1]]).long()
+        info = torch.utils.data.get_worker_info()
+        self.encoder.reseed((self.epoch, info.id if info is not None else -1))
+        return self.to_ids(self.encoder.encode([self.lines[idx]])[0])
+
+    def __len__(self):
+        return len(self.lines)
+
+    def num_tokens(self, index):
+        return self.sizes[index]
+
+    def size(self, index):
+        return self.sizes[index]
+
+    @property
+    def supports_prefetch(self):
+        return False
+
+
+class SampledPairDataset(LanguagePairDataset):
+    """
+    エポックの番号を原言語側・目的言語側のデータセットに伝える LanguagePairDataset
+    """
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        self.src.set_epoch(epoch)
+        self.tgt.set_epoch(epoch)
+
+
+@dataclass
+class SPSamplingTranslationConfig(TranslationConfig):
+    raw_data: str = field(
+        default="", metadata={"help": "directory of raw (not encoded) text files, e.g. train.en or train1.en train2.en ..."})
+    sp_model: str = field(
+        default="bpe.model", metadata={"help": "SentencePiece model used to encode the raw text"})
+    sp_alpha: float = field(
+        default=0.1, metadata={"help": "smoothing parameter of subword sampling for the training data"})
+    sp_nbest: int = field(
+        default=-1, metadata={"help": "the number of segmentation candidates to sample from (-1: all)"})
+    sp_seed: int = field(
+        default=1, metadata={"help": "random seed of subword sampling"})
+
+
+@register_task("translation_sp_sampling", dataclass=SPSamplingTranslationConfig)
+class SPSamplingTranslationTask(TranslationTask):
+    def load_dataset(self, split, epoch=1, combine=False, **kwargs):
+        src, tgt = self.cfg.source_lang, self.cfg.target_lang
+        encoder = SPEncoder(self.cfg.sp_model, self.cfg.sp_alpha,
+                            self.cfg.sp_nbest, self.cfg.sp_seed)
+        sample = split == getattr(self.cfg, "train_subset", "train")
+        cache_dir = os.path.join(self.cfg.data.split(os.pathsep)[0], "sp_sampling")
+
+        datasets = []
+        for lang, dictionary, max_len in ((src, self.src_dict, self.cfg.max_source_positions),
+                                          (tgt, self.tgt_dict, self.cfg.max_target_positions)):
+            paths = split_files(self.cfg.raw_data, split, lang)
+            if not paths:
+                raise FileNotFoundError("Dataset not found: {} ({}) in {}".format(
+                    split, lang, self.cfg.raw_data))
+            datasets.append(SampledTextDataset(TextLines(paths), encoder, dictionary,
+                                               sample, max_len, cache_dir))
+        src_ds, tgt_ds = datasets
+        if len(src_ds) != len(tgt_ds):
+            raise ValueError("Error: {} has {} {} sentences but {} {} sentences.".format(
+                split, len(src_ds), src, len(tgt_ds), tgt))
+
+        self.datasets[split] = SampledPairDataset(
+            src_ds, src_ds.sizes, self.src_dict, tgt_ds, tgt_ds.sizes, self.tgt_dict,
+            left_pad_source=self.cfg.left_pad_source,
+            left_pad_target=self.cfg.left_pad_target,
+            shuffle=(split != "test"))
@@ -0,0 +1,170 @@
+"""
+生のテキスト(一行一文)を読み込み、SentencePiece でエンコードするための部品
+
+TextLines:  テキストファイルを mmap し、各行の開始位置の配列だけをメモリに載せる。
+            fork したデータローダーのワーカープロセスとは、ページキャッシュを通してファイルの中身を共有する。
+SPEncoder:  SentencePiece のモデルを各プロセスで一度だけ読み込み、文をピースの列にエンコードする。
+            alpha を指定したときは、呼び出すたびに異なる分割をサンプリングする(subword regularization)。
+
+fairseq には依存しないので、単体で動作を確認できる。
+"""
+
+import glob
+import hashlib
+import mmap
+import os
+import re
+import numpy as np
+
+
+def split_files(data_dir, split, lang):
+    """
+    data_dir にある split の言語 lang のファイルのパスを返す関数
+    小分けにされたファイル(例 train1.en train2.en ...)は番号順に並べる。
+    """
+    pattern = re.compile(r"^{}(\d*)\.{}$".format(re.escape(split), re.escape(lang)))
+    paths = []
+    for path in glob.glob(os.path.join(data_dir, "{}*.{}".format(split, lang))):
+        m = pattern.match(os.path.basename(path))
+        if m:
+            paths.append((int(m.group(1)) if m.group(1) else 0, path))
+    return [path for _, path in sorted(paths)]
+
+
+class TextLines():
+    def __init__(self, paths):
+        self.paths = paths
+        starts, ends, files = [], [], []
+        for idx, path in enumerate(paths):
+            head, tail = self.line_offsets(path)
+            starts.append(head)
+            ends.append(tail)
+            files.append(np.full(len(head), idx, dtype=np.int32))
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        self.ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+        self.files = np.concatenate(files) if files else np.zeros(0, dtype=np.int32)
+        self.mmaps = None
+
+    @staticmethod
+    def line_offsets(path):
+        """
+        各行の (開始位置, 終了位置) の配列を返す関数 (終了位置は改行文字を含まない)
+        """
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = np.frombuffer(mm, dtype=np.uint8)
+            ends = np.flatnonzero(data == ord('\n')).astype(np.int64)
+            if len(data) and data[-1] != ord('\n'):
+                ends = np.append(ends, len(data))
+            del data
+            mm.close()
+        starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+        return starts, ends
+
+    def open(self):
+        # mmap はプロセスごとに開き直す (pickle で送らない)
+        self.mmaps = []
+        for path in self.paths:
+            with open(path, "rb") as f:
+                self.mmaps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                                  if os.path.getsize(path) else b"")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["mmaps"] = None
+        return state
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        if self.mmaps is None:
+            self.open()
+        mm = self.mmaps[self.files[idx]]
+        return mm[self.starts[idx]:self.ends[idx]].decode("utf-8").strip()
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class SPEncoder():
+    def __init__(self, model_path, alpha=None, nbest=-1, seed=1):
+        """
+        alpha:  サンプリングの平滑化パラメータ (None のときは常に最も確率の高い分割を返す)
+        nbest:  サンプリングの候補とする分割の数 (-1 のときは全ての分割からサンプリングする)
+        """
+        self.model_path = model_path
+        self.alpha = alpha
+        self.nbest = nbest
+        self.seed = seed
+        self.sp = None
+        self.seeded = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["sp"], state["seeded"] = None, None
+        return state
+
+    def load(self):
+        if self.sp is None:
+            import sentencepiece as spm
+            self.sp = spm.SentencePieceProcessor()
+            self.sp.Load(self.model_path)
+        return self.sp
+
+    def reseed(self, key):
+        """
+        サンプリングの乱数のシードを (seed, key) から決める関数
+        データローダーのワーカーはエポックごとに同じ状態から fork されるので、
+        key にエポックとワーカーの番号を含めないと、毎エポック同じ分割がサンプリングされる。
+        """
+        if self.seeded == key:
+            return
+        import sentencepiece as spm
+        digest = hashlib.blake2b(repr((self.seed, key)).encode(), digest_size=4).digest()
+        spm.set_random_generator_seed(int.from_bytes(digest, "little"))
+        self.seeded = key
+
+    def encode(self, sents, sample=None):
+        """
+        文のリストをピース(str)の列のリストにエンコードする関数
+        sample が None のときは alpha が指定されているかどうかでサンプリングの有無を決める。
+        """
+        sample = self.alpha is not None if sample is None else sample
+        if sample:
+            return self.load().encode(sents, out_type=str, enable_sampling=True,
+                                      alpha=self.alpha, nbest_size=self.nbest)
+        return self.load().encode(sents, out_type=str)
+
+    def checksum(self):
+        with open(self.model_path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()[:8]
+
+
+def piece_lengths(lines, encoder, cache_dir=None, batch_size=10000):
+    """
+    各行を決定的にエンコードしたときのピース数の配列を返す関数
+    fairseq のバッチ作成(トークン数による分割、長さによるフィルタ)に用いる。
+    cache_dir を指定したときは、テキストと SentencePiece のモデルごとに .npy として保存し、次回からは読み込むだけにする。
+    """
+    cache = None
+    if cache_dir is not None:
+        key = hashlib.md5(repr([(p, os.path.getsize(p), os.path.getmtime(p))
+                               for p in lines.paths]).encode()).hexdigest()[:8]
+        cache = os.path.join(cache_dir, "lengths.{}.{}.npy".format(key, encoder.checksum()))
+        if os.path.exists(cache):
+            return np.load(cache)
+
+    lengths = np.zeros(len(lines), dtype=np.int32)
+    for head in range(0, len(lines), batch_size):
+        tail = min(head + batch_size, len(lines))
+        pieces = encoder.encode([lines[i] for i in range(head, tail)], sample=False)
+        lengths[head:tail] = [len(p) for p in pieces]
+
+    if cache is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache, lengths)
+    return lengths
@@ -0,0 +1,181 @@
+"""
+ビーム幅(beam)と長さペナルティ(lenpen)の組み合わせを一度の実行で評価するスクリプト
+
+cli/test.sh で設定ごとに fairseq-interactive を実行し直す代わりに、次のようにして計算を共有する。
+1. 各バッチのエンコーダーの出力は一度だけ計算し、全てのビーム幅のデコードで使い回す。
+2. fairseq のビームサーチでは、lenpen は終了した仮説の順位付けにしか影響しないので、
+   各ビーム幅について nbest=beam で一度だけデコードし、各 lenpen の値で仮説を選び直す。
+   (仮説のスコアは、対数確率の和を (トークン数) ** lenpen で割った値)
+
+各設定の BLEU と、エンコーダー(共有)とデコードにかかった時間を表示する。
+
+usage:
+    python sweep.py --src en --tgt ja --checkpoint_dir checkpoints --checkpoint_file checkpoint_last.pt \
+        --data data-bin --bpe_model bpe.model --input test.en --reference test.ja \
+        --beam 1 3 5 --lenpen 0.6 0.8 1.0 1.2
+"""
+
+import copy
+import time
+from argparse import ArgumentParser
+import numpy as np
+from translation import Translation
+
+
+def make_batches(hub, src_sents, batch_size):
+    """
+    前処理済みの文を長さ順に並べて batch_size 文ずつまとめ、fairseq の入力形式のバッチのリストを返す関数
+    """
+    import torch
+    from fairseq.data import data_utils
+    tokens = [hub.encode(sent) for sent in src_sents]
+    order = np.argsort([len(t) for t in tokens], kind="stable")
+    pad = hub.src_dict.pad()
+    batches = []
+    for head in range(0, len(order), batch_size):
+        ids = order[head:head + batch_size]
+        batches.append({
+            "id": torch.from_numpy(ids),
+            "net_input": {
+                "src_tokens": data_utils.collate_tokens([tokens[i] for i in ids], pad, left_pad=True),
+                "src_lengths": torch.tensor([len(tokens[i]) for i in ids]),
+            },
+        })
+    return batches
+
+
+def build_generators(hub, beams):
+    generators = {}
+    for beam in beams:
+        if hasattr(hub, "cfg"):
+            from omegaconf import open_dict
+            gen_args = copy.deepcopy(hub.cfg.generation)
+            with open_dict(gen_args):
+                gen_args.beam = beam
+                gen_args.nbest = beam
+                gen_args.lenpen = 1.0
+        else:
+            # fairseq 0.10.2 (requirements.txt) のハブは、設定を argparse.Namespace (hub.args) として持つ
+            gen_args = copy.copy(hub.args)
+            gen_args.beam = beam
+            gen_args.nbest = beam
+            gen_args.lenpen = 1.0
+        generators[beam] = hub.task.build_generator(hub.models, gen_args)
+    return generators
+
+
+def rescore(hypos, lenpen):
+    """
+    終了した仮説のリストから、長さペナルティ lenpen で正規化したスコアが最も高い仮説を返す関数
+    """
+    return max(hypos, key=lambda h: h["positional_scores"].sum().item() / len(h["tokens"]) ** lenpen)
+
+
+def sweep(model, src_sents, beams, lenpens, batch_size):
+    """
+    各設定 (beam, lenpen) の翻訳結果と、(エンコーダーの時間, 各ビーム幅のデコードの時間) を返す関数
+    """
+    import torch
+    hub = model.model
+    generators = build_generators(hub, beams)
+    batches = make_batches(hub, src_sents, batch_size)
+    hyps = {(beam, lenpen): [None] * len(src_sents) for beam in beams for lenpen in lenpens}
+    enc_time, dec_time = 0.0, {beam: 0.0 for beam in beams}
+
+    # 全てのビーム幅のデコードで共有するエンコーダーの出力は、上書きする前の本来の関数で計算する
+    forward_encoder = generators[beams[0]].model.forward_encoder
+    for batch in batches:
+        with torch.inference_mode():
+            start = time.perf_counter()
+            encoder_outs = forward_encoder(batch["net_input"])
+            enc_time += time.perf_counter() - start
+
+            for beam, generator in generators.items():
+                # エンコーダーの出力は並べ替えのたびに新しいテンソルとして複製されるので、そのまま共有してよい
+                generator.model.forward_encoder = lambda net_input: encoder_outs
+                try:
+                    start = time.perf_counter()
+                    results = hub.task.inference_step(generator, hub.models, batch)
+                    dec_time[beam] += time.perf_counter() - start
+                finally:
+                    # インスタンスの属性を削除して、クラスの forward_encoder に戻す
+                    del generator.model.forward_encoder
+
+                for idx, hypos in zip(batch["id"].tolist(), results):
+                    for lenpen in lenpens:
+                        best = rescore(hypos, lenpen)
+                        hyps[(beam, lenpen)][idx] = model.postproc(hub.decode(best["tokens"]))
+    return hyps, enc_time, dec_time, batches
+
+
+def check(model, src_sents, hyps, batches, num_batches=2):
+    """
+    先頭の num_batches 個のバッチについて、各設定の翻訳結果が hub.translate (設定ごとに通常どおりデコードしたもの) と
+    一致するかを確かめ、一致しなかった (beam, lenpen, 文の番号) のリストを返す関数
+    """
+    hub = model.model
+    mismatches = []
+    for batch in batches[:num_batches]:
+        ids = batch["id"].tolist()
+        for (beam, lenpen), hyp in sorted(hyps.items()):
+            expected = hub.translate([src_sents[i] for i in ids], beam=beam, lenpen=lenpen)
+            mismatches += [(beam, lenpen, i) for i, e in zip(ids, expected)
+                           if model.postproc(e) != hyp[i]]
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--src', default='en')
+    parser.add_argument('--tgt', default='ja')
+    parser.add_argument('--checkpoint_dir', default='checkpoints')
+    parser.add_argument('--checkpoint_file', default='checkpoint_last.pt')
+    parser.add_argument('--data', default='data-bin')
+    parser.add_argument('--bpe_model', default='bpe.model')
+    parser.add_argument('--input', required=True,
+                        help='raw source sentences (one sentence per line)')
+    parser.add_argument('--reference', required=True,
+                        help='raw reference translations (one sentence per line)')
+    parser.add_argument('--beam', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--lenpen', type=float, nargs='+',
+                        default=[0.6, 0.8, 1.0, 1.2])
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--tokenize', default='13a',
+                        help='tokenizer of sacrebleu (the same default as cli/test.sh)')
+    parser.add_argument('--check_batches', type=int, default=2,
+                        help='the number of batches whose translations are compared with hub.translate for every configuration (0 disables the check)')
+    args = parser.parse_args()
+
+    import sacrebleu
+
+    model = Translation(args.src, args.tgt)
+    model.load(args.checkpoint_dir, args.checkpoint_file,
+               args.data, args.bpe_model)
+    with open(args.input, 'r', encoding="utf-8") as f:
+        src_sents = [model.preproc(line.strip()) for line in f]
+    with open(args.reference, 'r', encoding="utf-8") as f:
+        refs = [line.strip() for line in f]
+
+    hyps, enc_time, dec_time, batches = sweep(
+        model, src_sents, args.beam, args.lenpen, args.batch_size)
+
+    if args.check_batches > 0:
+        mismatches = check(model, src_sents, hyps, batches, args.check_batches)
+        if mismatches:
+            raise RuntimeError("{} translations differ from hub.translate, e.g. (beam, lenpen, sentence) = {}".format(
+                len(mismatches), mismatches[:5]))
+        print("Translations of {} batches are identical to hub.translate for all configurations.\n".format(
+            min(args.check_batches, len(batches))))
+
+    print("{:>5s} {:>7s} {:>8s} {:>14s}".format("beam", "lenpen", "BLEU", "sents/s"))
+    separate = 0.0
+    for (beam, lenpen), hyp in sorted(hyps.items()):
+        bleu = sacrebleu.corpus_bleu(hyp, [refs], tokenize=args.tokenize)
+        sec = enc_time + dec_time[beam]
+        separate += sec
+        print("{:5d} {:7.2f} {:8.2f} {:14.1f}".format(
+            beam, lenpen, bleu.score, len(src_sents) / sec))
+
+    total = enc_time + sum(dec_time.values())
+    print("\n{} configurations in {:.1f} s (encoder {:.1f} s, shared). Separate runs would take about {:.1f} s.".format(
+        len(hyps), total, enc_time, separate))
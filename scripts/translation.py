@@ -1,10 +1,9 @@
+import os
 import re
 import unicodedata
-import sentencepiece as spm
-from fairseq.models.transformer import TransformerModel
-from sacremoses import MosesTokenizer
-import MeCab
-import unidic
+
+# fairseq, sacremoses, MeCab, sentencepiece の読み込みには時間がかかるので、
+# 原言語に応じて必要なものだけを、必要になった時点で読み込む
 
 
 class Translation:
@@ -13,8 +12,11 @@ class Translation:
         self.tgt = tgt
         self.ln_ls = ["en", "ja"]
         if src == "en":
+            from sacremoses import MosesTokenizer
             self.tokenizer = MosesTokenizer(lang="en")
         elif src == "ja":
+            import MeCab
+            import unidic
             self.tokenizer = MeCab.Tagger("-Owakati")
         else:
             raise ValueError(
@@ -24,13 +26,65 @@ class Translation:
             raise ValueError(
                 "Error: Target language %s is not supported." % tgt)
 
-    def load(self, checkpoint_dir, checkpoint_file, data_name_or_path, path_bpe_model):
+    def load(self, checkpoint_dir, checkpoint_file, data_name_or_path, path_bpe_model, shortlist=None):
+        """
+        shortlist:  shortlist.py で作成した語彙のショートリストのパス
+                    指定したときは、バッチごとに候補となるピースだけについて出力層を計算する。(use_shortlist で切り替えられる)
+        """
+        import sentencepiece as spm
+        from fairseq.models.transformer import TransformerModel
         self.model = TransformerModel.from_pretrained(
             checkpoint_dir,
             checkpoint_file=checkpoint_file,
             data_name_or_path=data_name_or_path
         )
         self.sp = spm.SentencePieceProcessor(model_file=path_bpe_model)
+        self.load_shortlist(shortlist)
+
+    def load_export(self, export_dir, shortlist=None):
+        """
+        export_model.py で書き出した推論用のディレクトリを読み込む関数
+        学習用のチェックポイントを読み込む load よりも速く、重みは mmap によってワーカープロセス間で共有される。
+        """
+        import sentencepiece as spm
+        from export_model import BPE_FILE, load_export
+        self.model = load_export(export_dir)
+        self.sp = spm.SentencePieceProcessor(
+            model_file=os.path.join(export_dir, BPE_FILE))
+        self.load_shortlist(shortlist)
+
+    def load_shortlist(self, shortlist):
+        self.shortlist, self.use_shortlist = None, False
+        if shortlist is None:
+            return
+        from shortlist import Shortlist
+        from shortlist_projection import attach
+        # data_name_or_path は fairseq によって checkpoint_dir からの相対パスとして解決されるので、解決後のパスを用いる
+        # (fairseq 0.10.2 (requirements.txt) のハブは、設定を argparse.Namespace (hub.args) として持つ)
+        if hasattr(self.model, "cfg"):
+            data_dir = self.model.cfg.task.data
+        else:
+            data_dir = self.model.args.data
+        self.shortlist = Shortlist.load(
+            shortlist,
+            os.path.join(data_dir, "dict.{}.txt".format(self.src)),
+            os.path.join(data_dir, "dict.{}.txt".format(self.tgt)))
+        self.projections = attach(self.model.models)
+        self.use_shortlist = True
+
+    def set_shortlist(self, src_sents):
+        """
+        バッチに含まれる原言語のピースの候補の和集合を、出力層で計算する語彙として設定する関数
+        """
+        if self.shortlist is None:
+            return
+        ids = None
+        if self.use_shortlist:
+            src_dict = self.model.src_dict
+            ids = self.shortlist.candidates(
+                [src_dict.index(w) for src_sent in src_sents for w in src_sent.split()])
+        for projection in self.projections:
+            projection.set_shortlist(ids)
 
     def preproc_en(self, en):
         en = unicodedata.normalize("NFKC", en)
@@ -46,9 +100,22 @@ class Translation:
         ja = ' '.join(self.sp.encode(ja, out_type="str"))
         return ja
 
+    def preproc(self, src_sent):
+        return self.preproc_en(src_sent) if self.src == "en" else self.preproc_ja(src_sent)
+
+    def postproc(self, tgt_sent):
+        return ''.join(tgt_sent.split()).replace(' ', '').replace('_', '').strip()
+
+    def generate(self, src_sents, beam, lenpen):
+        """
+        前処理済みの文のリストをまとめて翻訳する関数 (fairseq の内部でバッチ処理される)
+        """
+        self.set_shortlist(src_sents)
+        tgt_sents = self.model.translate(src_sents, beam=beam, lenpen=lenpen)
+        return [self.postproc(tgt_sent) for tgt_sent in tgt_sents]
+
+    def translate_batch(self, src_sents, beam, lenpen):
+        return self.generate([self.preproc(src_sent) for src_sent in src_sents], beam, lenpen)
+
     def translate(self, src_sent, beam, lenpen):
-        src_sent = self.preproc_en(
-            src_sent) if self.src == "en" else self.preproc_ja(src_sent)
-        tgt_sent = self.model.translate(src_sent, beam, lenpen)
-        tgt_sent = ''.join(tgt_sent.split()).replace(' ', '').replace('_', '').strip()
-        return tgt_sent
+        return self.translate_batch([src_sent], beam, lenpen)[0]
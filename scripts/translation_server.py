@@ -0,0 +1,245 @@
+"""
+Translation を一度だけ読み込み、ローカルの HTTP サーバとして提供するスクリプト
+
+同時に届いたリクエストを動的にまとめて(マイクロバッチ)、一回の順伝播で翻訳する。
+バッチは次のどちらかを満たした時点で翻訳される。
+    1. バッチ内のトークン数の合計が max_batch_tokens に達した
+    2. バッチの最初のリクエストが届いてから max_delay ミリ秒が経過した
+待ち行列の長さが max_queue を超えたときは 503 を返し、待ち時間が際限なく伸びないようにする。
+
+エンドポイント:
+    POST /translate     {"text": "..."} を受け取り、{"translation": "..."} を返す
+    GET  /metrics       レイテンシのヒストグラム、パーセンタイル、待ち行列の長さ、バッチの大きさを返す
+    GET  /health        {"status": "ok"} を返す
+
+usage:
+    python translation_server.py --src en --tgt ja --checkpoint_dir checkpoints --checkpoint_file checkpoint_last.pt \
+        --data data-bin --bpe_model bpe.model --port 8080
+"""
+
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from translation import Translation
+
+# レイテンシのヒストグラムの区切り(ミリ秒)
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+          500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Metrics():
+    def __init__(self, window=10000):
+        self.hist = [0] * (len(BUCKETS) + 1)
+        self.recent = deque(maxlen=window)
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batch_sents = 0
+        self.batch_tokens = 0
+
+    def observe(self, latency):
+        ms = latency * 1000
+        idx = next((i for i, b in enumerate(BUCKETS) if ms <= b), len(BUCKETS))
+        self.hist[idx] += 1
+        self.recent.append(ms)
+        self.requests += 1
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        lat = sorted(self.recent)
+        return lat[min(len(lat) - 1, int(q * len(lat)))]
+
+    def to_dict(self, queue_depth):
+        return {
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "queue_depth": queue_depth,
+            "batches": self.batches,
+            "mean_batch_sents": self.batch_sents / max(self.batches, 1),
+            "mean_batch_tokens": self.batch_tokens / max(self.batches, 1),
+            "latency_ms": {"p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99)},
+            "latency_histogram_ms": {("<={}".format(b) if i < len(BUCKETS) else ">{}".format(BUCKETS[-1])): n
+                                     for i, (b, n) in enumerate(zip(BUCKETS + [BUCKETS[-1]], self.hist))},
+        }
+
+
+class TranslationServer():
+    def __init__(self, model, beam, lenpen, max_batch_tokens=4000, max_delay=10, max_queue=1024):
+        """
+        model:              読み込み済みの Translation
+        max_batch_tokens:   一つのバッチに含めるトークン数(SentencePiece のピース数)の上限
+        max_delay:          最初のリクエストが届いてからバッチを翻訳するまでの最大の待ち時間(ミリ秒)
+        max_queue:          待ち行列に入れられるリクエスト数の上限
+        """
+        self.model = model
+        self.beam = beam
+        self.lenpen = lenpen
+        self.max_batch_tokens = max_batch_tokens
+        self.max_delay = max_delay / 1000
+        self.max_queue = max_queue
+        self.metrics = Metrics()
+        # モデルはスレッドセーフではないので、翻訳は一つのスレッドでのみ行う
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # 前処理(Moses/MeCab と SentencePiece)はイベントループを止めないように別のスレッドで行う
+        # (トークナイザーもスレッドセーフではないので一つのスレッドで行い、翻訳とは別のスレッドにして翻訳の待ちに巻き込まれないようにする)
+        self.preproc_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self, host, port):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.batch_loop())
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving on http://{}:{}".format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def submit(self, text):
+        """
+        前処理した文を待ち行列に入れ、翻訳が終わるまで待つ関数
+        """
+        loop = asyncio.get_running_loop()
+        src = await loop.run_in_executor(self.preproc_executor, self.model.preproc, text)
+        future = loop.create_future()
+        await self.queue.put((src, len(src.split()), future))
+        return await future
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        pending = None
+        while True:
+            # バッチの最初のリクエストが届くまで待つ
+            first = pending if pending is not None else await self.queue.get()
+            pending = None
+            batch, tokens = [first], first[1]
+            deadline = loop.time() + self.max_delay
+
+            while tokens < self.max_batch_tokens:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if tokens + item[1] > self.max_batch_tokens:
+                    # 上限を超える文は次のバッチの先頭に回す
+                    pending = item
+                    break
+                batch.append(item)
+                tokens += item[1]
+
+            # 待っている間に取り消された要求は翻訳しない
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            tokens = sum(item[1] for item in batch)
+            self.metrics.batches += 1
+            self.metrics.batch_sents += len(batch)
+            self.metrics.batch_tokens += tokens
+            try:
+                tgt_sents = await loop.run_in_executor(
+                    self.executor, self.model.generate, [src for src, _, _ in batch], self.beam, self.lenpen)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            # クライアントが切断して取り消された要求の future には結果を設定しない (InvalidStateError でこのタスクが止まるため)
+            for (_, _, future), tgt_sent in zip(batch, tgt_sents):
+                if not future.done():
+                    future.set_result(tgt_sent)
+
+    async def handle(self, reader, writer):
+        """
+        HTTP/1.1 のリクエストを一つずつ処理する関数 (Keep-Alive に対応)
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as e:
+                    # 前処理や翻訳での想定外のエラーは、接続を切らずに 500 として返す
+                    status, payload = 500, {"error": "{}: {}".format(type(e).__name__, e)}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\n\r\n".format(
+                    status, STATUS[status], len(data)).encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics.to_dict(self.queue.qsize())
+        if method != "POST" or path != "/translate":
+            return 404, {"error": "not found"}
+
+        try:
+            text = json.loads(body)["text"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "request body must be a JSON object with a \"text\" field"}
+        if not isinstance(text, str):
+            return 400, {"error": "\"text\" must be a string"}
+        if self.queue.qsize() >= self.max_queue:
+            self.metrics.rejected += 1
+            return 503, {"error": "queue is full"}
+
+        start = time.perf_counter()
+        translation = await self.submit(text)
+        self.metrics.observe(time.perf_counter() - start)
+        return 200, {"translation": translation}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--src', default='en')
+    parser.add_argument('--tgt', default='ja')
+    parser.add_argument('--checkpoint_dir', default='checkpoints')
+    parser.add_argument('--checkpoint_file', default='checkpoint_last.pt')
+    parser.add_argument('--data', default='data-bin')
+    parser.add_argument('--bpe_model', default='bpe.model')
+    parser.add_argument('--export_dir', default=None,
+                        help='directory written by export_model.py (used instead of the checkpoint)')
+    parser.add_argument('--shortlist', default=None)
+    parser.add_argument('--beam', type=int, default=3)
+    parser.add_argument('--lenpen', type=float, default=0.6)
+    parser.add_argument('--max_batch_tokens', type=int, default=4000)
+    parser.add_argument('--max_delay', type=float, default=10,
+                        help='maximum queueing delay of a batch in milliseconds')
+    parser.add_argument('--max_queue', type=int, default=1024)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    model = Translation(args.src, args.tgt)
+    if args.export_dir is not None:
+        model.load_export(args.export_dir, shortlist=args.shortlist)
+    else:
+        model.load(args.checkpoint_dir, args.checkpoint_file,
+                   args.data, args.bpe_model, shortlist=args.shortlist)
+    server = TranslationServer(model, args.beam, args.lenpen,
+                               args.max_batch_tokens, args.max_delay, args.max_queue)
+    asyncio.run(server.start(args.host, args.port))